@@ -0,0 +1,391 @@
+"""
+Benchmark suite for sensing, inference, physics and rendering, headless and deterministic
+(fixed seeds and map), checking that the fast paths give the same outputs as the reference ones.
+
+Results are written as JSON and can be compared against stored baseline:
+
+    python benchmark.py --output results.json --baseline baseline.json
+    python benchmark.py --save-baseline baseline.json
+"""
+
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import argparse
+from dataclasses import dataclass, field, asdict
+import json
+import math
+import platform
+import sys
+import time
+from typing import Callable
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.backends.backend_agg as agg
+import pygame
+
+from map import Map, RayCastResult, green_wall_mask
+from car import Car, CarController
+from fleet import Fleet
+from fuzzy_car_controller import FuzzyCarController
+from sensors import DEFAULT_SENSORS, FeatureExtractor, SensorArray, fan_features
+
+BENCHMARK_MAP = 'maps/1.png'
+BENCHMARK_MAP_SIZE = (1000, 900)
+BENCHMARK_CHARTS_SIZE = (600, 900)
+BENCHMARK_SEED = 0
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    unit: str # of the rate, like 'rays/s'
+    rate: float
+    calls: int
+    seconds: float
+    checks: dict[str, bool] = field(default_factory=dict) # fast path matches reference
+    details: dict[str, float] = field(default_factory=dict) # like max errors
+
+    @property
+    def passed(self):
+        return all(self.checks.values())
+
+def measure(function: Callable[[], object], items_per_call: int, min_time: float):
+    """Calls the function (after warm up call) until min time passes, returns items rate, calls and time."""
+    function()
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return items_per_call * calls / elapsed, calls, elapsed
+
+class BenchmarkContext:
+    """Fixed map and random (but seeded) samples of car states on the track, shared by benchmarks."""
+
+    def __init__(self, samples: int = 1000, seed: int = BENCHMARK_SEED):
+        pygame.init()
+        pygame.font.init()
+        self.screen = pygame.display.set_mode((BENCHMARK_MAP_SIZE[0] + BENCHMARK_CHARTS_SIZE[0], BENCHMARK_MAP_SIZE[1]))
+        self.map = Map(BENCHMARK_MAP, *BENCHMARK_MAP_SIZE, wall_mask_function=green_wall_mask)
+        rng = np.random.default_rng(seed)
+        free = np.argwhere(~self.map.wall_mask)
+        self.positions = free[rng.choice(free.shape[0], samples)] + rng.uniform(0, 1, (samples, 2))
+        self.angles = rng.uniform(-math.pi, math.pi, samples)
+        self.velocities = rng.uniform(0, Car.MAX_VELOCITY_FORWARD, samples)
+        self.controls = rng.uniform(-1, 1, (samples, 3)) # gas, brake, steer
+        self.sensors = [DEFAULT_SENSORS.sense(self.map, p, a)
+                        for p, a in zip(self.positions.tolist(), self.angles.tolist())]
+
+def controller_outputs(controller: FuzzyCarController, sensors_list: list[dict[str, RayCastResult]], velocities):
+    outputs = np.empty((len(sensors_list), 3))
+    for i, (sensors, velocity) in enumerate(zip(sensors_list, velocities)):
+        controller.car.velocity = velocity
+        controller.update_simulation(sensors)
+        outputs[i] = (controller.gas, controller.brake, controller.steer)
+    return outputs
+
+def benchmark_rays(context: BenchmarkContext, min_time: float):
+    map = context.map
+    positions, angles = context.positions.tolist(), context.angles.tolist()
+    reference = [map.cast_ray_to_wall(p, a) for p, a in zip(positions, angles)]
+    reference_distances = np.array([r.distance for r in reference])
+    reference_hits = np.array([r.hit for r in reference])
+    results = []
+
+    def cast_reference():
+        for p, a in zip(positions, angles):
+            map.cast_ray_to_wall(p, a)
+    results.append(BenchmarkResult('rays_reference', 'rays/s', *measure(cast_reference, len(angles), min_time)))
+
+    xs, ys = context.positions[:, 0], context.positions[:, 1]
+    def cast_stepped():
+        return map.cast_rays_arrays(xs, ys, context.angles)
+    distances, hits, _, _ = cast_stepped()
+    results.append(BenchmarkResult('rays_stepped', 'rays/s', *measure(cast_stepped, len(angles), min_time),
+                                   checks={'same_as_reference': bool((distances == reference_distances).all()
+                                                                     and (hits == reference_hits).all())}))
+
+    map.build_distance_field()
+    def cast_traced():
+        return map.trace_rays_arrays(xs, ys, context.angles)
+    distances, hits, _, _ = cast_traced()
+    matching = float(((distances == reference_distances) & (hits == reference_hits)).mean())
+    results.append(BenchmarkResult('rays_traced', 'rays/s', *measure(cast_traced, len(angles), min_time),
+                                   checks={'same_as_reference': matching >= 0.999}, # rare rounding on pixel edges
+                                   details={'matching_fraction': matching}))
+    map.distance_field = None
+
+    # Sensing with features extraction, for whole batch of cars and per car (like in the game)
+    count = 100
+    for sensor_array in (DEFAULT_SENSORS, SensorArray.fan(16), SensorArray.fan(64)):
+        features = FeatureExtractor(fan_features(sensor_array), sensor_array)
+        def sense_batch():
+            distances, _, _, _ = sensor_array.cast(map, xs, ys, context.angles)
+            return features.compute(distances)
+        def sense_single():
+            return [features.compute_sensors(sensor_array.sense(map, p, a))
+                    for p, a in zip(positions[:count], angles[:count])]
+        batch = sense_batch()[:count]
+        single = np.array([list(f.values()) for f in sense_single()])
+        single_result = BenchmarkResult(f'sensing_single_{len(sensor_array)}', 'cars/s',
+                                        *measure(sense_single, count, min_time))
+        batch_result = BenchmarkResult(f'sensing_batch_{len(sensor_array)}', 'cars/s',
+                                       *measure(sense_batch, len(angles), min_time),
+                                       checks={'same_as_single': bool(np.allclose(batch, single))})
+        speedup = batch_result.rate / single_result.rate
+        batch_result.checks['faster_than_single'] = speedup > 1
+        batch_result.details['speedup_over_single'] = speedup
+        results += [batch_result, single_result]
+    return results
+
+def benchmark_inference(context: BenchmarkContext, min_time: float):
+    results = []
+    count = 100 # exact one is slow
+    subset = context.sensors[:count], context.velocities[:count]
+    everything = context.sensors, context.velocities
+    exact = FuzzyCarController(Car((0, 0)))
+    exact.simulation.cache = False # measure computing, not cache hits on repeated inputs
+    reference = controller_outputs(exact, *subset)
+    results.append(BenchmarkResult('inference_exact', 'inferences/s',
+                                   *measure(lambda: controller_outputs(exact, *subset), count, min_time)))
+
+    native = FuzzyCarController(Car((0, 0)))
+    native.compile_inference_engine()
+    outputs = controller_outputs(native, *subset)
+    error = float(np.abs(outputs - reference).max())
+    results.append(BenchmarkResult('inference_native', 'inferences/s',
+                                   *measure(lambda: controller_outputs(native, *everything), len(context.sensors), min_time),
+                                   checks={'same_as_reference': error < 1e-9}, details={'max_error': error}))
+
+    engine = native.inference
+    inputs = np.array([[{'velocity': v, **native.features.compute_sensors(s)}[label] for label in engine.input_labels]
+                       for s, v in zip(context.sensors, context.velocities)])
+    batch = engine.compute_array(inputs)
+    single = np.array([[engine.compute(dict(zip(engine.input_labels, row)))[label] for label in engine.output_labels]
+                       for row in inputs[:count]])
+    error = float(np.abs(batch[:count] - single).max())
+    results.append(BenchmarkResult('inference_native_batch', 'inferences/s',
+                                   *measure(lambda: engine.compute_array(inputs), len(inputs), min_time),
+                                   checks={'same_as_single': error < 1e-9}, details={'max_error': error}))
+
+    table = FuzzyCarController(Car((0, 0)))
+    table.compile_lookup_table()
+    outputs = controller_outputs(table, *subset)
+    error = float(np.abs(outputs - reference).max())
+    results.append(BenchmarkResult('inference_table', 'inferences/s',
+                                   *measure(lambda: controller_outputs(table, *everything), len(context.sensors), min_time),
+                                   checks={'within_tolerance': error < 0.25}, # approximation
+                                   details={'max_error': error}))
+    return results
+
+def benchmark_physics(context: BenchmarkContext, min_time: float):
+    results = []
+    dt = 1 / 60
+    steps = 100
+    count = 100
+    controls = context.controls[:count]
+
+    def step_cars(update: bool):
+        cars = [Car(p, a) for p, a in zip(context.positions[:count].tolist(), context.angles[:count].tolist())]
+        controllers = [CarController(car) for car in cars]
+        for controller, (gas, brake, steer) in zip(controllers, controls.tolist()):
+            controller.gas, controller.brake, controller.steer = gas, brake, steer
+        for _ in range(steps):
+            for car, controller in zip(cars, controllers):
+                controller.update(dt=dt)
+                if update:
+                    car.update(dt=dt) # sprite API, images are looked up only when drawn
+                else:
+                    car.move(dt)
+        return np.array([(*car.position, car.angle, car.velocity) for car in cars])
+
+    results.append(BenchmarkResult('car_steps', 'car-steps/s',
+                                   *measure(lambda: step_cars(True), count * steps, min_time)))
+    reference = step_cars(False)
+    results.append(BenchmarkResult('car_steps_headless', 'car-steps/s',
+                                   *measure(lambda: step_cars(False), count * steps, min_time)))
+
+    def step_fleet(count: int):
+        fleet = Fleet(count, (0, 0))
+        fleet.positions = context.positions[:count].copy()
+        fleet.angles = context.angles[:count].copy()
+        fleet.gas, fleet.brake, fleet.steer = context.controls[:count].T.copy()
+        for _ in range(steps):
+            fleet.step(dt)
+        return np.column_stack((fleet.positions, fleet.angles, fleet.velocities))
+
+    same = bool((step_fleet(count) == reference).all())
+    results.append(BenchmarkResult('fleet_steps', 'car-steps/s',
+                                   *measure(lambda: step_fleet(len(context.positions)), len(context.positions) * steps, min_time),
+                                   checks={'same_as_reference': same}))
+    return results
+
+def benchmark_rendering(context: BenchmarkContext, min_time: float):
+    results = []
+    width, height = BENCHMARK_CHARTS_SIZE
+    states = list(zip(context.sensors[:60], context.velocities[:60]))
+    frame = 0
+
+    def next_state(controller: FuzzyCarController):
+        nonlocal frame
+        sensors, velocity = states[frame % len(states)]
+        frame += 1
+        controller.car.velocity = velocity
+        controller.update_simulation(sensors)
+
+    full = FuzzyCarController(Car((0, 0)))
+    def render_full():
+        next_state(full)
+        fig = full.visualize(width, height)
+        canvas = agg.FigureCanvasAgg(fig)
+        buffer, size = canvas.print_to_buffer()
+        context.screen.blit(pygame.image.frombuffer(buffer, size, 'RGBA'), (context.map.width, 0))
+        return np.frombuffer(buffer, np.uint8).reshape(size[1], size[0], 4)
+    results.append(BenchmarkResult('visualizer_view', 'frames/s', *measure(render_full, 1, min_time)))
+
+    blitted = FuzzyCarController(Car((0, 0)))
+    surface = None
+    def render_blit():
+        nonlocal surface
+        next_state(blitted)
+        buffer, size = blitted.visualize_blit(width, height)
+        if surface is None:
+            surface = pygame.image.frombuffer(buffer, size, 'RGBA')
+        context.screen.blit(surface, (context.map.width, 0))
+        return np.asarray(buffer)
+    frame = 0
+    reference = render_full().astype(int)
+    frame = 0
+    differing = float((np.abs(render_blit().astype(int) - reference).max(axis=-1) > 40).mean())
+    results.append(BenchmarkResult('visualizer_blit', 'frames/s', *measure(render_blit, 1, min_time),
+                                   checks={'same_as_reference': differing < 0.01}, # antialiasing of the cut edges
+                                   details={'differing_pixels_fraction': differing}))
+
+    charts = FuzzyCarController(Car((0, 0)))
+    def render_charts():
+        next_state(charts)
+        context.screen.blit(charts.visualize_charts(width, height), (context.map.width, 0))
+    results.append(BenchmarkResult('pygame_charts', 'frames/s', *measure(render_charts, 1, min_time)))
+
+    # Drawing only (all the charts changing each frame), for cuts and crisp values recorded above
+    from fuzzy_charts import FuzzyCharts
+    recorded = []
+    for _ in states:
+        render_charts()
+        recorded.append([chart.last_state for chart in charts.charts.charts])
+    drawn = FuzzyCharts(width, height, charts.visualization_layout())
+    def draw_charts():
+        nonlocal frame
+        for chart, (cuts, crisp_value) in zip(drawn.charts, recorded[frame % len(recorded)]):
+            chart.draw(drawn.surface, dict(cuts), crisp_value)
+        frame += 1
+    frame = 1
+    draw_charts() # other state first, so the next one is drawn over it
+    frame = 0
+    draw_charts()
+    incremental = pygame.surfarray.array3d(drawn.surface)
+    redrawn = FuzzyCharts(width, height, charts.visualization_layout())
+    for chart, (cuts, crisp_value) in zip(redrawn.charts, recorded[0]):
+        chart.draw(redrawn.surface, dict(cuts), crisp_value)
+    same = bool((incremental == pygame.surfarray.array3d(redrawn.surface)).all())
+    results.append(BenchmarkResult('pygame_charts_draw', 'frames/s', *measure(draw_charts, 1, min_time),
+                                   checks={'same_as_full_redraw': same}))
+
+    fig = full.visualize(width, height)
+    canvas = agg.FigureCanvasAgg(fig)
+    canvas.draw()
+    def agg_to_pygame():
+        buffer, size = canvas.print_to_buffer()
+        context.screen.blit(pygame.image.frombuffer(buffer, size, 'RGBA'), (context.map.width, 0))
+    results.append(BenchmarkResult('agg_to_pygame_blit', 'frames/s', *measure(agg_to_pygame, 1, min_time)))
+
+    # Drawing many cars, with the shared pre-rotated sprites and rotating each one
+    cars = [Car(p, a) for p, a in zip(context.positions[:100].tolist(), context.angles[:100].tolist())]
+    def draw_cars():
+        for car in cars:
+            context.screen.blit(car.image, car.rect)
+    results.append(BenchmarkResult('car_sprites', 'cars/s', *measure(draw_cars, len(cars), min_time)))
+    def draw_cars_rotated():
+        for car in cars:
+            image = pygame.transform.rotate(car.base_image, math.degrees(car.angle) - 90)
+            context.screen.blit(image, image.get_rect(center=car.position))
+    results.append(BenchmarkResult('car_sprites_rotated', 'cars/s', *measure(draw_cars_rotated, len(cars), min_time)))
+
+    results.append(BenchmarkResult('map_blit', 'frames/s',
+                                   *measure(lambda: context.screen.blit(context.map.surface, (0, 0)), 1, min_time)))
+    plt.close('all')
+    return results
+
+BENCHMARKS = {
+    'rays': benchmark_rays,
+    'inference': benchmark_inference,
+    'physics': benchmark_physics,
+    'rendering': benchmark_rendering,
+}
+
+def run(groups: list[str] | None = None, min_time: float = 1.) -> list[BenchmarkResult]:
+    context = BenchmarkContext()
+    results = []
+    for name, benchmark in BENCHMARKS.items():
+        if groups is None or name in groups:
+            results.extend(benchmark(context, min_time))
+    return results
+
+def compare(results: list[BenchmarkResult], baseline: dict, tolerance: float):
+    """Returns ratios of rates against the baseline, and names of benchmarks slower by more than tolerance."""
+    baseline_rates = {b['name']: b['rate'] for b in baseline['results']}
+    ratios = {r.name: r.rate / baseline_rates[r.name] for r in results if baseline_rates.get(r.name)}
+    regressions = [name for name, ratio in ratios.items() if ratio < 1 - tolerance]
+    return ratios, regressions
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Runs benchmarks, checking fast paths against reference ones.')
+    parser.add_argument('groups', nargs='*', metavar='GROUP',
+                        help=f'benchmarks groups to run: {", ".join(BENCHMARKS.keys())} (all by default)')
+    parser.add_argument('--min-time', type=float, default=1., help='seconds to run each benchmark for')
+    parser.add_argument('--output', help='path to write results JSON to')
+    parser.add_argument('--baseline', help='path of baseline results JSON to compare with')
+    parser.add_argument('--save-baseline', help='path to write results JSON as new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown against baseline')
+    args = parser.parse_args(argv)
+    unknown = [g for g in args.groups if g not in BENCHMARKS]
+    if unknown:
+        parser.error(f'unknown benchmarks groups: {", ".join(unknown)}')
+
+    results = run(args.groups or None, args.min_time)
+    report = {
+        'machine': {'platform': platform.platform(), 'processor': platform.processor(),
+                    'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'min_time': args.min_time,
+        'results': [asdict(r) for r in results],
+    }
+
+    ratios, regressions = {}, []
+    if args.baseline:
+        with open(args.baseline) as file:
+            ratios, regressions = compare(results, json.load(file), args.tolerance)
+        report['baseline'] = {'path': args.baseline, 'ratios': ratios, 'regressions': regressions}
+
+    for r in results:
+        ratio = f'{ratios[r.name]:>6.2f}x' if r.name in ratios else ''
+        checks = ', '.join(f'{k}: {"ok" if v else "FAILED"}' for k, v in r.checks.items())
+        print(f'{r.name:<24}{r.rate:>14,.1f} {r.unit:<14}{ratio:>8}  {checks}')
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as file:
+                json.dump(report, file, indent=4)
+
+    failed = [r.name for r in results if not r.passed]
+    if failed:
+        print('Failed checks: ' + ', '.join(failed))
+    if regressions:
+        print('Regressions: ' + ', '.join(regressions))
+    return 1 if failed or regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
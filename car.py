@@ -1,9 +1,37 @@
 import pygame
 import math
 
-from map import Coordinate
+from map import Coordinate, RayCastResult
 
-car_image = pygame.transform.scale(pygame.image.load('car.png'), (33, 22))
+_car_image: pygame.Surface | None = None
+
+def get_car_image():
+    """Car sprite image, loaded on first use (so headless simulations never load it)."""
+    global _car_image
+    if _car_image is None:
+        _car_image = pygame.transform.scale(pygame.image.load('car.png'), (33, 22))
+    return _car_image
+
+class RotatedSprites:
+    """Copies of image pre-rotated at fixed angular resolution, so drawing rotated sprites allocates nothing."""
+    def __init__(self, image: pygame.Surface, steps: int = 360):
+        if pygame.display.get_surface() is not None:
+            image = image.convert_alpha() # display format blits faster
+        self.steps = steps
+        self.images = [pygame.transform.rotate(image, i * 360 / steps) for i in range(steps)]
+
+    def rotated(self, degrees: float) -> pygame.Surface:
+        """Image rotated counterclockwise by the angle, rounded to the resolution."""
+        return self.images[round(degrees * self.steps / 360) % self.steps]
+
+_car_sprites: dict[int, RotatedSprites] = {}
+
+def get_car_sprites(steps: int = 360):
+    """Pre-rotated car sprites at given resolution (steps per turn), built on first use and shared by all cars."""
+    sprites = _car_sprites.get(steps)
+    if sprites is None:
+        sprites = _car_sprites[steps] = RotatedSprites(get_car_image(), steps)
+    return sprites
 
 class Car(pygame.sprite.Sprite):
     MAX_VELOCITY_FORWARD = 200
@@ -13,23 +41,45 @@ class Car(pygame.sprite.Sprite):
     BRAKING_FACTOR = 100
     IDLE_DECAY_FACTOR = 5
     STEER_DECAY_FACTOR = 5
+    ROTATION_STEPS = 360 # of pre-rotated sprites per turn, shared by all cars (see `get_car_sprites`)
 
     def __init__(self, position: Coordinate, angle: float = 0):
         super().__init__()
-        self.base_image = car_image
         self.position = list(position)
         self.velocity: float = 0
         self.angle = angle # radians
+        self.image_position: Coordinate | None = None # pose the sprite is drawn at, current one if none
+        self.image_angle: float | None = None
+
+    @property
+    def base_image(self):
+        return get_car_image()
+
+    @property
+    def image(self) -> pygame.Surface:
+        """Sprite for the drawn pose, looked up only when drawn."""
+        angle = self.angle if self.image_angle is None else self.image_angle
+        return get_car_sprites(Car.ROTATION_STEPS).rotated(math.degrees(angle) - 90)
+
+    @property
+    def rect(self) -> pygame.Rect:
+        return self.image.get_rect(center=self.position if self.image_position is None else self.image_position)
 
     def update(self, dt: float):
+        self.move(dt)
+        self.update_image()
+
+    def move(self, dt: float):
         # speed decay
         self.brake(dt * Car.IDLE_DECAY_FACTOR)
 
         self.position[0] += self.velocity * math.sin(self.angle) * dt
         self.position[1] += self.velocity * math.cos(self.angle) * dt
 
-        self.image = pygame.transform.rotate(self.base_image, math.degrees(self.angle) - 90)
-        self.rect = self.image.get_rect(center=self.position)
+    def update_image(self, position: Coordinate | None = None, angle: float | None = None):
+        """Sets pose the sprite is drawn at: current one, or given one (like interpolated between physics steps)."""
+        self.image_position = position
+        self.image_angle = angle
 
     def accelerate(self, value: float):
         self.velocity += value
@@ -47,6 +97,10 @@ class CarController():
         self.brake: float = 0
         self.gas: float = 0
         self.steer: float = 0
+        self.failed = False # whether the last simulation update fell back to default controls
+
+    def update_simulation(self, sensors: dict[str, RayCastResult]):
+        pass # for controllers using sensors, called before `update`
 
     def update(self, dt: float, *args, **kwargs):
         self.brake = max(0, min(1, self.brake))
@@ -0,0 +1,141 @@
+"""
+Charts rendering in background process, so the game loop never waits for it.
+
+The loop hands snapshots of the controller inputs to the worker, which recomputes the
+memberships with its own copy of the rule base and renders the charts (with matplotlib
+or pygame) into shared double buffer. The loop blits the latest completed frame only,
+at most one snapshot is in flight and snapshots are handed at limited rate.
+"""
+
+import logging
+import multiprocessing
+import os
+from multiprocessing.connection import Connection
+import time
+from typing import Any
+import numpy as np
+import pygame
+
+from fuzzy_car_controller import FuzzyCarController
+
+CHARTS_WORKER_MODES = ('blit', 'full', 'pygame') # like charts modes of the game, without pygame matplotlib backend
+CHARTS_WORKER_NICENESS = 10 # lower priority, so the worker yields to the game even on single core
+
+logger = logging.getLogger(__name__)
+
+def _render(controller: FuzzyCarController, mode: str, width: int, height: int) -> np.ndarray:
+    """Renders charts for the current state of controller simulation, returns RGBA array of shape (H, W, 4)."""
+    if mode == 'pygame':
+        surface = controller.visualize_charts(width, height)
+        return np.frombuffer(pygame.image.tobytes(surface, 'RGBA'), np.uint8).reshape(height, width, 4)
+    if mode == 'blit':
+        buffer, (w, h) = controller.visualize_blit(width, height)
+    else:
+        import matplotlib.backends.backend_agg as agg
+        buffer, (w, h) = agg.FigureCanvasAgg(controller.visualize(width, height)).print_to_buffer()
+    return np.frombuffer(buffer, np.uint8).reshape(h, w, 4)
+
+def _run_worker(connection: Connection, frames_buffer, processed, latest,
+                rule_base: dict[str, Any], mode: str, width: int, height: int):
+    if hasattr(os, 'nice'):
+        os.nice(CHARTS_WORKER_NICENESS)
+    import matplotlib
+    matplotlib.use('Agg')
+    if mode == 'pygame':
+        pygame.font.init()
+    from car import Car
+
+    controller = FuzzyCarController(Car((0, 0)), **rule_base)
+    frames = np.frombuffer(frames_buffer, np.uint8).reshape(2, height, width, 4)
+    failing = False # rendering errors are logged once per streak
+    while (inputs := connection.recv()) is not None:
+        try:
+            controller.compute_simulation(inputs)
+            rgba = _render(controller, mode, width, height)
+            slot = (latest.value + 1) % 2 # never the one the game may blit
+            frames[slot, :rgba.shape[0], :rgba.shape[1]] = rgba[:height, :width]
+            latest.value = slot
+        except ValueError:
+            pass # no active rules to show, previous frame stays
+        except Exception:
+            if not failing:
+                logger.exception('Charts rendering failed, previous frame stays until it succeeds')
+            failing = True
+        else:
+            failing = False
+        processed.value += 1 # even if failed, so the game keeps handing snapshots
+
+class ChartsWorker:
+    def __init__(self, controller: FuzzyCarController, width: int, height: int,
+                 mode: str = 'blit', refresh_rate: float = 10.):
+        """
+        Parameters
+        ----------
+        controller : controller which rule base is visualized (rebuilt in the worker)
+        width, height : of the charts
+        mode : rendering of the charts, see `CHARTS_WORKER_MODES`
+        refresh_rate : maximal count of snapshots handed to the worker per second
+        """
+        if mode not in CHARTS_WORKER_MODES:
+            raise ValueError(f"Unknown charts mode '{mode}'.")
+        self.width = width
+        self.height = height
+        self.interval = 1 / refresh_rate
+        # Forking needs no reimporting in the worker (nor running `__main__` again, like the game script),
+        # so it has to be started before the process has any threads (or the display), see `game.py`
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+        self.frames_buffer = context.RawArray('B', 2 * height * width * 4)
+        self.processed = context.RawValue('q', 0) # snapshots handled by the worker, rendered or not
+        self.latest = context.RawValue('b', 1) # slot of the latest rendered frame
+        self.connection, worker_connection = context.Pipe()
+        self.process = context.Process(target=_run_worker, name='charts', daemon=True,
+                                       args=(worker_connection, self.frames_buffer, self.processed, self.latest,
+                                             controller.rule_base_arguments, mode, width, height))
+        self.process.start()
+        worker_connection.close()
+
+        frames = np.frombuffer(self.frames_buffer, np.uint8).reshape(2, height, width, 4)
+        # Charts are opaque, so alpha is ignored, blitting much faster than with per-pixel alpha
+        self.surfaces = [pygame.image.frombuffer(frames[slot], (width, height), 'RGBX') for slot in range(2)]
+        self.requested = 0
+        self.shown = 0 # processed count when the latest frame was taken
+        self.request_time = -self.interval
+
+    def submit(self, inputs: dict[str, float]) -> bool:
+        """
+        Hands the inputs snapshot to the worker, unless it is still busy with previous one
+        or the last one was handed too recently. Never waits, returns whether handed.
+        """
+        now = time.perf_counter()
+        if not inputs or self.processed.value < self.requested or now - self.request_time < self.interval:
+            return False
+        try:
+            self.connection.send(dict(inputs))
+        except OSError:
+            return False # worker died, see `alive`
+        self.requested += 1
+        self.request_time = now
+        return True
+
+    @property
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def latest_frame(self) -> pygame.Surface | None:
+        """Surface of the latest completed frame, or none if there is no new one since the last call."""
+        processed = self.processed.value
+        if processed == self.shown:
+            return None
+        self.shown = processed
+        return self.surfaces[self.latest.value]
+
+    def close(self):
+        if self.process.is_alive():
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+            self.process.join(timeout=1)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.connection.close()
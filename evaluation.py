@@ -0,0 +1,114 @@
+"""
+Parallel evaluation of fuzzy controller candidates (parameters and rule sets)
+in headless episodes, spread across processes. The map is loaded once per worker.
+Candidates differing in parameters only can be evaluated together in single process
+instead, as vectorized population (see `population.py`).
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+from typing import Any, Sequence
+
+import numpy as np
+
+from map import Map, green_wall_mask
+from car import Car
+from fuzzy_car_controller import FuzzyCarController
+from simulation import Simulation, SimulationResult
+from sensors import DEFAULT_SENSORS
+
+# Candidate is dictionary of `FuzzyCarController` keyword arguments, like `parameters`, `rules` or `sensor_array`.
+# These have to be picklable, so rules have to be module level functions.
+Candidate = dict[str, Any]
+
+_worker_map: Map | None = None
+
+def load_map(path: str = 'maps/1.png', max_width: int = 1000, max_height: int = 900, distance_field: bool = False):
+    return Map(path, max_width, max_height, wall_mask_function=green_wall_mask, use_distance_field=distance_field)
+
+def _init_worker(map_path: str, max_width: int, max_height: int):
+    global _worker_map
+    _worker_map = load_map(map_path, max_width, max_height)
+
+def score(result: SimulationResult) -> float:
+    """Track score (gates passed, see `LapTimer.scores`) or distance travelled if map has no track."""
+    return result.track_score if result.track_score is not None else result.distance
+
+def evaluate_candidate(map: Map, candidate: Candidate, duration: float = 60, dt: float = 1 / 60):
+    """Runs single headless episode for the candidate, using native inference engine."""
+    def controller_factory(car: Car):
+        controller = FuzzyCarController(car, **candidate)
+        controller.compile_inference_engine()
+        return controller
+    return Simulation(map, controller_factory, dt, candidate.get('sensor_array', DEFAULT_SENSORS)).run(duration)
+
+def _evaluate_in_worker(args: tuple[Candidate, float, float]):
+    candidate, duration, dt = args
+    return score(evaluate_candidate(_worker_map, candidate, duration, dt))
+
+def random_candidates(count: int, seed: int = 0, deviation: float = 10) -> list[Candidate]:
+    """Default candidate followed by random perturbations of the default input breakpoints."""
+    rng = np.random.default_rng(seed)
+    candidates = [{}]
+    for _ in range(count - 1):
+        parameters = {}
+        for label in ('velocity', 'balance', 'side', 'head'):
+            parameters[label] = {term: sorted(np.add(values, rng.normal(0, deviation, len(values))).tolist())
+                                 for term, values in FuzzyCarController.DEFAULT_PARAMETERS[label].items()}
+        candidates.append({'parameters': parameters})
+    return candidates
+
+def evaluate(candidates: Sequence[Candidate],
+             map_path: str = 'maps/1.png',
+             max_width: int = 1000,
+             max_height: int = 900,
+             duration: float = 60,
+             dt: float = 1 / 60,
+             workers: int | None = None) -> list[float]:
+    """
+    Evaluates candidates in parallel across worker processes (all CPUs by default),
+    returns their scores in the same order.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(candidates) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_worker,
+                             initargs=(map_path, max_width, max_height)) as executor:
+        return list(executor.map(_evaluate_in_worker,
+                                 [(candidate, duration, dt) for candidate in candidates],
+                                 chunksize=chunksize))
+
+def evaluate_population(candidates: Sequence[Candidate],
+                        map_path: str = 'maps/1.png',
+                        max_width: int = 1000,
+                        max_height: int = 900,
+                        duration: float = 60,
+                        dt: float = 1 / 60,
+                        distance_field: bool = False) -> list[float]:
+    """
+    Evaluates candidates together as vectorized population, in the current process,
+    returns their scores in the same order (the same as of `evaluate`, unless rays are
+    traced using distance field). Candidates have to differ in parameters only.
+    """
+    from population import FuzzyPopulation, PopulationSimulation
+    shared = {key: value for key, value in candidates[0].items() if key != 'parameters'}
+    for i, candidate in enumerate(candidates):
+        if {key: value for key, value in candidate.items() if key != 'parameters'} != shared:
+            raise ValueError(f'Candidate #{i} differs from the first one in other than parameters.')
+    population = FuzzyPopulation([candidate.get('parameters') for candidate in candidates], **shared)
+    map = load_map(map_path, max_width, max_height, distance_field)
+    return PopulationSimulation(map, population, dt).run(duration).scores.tolist()
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    candidates = random_candidates(count)
+    start = time.perf_counter()
+    scores = evaluate(candidates, duration=30, workers=workers)
+    wall_time = time.perf_counter() - start
+    print(f'Evaluated {count} candidates in {wall_time:.2f} s, '
+          f'default score {scores[0]:.3f}, best score {max(scores):.3f} (#{int(np.argmax(scores))})')
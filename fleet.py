@@ -0,0 +1,120 @@
+"""
+Structure-of-arrays representation of many cars, stepped together in batch.
+
+The physics and control rules are the same as in `Car` and `CarController`.
+"""
+
+import math
+import numpy as np
+import pygame
+
+from map import Coordinate, Map
+from car import Car, get_car_sprites
+from sensors import SensorArray
+
+def _brake(velocities: np.ndarray, values: np.ndarray | float):
+    """Vectorized `Car.brake`: slows down towards zero, never past it."""
+    return np.copysign(np.maximum(0, np.abs(velocities) - values), velocities)
+
+class Fleet:
+    def __init__(self, count: int, position: Coordinate, angle: float = 0):
+        self.positions = np.tile(np.asarray(position, dtype=np.float64), (count, 1)) # shape (N, 2)
+        self.angles = np.full(count, angle, dtype=np.float64) # radians
+        self.velocities = np.zeros(count)
+        self.gas = np.zeros(count)
+        self.brake = np.zeros(count)
+        self.steer = np.zeros(count)
+        self.active = np.ones(count, dtype=bool) # inactive cars are frozen
+
+    def __len__(self):
+        return self.angles.size
+
+    def sense(self, map: Map, sensor_array: SensorArray):
+        """Casts rays of the sensors array from all the cars, returns distances of shape (N, sensors)."""
+        distances, _, _, _ = sensor_array.cast(map, self.positions[:, 0], self.positions[:, 1], self.angles)
+        return distances
+
+    def crashed(self, map: Map):
+        """Whether the cars centers are on the wall or out of the map."""
+        x, y = self.positions.T
+        inside = (0 <= x) & (x < map.width) & (0 <= y) & (y < map.height)
+        xi = np.where(inside, x, 0).astype(np.intp)
+        yi = np.where(inside, y, 0).astype(np.intp)
+        return ~inside | map.wall_mask[xi, yi]
+
+    def step(self, dt: float):
+        """Applies controls (like `CarController.update`) and moves (like `Car.move`) all active cars."""
+        self.brake = np.clip(self.brake, 0, 1)
+        self.gas = np.clip(self.gas, -1, 1)
+        self.steer = np.clip(self.steer, -1, 1)
+        v = self.velocities
+
+        forward = np.minimum(v + dt * Car.ACCELERATION_FACTOR_FORWARD * (1.1 - v / Car.MAX_VELOCITY_FORWARD),
+                             Car.MAX_VELOCITY_FORWARD)
+        backward = np.maximum(-Car.MAX_VELOCITY_BACKWARD,
+                              v + -dt * Car.ACCELERATION_FACTOR_BACKWARD * (1.1 - v / Car.MAX_VELOCITY_BACKWARD))
+        braking = _brake(v, dt * Car.BRAKING_FACTOR)
+        v = np.select([(self.gas > 0) & (v < 0), self.gas > 0, (self.gas < 0) & (v > 0), self.gas < 0],
+                      [braking, forward, braking, backward], v)
+
+        v = np.where(self.brake > 0, _brake(v, dt * Car.BRAKING_FACTOR * self.brake), v)
+
+        steering = self.steer != 0
+        angles = np.where(steering, self.angles + math.radians(dt * 100) * self.steer, self.angles)
+        v = np.where(steering, _brake(v, dt * Car.STEER_DECAY_FACTOR), v)
+
+        # speed decay
+        v = _brake(v, dt * Car.IDLE_DECAY_FACTOR)
+
+        positions = np.empty_like(self.positions)
+        positions[:, 0] = self.positions[:, 0] + v * np.sin(angles) * dt
+        positions[:, 1] = self.positions[:, 1] + v * np.cos(angles) * dt
+
+        active = self.active
+        self.velocities = np.where(active, v, self.velocities)
+        self.angles = np.where(active, angles, self.angles)
+        self.positions = np.where(active[:, None], positions, self.positions)
+
+    def draw(self, surface: pygame.Surface, indices=None):
+        """Draws selected cars (all by default), with the shared pre-rotated sprites."""
+        if indices is None:
+            indices = range(len(self))
+        sprites = get_car_sprites(Car.ROTATION_STEPS)
+        for i in indices:
+            image = sprites.rotated(math.degrees(self.angles[i]) - 90)
+            surface.blit(image, image.get_rect(center=tuple(self.positions[i])))
+
+if __name__ == '__main__':
+    import sys
+    import time
+    from map import green_wall_mask
+    from car import Car
+    from fuzzy_car_controller import FuzzyCarController
+    from sensors import DEFAULT_SENSORS
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    sensors_count = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    duration = 10
+    dt = 1 / 60
+    map = Map('maps/1.png', 1000, 900, wall_mask_function=green_wall_mask, use_distance_field=True)
+    sensor_array = SensorArray.fan(sensors_count) if sensors_count else DEFAULT_SENSORS
+    controller = FuzzyCarController(Car((0, 0)), sensor_array=sensor_array)
+    engine = controller.compile_inference_engine()
+    features = controller.features
+    fleet = Fleet(count, map.starting_position, map.starting_angle)
+    fleet.angles += np.random.default_rng(0).normal(0, 0.05, count)
+    columns = [(['velocity'] + features.names).index(label) for label in engine.input_labels]
+
+    start = time.perf_counter()
+    for _ in range(int(duration / dt)):
+        inputs = np.column_stack([fleet.velocities, features.compute(fleet.sense(map, sensor_array))])
+        outputs = dict(zip(engine.output_labels, engine.compute_array(inputs[:, columns]).T))
+        # NaN where no rules are active, keeping previous controls then (like `FuzzyCarController` by default)
+        fleet.gas = np.where(np.isnan(outputs['gas']), fleet.gas, np.maximum(0, outputs['gas']))
+        fleet.brake = np.where(np.isnan(outputs['brake']), fleet.brake, outputs['brake'])
+        fleet.steer = np.where(np.isnan(outputs['steer']), fleet.steer, outputs['steer'])
+        fleet.step(dt)
+        fleet.active &= ~fleet.crashed(map)
+    wall_time = time.perf_counter() - start
+    print(f'Simulated {count} cars for {duration} s in {wall_time:.2f} s '
+          f'({count * duration / wall_time:.0f} car-seconds per second) with {len(sensor_array)} sensors, crashed: {(~fleet.active).sum()}')
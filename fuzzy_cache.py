@@ -0,0 +1,89 @@
+"""
+Memoizing cache of fuzzy inference outputs, keyed by inputs quantized to given resolution.
+
+Consecutive ticks often give nearly the same inputs (like on straight sections at steady speed),
+so instead of computing them again, outputs computed for the same quantized inputs are reused.
+Outputs are always computed for the quantized inputs (not the first ones which fell into
+the bucket), so the results don't depend on history and the inference stays the source of truth.
+"""
+
+from collections import OrderedDict
+import math
+from typing import Callable, Hashable
+
+Outputs = dict[str, float]
+
+class FuzzyInferenceCache:
+    def __init__(self, max_size: int = 4096, resolution: float | dict[str, float] = 1.):
+        """
+        Parameters
+        ----------
+        max_size : maximal count of entries, least recently used ones are evicted
+        resolution : quantization step, the same for all inputs or per input label
+            (default of 1 is the universe step of all `FuzzyCarController` inputs)
+        """
+        if max_size < 1:
+            raise ValueError('Cache size must be at least 1.')
+        self.max_size = max_size
+        self.resolution = resolution
+        self.entries: OrderedDict[tuple, Outputs] = OrderedDict()
+        self.rule_base: Hashable | None = None # of the controllers sharing the cache
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def bind(self, rule_base: Hashable):
+        """Attaches the cache to the rule base, so only controllers with the same one can share it."""
+        if self.rule_base is None:
+            self.rule_base = rule_base
+        elif self.rule_base != rule_base:
+            raise ValueError('Inference cache can be shared only by controllers with the same rule base.')
+
+    def _step(self, label: str):
+        return self.resolution if not isinstance(self.resolution, dict) else self.resolution.get(label, 1.)
+
+    def quantize(self, inputs: dict[str, float]) -> tuple[tuple, dict[str, float]]:
+        """Key for the inputs and the quantized inputs themselves (bucket centers)."""
+        key = []
+        quantized = {}
+        for label, value in inputs.items():
+            step = self._step(label)
+            index = math.floor(value / step + 0.5)
+            key.append(index)
+            quantized[label] = index * step
+        return tuple(key), quantized
+
+    def lookup(self, inputs: dict[str, float], compute: Callable[[dict[str, float]], Outputs]):
+        """
+        Returns outputs for the quantized inputs, computing them only if not cached,
+        and the quantized inputs. Failed computations (exceptions) are not cached.
+        """
+        key, quantized = self.quantize(inputs)
+        outputs = self.entries.get(key)
+        if outputs is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return outputs, quantized
+        self.misses += 1
+        outputs = compute(quantized)
+        self.entries[key] = outputs
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return outputs, quantized
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+    def stats(self):
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hit_rate}
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
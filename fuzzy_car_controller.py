@@ -1,126 +1,376 @@
+import logging
+import math
 import time
+from typing import TYPE_CHECKING, Callable
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
 import skfuzzy
+from skfuzzy_lazy import defer_skfuzzy_visualization
+defer_skfuzzy_visualization() # `skfuzzy.control` would import `matplotlib.pyplot` (see `skfuzzy_lazy.py`)
 import skfuzzy.control
 
 from map import RayCastResult
 from car import Car, CarController
-from visualization import MyFuzzyVariableVisualizer
+from fuzzy_inference import FuzzyInferenceEngine
+from fuzzy_lookup_table import FuzzyLookupTable
+from fuzzy_cache import FuzzyInferenceCache
+from sensors import DEFAULT_SENSORS, Feature, FeatureExtractor, SensorArray, default_features
+
+if TYPE_CHECKING: # plotting modules are imported only when visualization is requested
+    from visualization import FigureBlitter
+    from fuzzy_charts import ChartLayout, FuzzyCharts
+
+FUZZY_INFERENCE_MODES = ('exact', 'table', 'native') # `skfuzzy`, lookup table, native engine
+OUTPUT_LABELS = ('gas', 'brake', 'steer')
+
+logger = logging.getLogger(__name__)
+
+FuzzyRules = Callable[[list[skfuzzy.control.Antecedent], list[skfuzzy.control.Consequent]],
+                      list[skfuzzy.control.Rule]]
+
+def default_rules(inputs: list[skfuzzy.control.Antecedent], outputs: list[skfuzzy.control.Consequent]):
+    c = skfuzzy.control
+    velocity, balance, side, head = inputs
+    gas, brake, steer = outputs
+
+    return [
+        c.Rule(balance['LEFT'], steer['RIGHT']),
+        c.Rule(balance['RIGHT'], steer['LEFT']),
+        c.Rule(balance['CENTER'] & side['CENTER'], steer['NONE'] % 0.1),
+
+        c.Rule(side['LEFT'], steer['RIGHT']),
+        c.Rule(side['RIGHT'], steer['LEFT']),
+
+        c.Rule(head['CLOSE'], (brake['HARD'], gas['NONE'])),
+        c.Rule(head['AWAY'] & balance['CENTER'], (brake['NONE'], gas['HARD'])),
+        c.Rule(head['AWAY'] & ~balance['CENTER'], (brake['NONE'], gas['SOFT'])),
+
+        c.Rule(velocity['SLOW'], gas['SOFT']),
+    ]
+
+def share_inference_caches(controllers: list['FuzzyCarController'], max_size: int = 4096,
+                           resolution: float | dict[str, float] = 1.):
+    """
+    Sets up inference caches for the controllers (after their inference is set up),
+    single one shared by all the controllers with the same rule base. Returns the caches.
+    """
+    caches: dict[tuple, FuzzyInferenceCache] = {}
+    for controller in controllers:
+        key = (*controller.rule_base_key, type(controller.inference).__name__)
+        controller.cache = caches.setdefault(key, FuzzyInferenceCache(max_size, resolution))
+    return list(caches.values())
 
 class FuzzyCarController(CarController):
-    def __init__(self, car: Car):
+    # Membership functions parameters for each term of each variable:
+    # trapezoid breakpoints for inputs, sigmoid center & width (or gaussian mean & sigma) for outputs.
+    DEFAULT_PARAMETERS = {
+        'velocity': {
+            'SLOW':     [0,    0,   0, 75],
+            'MEDIUM':   [50, 100, 100, 150],
+            'FAST':     [75, 200, 200, 200],
+        },
+        'balance': {
+            'LEFT':     [-200, -200, -200, 0],
+            'CENTER':   [-50, 0, 0, 50],
+            'RIGHT':    [0, 200, 200, 200],
+        },
+        'side': {
+            'LEFT':     [-100, -100, -100, 0],
+            'CENTER':   [-25, 0, 0, 25],
+            'RIGHT':    [0, 100, 100, 100],
+        },
+        'head': {
+            'CLOSE':    [ 0,  0,  25, 125],
+            'AWAY':     [75, 200, 200, 200],
+        },
+        'gas': {
+            'NONE':     [0.05, -40],
+            'SOFT':     [0.33, -10],
+            'HARD':     [0.75, 20],
+        },
+        'brake': {
+            'NONE':     [0.05, -40],
+            'SOFT':     [0.33, -10],
+            'HARD':     [0.75, 20],
+        },
+        'steer': {
+            'RIGHT':    [-0.5, -10],
+            'NONE':     [0, 0.10],
+            'LEFT':     [0.5, 10],
+        },
+    }
+
+    # Membership functions of the terms, taking their parameters: by variable, or by variable and term;
+    # trapezoids (`skfuzzy.trapmf`) for other ones (the inputs)
+    MEMBERSHIP_FUNCTIONS = {
+        'gas': skfuzzy.sigmf,
+        'brake': skfuzzy.sigmf,
+        'steer': skfuzzy.sigmf,
+        ('steer', 'NONE'): skfuzzy.gaussmf,
+    }
+    OUTPUT_UNIVERSES = {
+        'gas':   np.arange(0 - 0.25, 1 + 0.02 + 0.25, 0.02),
+        'brake': np.arange(0 - 0.25, 1 + 0.02 + 0.25, 0.02),
+        'steer': np.arange(-1 - 0.5, 1 + 0.05 + 0.5, 0.05),
+    }
+
+    def __init__(self, 
+                 car: Car, 
+                 inference: FuzzyLookupTable | FuzzyInferenceEngine | None = None,
+                 parameters: dict[str, dict[str, list[float]]] | None = None,
+                 rules: FuzzyRules = default_rules,
+                 sensor_array: SensorArray = DEFAULT_SENSORS,
+                 features: dict[str, Feature] | None = None,
+                 cache: FuzzyInferenceCache | None = None,
+                 fallback_outputs: dict[str, float] | None = None):
+        """
+        Parameters
+        ----------
+        car : controlled car
+        inference : optional surrogate used instead of exact `skfuzzy` simulation
+        parameters : overrides for `DEFAULT_PARAMETERS`, per variable and term (required for custom features)
+        rules : function building the rules from inputs (velocity, then features) and outputs variables
+        sensor_array : sensors the car is sensing with
+        features : inputs derived from the sensors distances, by labels (see `default_features` for default)
+        cache : optional cache of outputs for quantized inputs, can be shared by controllers with the same rule base
+        fallback_outputs : used for outputs without active rules, by labels (last valid outputs by default)
+        """
         super().__init__(car)
 
         self.fig = None
+        self.blitter: 'FigureBlitter | None' = None
+        self.charts: 'FuzzyCharts | None' = None
+        self.inference = inference # used instead of exact `skfuzzy` simulation if set
+        self.last_inputs: dict[str, float] = {}
+        self.last_outputs = {'gas': 0., 'brake': 0., 'steer': 0.} # last valid ones
+        self.fallback_outputs = fallback_outputs
+        self.errors = 0 # count of simulation updates falling back
+        self.simulation_error: ValueError | None = None # of exact simulation in the last update, if it failed
+        self._activation_check: FuzzyInferenceEngine | None = None
+        self.parameters = self.merge_parameters(parameters)
+        self.rules = rules
+        features = features or default_features(sensor_array)
+        self.features = FeatureExtractor(features, sensor_array)
+        # Rebuild the same rule base elsewhere (like in charts worker process), picklable
+        self.rule_base_arguments = {'parameters': self.parameters, 'rules': rules,
+                                    'sensor_array': sensor_array, 'features': features}
+        self.cache = cache
+        self.rule_base_key = (f'{rules.__module__}.{rules.__qualname__}', repr(self.parameters),
+                              repr((self.features.names, self.features.ranges, self.features.sum_weights.tolist(),
+                                    self.features.min_offsets.tolist(), self.features.max_offsets.tolist())))
 
-        # TODO: more dynamic, based on sensor names/angles
         self.setup_inputs()
         self.setup_outputs()
         self.setup_control_system()
-        self.simulation = skfuzzy.control.ControlSystemSimulation(self.control_system)
+        self.simulation = skfuzzy.control.ControlSystemSimulation(self.control_system, lenient=True)
 
-    def setup_inputs(self):
-        velocity = skfuzzy.control.Antecedent(np.arange(0, 200 + 1, 1), 'velocity')
-        velocity['SLOW']    = skfuzzy.trapmf(velocity.universe, [0,    0,   0, 75])
-        velocity['MEDIUM']  = skfuzzy.trapmf(velocity.universe, [50, 100, 100, 150])
-        velocity['FAST']    = skfuzzy.trapmf(velocity.universe, [75, 200, 200, 200])
+    @staticmethod
+    def merge_parameters(parameters: dict[str, dict[str, list[float]]] | None) -> dict[str, dict[str, list[float]]]:
+        """Overrides merged over `DEFAULT_PARAMETERS`, per variable and term."""
+        parameters = parameters or {}
+        return {label: {**FuzzyCarController.DEFAULT_PARAMETERS.get(label, {}), **parameters.get(label, {})}
+                for label in {**FuzzyCarController.DEFAULT_PARAMETERS, **parameters}}
 
-        balance = skfuzzy.control.Antecedent(np.arange(-200, 200 + 1, 1), 'balance')
-        balance['LEFT']     = skfuzzy.trapmf(balance.universe, [-200, -200, -200, 0])
-        balance['CENTER']   = skfuzzy.trapmf(balance.universe, [-50, 0, 0, 50])
-        balance['RIGHT']    = skfuzzy.trapmf(balance.universe, [0, 200, 200, 200])
+    def setup_inputs(self):
+        p = self.parameters
+        ranges = {'velocity': (0, 200), **dict(zip(self.features.names, self.features.ranges))}
 
-        side = skfuzzy.control.Antecedent(np.arange(-100, 100 + 1, 1), 'side')
-        side['LEFT']    = skfuzzy.trapmf(side.universe, [-100, -100, -100, 0])
-        side['CENTER']  = skfuzzy.trapmf(side.universe, [-25, 0, 0, 25])
-        side['RIGHT']   = skfuzzy.trapmf(side.universe, [0, 100, 100, 100])
+        self.inputs = []
+        self.input_bounds: dict[str, tuple[float, float]] = {}
+        for label, (low, high) in ranges.items():
+            if label not in p:
+                raise ValueError(f"No membership functions parameters for input '{label}'.")
+            variable = skfuzzy.control.Antecedent(np.arange(low, high + 1, 1), label)
+            for term, values in p[label].items():
+                variable[term] = self.membership(label, term, variable.universe, values)
+            self.inputs.append(variable)
+            self.input_bounds[label] = (float(variable.universe[0]), float(variable.universe[-1]))
 
-        head = skfuzzy.control.Antecedent(np.arange(0, 200 + 1, 1), 'head')
-        head['CLOSE']   = skfuzzy.trapmf(head.universe, [ 0,  0,  25, 125])
-        head['AWAY']    = skfuzzy.trapmf(head.universe, [75, 200, 200, 200])
+    def setup_outputs(self):
+        p = self.parameters
 
-        self.inputs = [velocity, balance, side, head]
+        self.outputs = []
+        for label, universe in FuzzyCarController.OUTPUT_UNIVERSES.items():
+            variable = skfuzzy.control.Consequent(universe, label)
+            for term, values in p[label].items():
+                variable[term] = self.membership(label, term, variable.universe, values)
+            self.outputs.append(variable)
 
-    def setup_outputs(self):
-        gas = skfuzzy.control.Consequent(np.arange(0 - 0.25, 1 + 0.02 + 0.25, 0.02), 'gas')
-        gas['NONE'] = skfuzzy.sigmf(gas.universe, 0.05, -40)
-        gas['SOFT'] = skfuzzy.sigmf(gas.universe, 0.33, -10)
-        gas['HARD'] = skfuzzy.sigmf(gas.universe, 0.75, 20)
+    @staticmethod
+    def membership(label: str, term: str, universe: np.ndarray, values: list[float]) -> np.ndarray:
+        """Membership function of the term of the variable (see `MEMBERSHIP_FUNCTIONS`) sampled on the universe."""
+        functions = FuzzyCarController.MEMBERSHIP_FUNCTIONS
+        function = functions.get((label, term), functions.get(label, skfuzzy.trapmf))
+        # Polygonal ones take all the breakpoints as single argument
+        return function(universe, values) if function in (skfuzzy.trapmf, skfuzzy.trimf) else function(universe, *values)
 
-        brake = skfuzzy.control.Consequent(np.arange(0 - 0.25, 1 + 0.02 + 0.25, 0.02), 'brake')
-        brake['NONE'] = skfuzzy.sigmf(brake.universe, 0.05, -40)
-        brake['SOFT'] = skfuzzy.sigmf(brake.universe, 0.33, -10)
-        brake['HARD'] = skfuzzy.sigmf(brake.universe, 0.75, 20)
+    def setup_control_system(self):
+        self.control_system = skfuzzy.control.ControlSystem(self.rules(self.inputs, self.outputs))
 
-        steer = skfuzzy.control.Consequent(np.arange(-1 - 0.5, 1 + 0.05 + 0.5, 0.05), 'steer')
-        steer['RIGHT'] = skfuzzy.sigmf(steer.universe, -0.5, -10)
-        steer['NONE']  = skfuzzy.gaussmf(steer.universe, 0, 0.10)
-        steer['LEFT']  = skfuzzy.sigmf(steer.universe, 0.5, 10)
+    def compile_lookup_table(self, resolution: int | dict[str, int] = 17):
+        """Samples the rule base into lookup table, used instead of exact computation since then."""
+        self.inference = FuzzyLookupTable.compile(self.control_system, resolution)
+        return self.inference
 
-        self.outputs = [gas, brake, steer]
+    def compile_inference_engine(self):
+        """Compiles the rule base into native inference engine, used instead of `skfuzzy` since then."""
+        self.inference = FuzzyInferenceEngine(self.control_system)
+        return self.inference
 
-    def setup_control_system(self):
-        c = skfuzzy.control
-        velocity, balance, side, head = self.inputs
-        gas, brake, steer = self.outputs
+    def compile_inference(self, mode: str):
+        """Sets up inference by mode name (see `FUZZY_INFERENCE_MODES`)."""
+        if mode == 'table':
+            return self.compile_lookup_table()
+        if mode == 'native':
+            return self.compile_inference_engine()
+        if mode != 'exact':
+            raise ValueError(f"Unknown fuzzy inference mode '{mode}'.")
+        self.inference = None
+        return None
 
-        self.control_system = c.ControlSystem([
-            c.Rule(balance['LEFT'], steer['RIGHT']),
-            c.Rule(balance['RIGHT'], steer['LEFT']),
-            c.Rule(balance['CENTER'] & side['CENTER'], steer['NONE'] % 0.1),
+    def update_simulation(self, sensors: dict[str, RayCastResult]):
+        """
+        Computes outputs for the sensors, never raising on inputs without active rules:
+        missing outputs fall back to `fallback_outputs` (or the last valid ones),
+        counted in `errors` and logged once per streak of failed updates.
+        """
+        inputs = self.clip_inputs({'velocity': self.car.velocity, **self.features.compute_sensors(sensors)})
+        self.simulation_error = None
+        if self.cache is None:
+            outputs = self.compute_outputs(inputs)
+        else:
+            # Cached outputs differ between inference modes, so these are part of the rule base too
+            self.cache.bind((*self.rule_base_key, type(self.inference).__name__))
+            outputs, inputs = self.cache.lookup(inputs, self.compute_outputs)
+        self.last_inputs = inputs
+        missing = [label for label in OUTPUT_LABELS if math.isnan(outputs[label])]
+        if missing:
+            if not self.failed and self.simulation_error is not None:
+                logger.warning('Fuzzy simulation failed at inputs %s, falling back (%d errors so far)',
+                               inputs, self.errors + 1, exc_info=self.simulation_error)
+            elif not self.failed:
+                logger.warning('No active rules for %s at inputs %s, falling back (%d errors so far)',
+                               ', '.join(missing), inputs, self.errors + 1)
+            fallback = self.fallback_outputs or self.last_outputs
+            outputs = {label: fallback[label] if label in missing else outputs[label] for label in OUTPUT_LABELS}
+            self.errors += 1
+        else:
+            self.last_outputs = outputs
+        self.failed = bool(missing)
+        self.gas = max(0, outputs['gas']) # other are properly clamped in the base car controller
+        self.brake = outputs['brake']
+        self.steer = outputs['steer']
 
-            c.Rule(side['LEFT'], steer['RIGHT']),
-            c.Rule(side['RIGHT'], steer['LEFT']),
+    def clip_inputs(self, inputs: dict[str, float]) -> dict[str, float]:
+        """Clips inputs to their universes bounds (like `skfuzzy` does), so cache keys stay bounded too."""
+        bounds = self.input_bounds
+        return {label: min(max(value, bounds[label][0]), bounds[label][1]) for label, value in inputs.items()}
 
-            c.Rule(head['CLOSE'], (brake['HARD'], gas['NONE'])),
-            c.Rule(head['AWAY'] & balance['CENTER'], (brake['NONE'], gas['HARD'])),
-            c.Rule(head['AWAY'] & ~balance['CENTER'], (brake['NONE'], gas['SOFT'])),
+    def compute_outputs(self, inputs: dict[str, float]) -> dict[str, float]:
+        """Outputs for (clipped) inputs, NaN for ones without active rules."""
+        if self.inference is not None:
+            return self.inference.compute(inputs)
+        engine = self.activation_check
+        active = engine.active_outputs(np.array([[inputs[label] for label in engine.input_labels]]))[0]
+        outputs = dict.fromkeys(OUTPUT_LABELS, math.nan)
+        if not active.any():
+            return outputs
+        try:
+            self.compute_simulation(inputs) # lenient, leaves out outputs without active rules
+        except ValueError as error:
+            self.simulation_error = error # logged once per streak of failed updates
+            return outputs
+        # Outputs left out may be stale in the simulation (from its cache of previous inputs)
+        outputs.update({label: self.simulation.output[label]
+                        for label, is_active in zip(engine.output_labels, active.tolist()) if is_active})
+        return outputs
 
-            c.Rule(velocity['SLOW'], gas['SOFT']),
-        ])
+    @property
+    def activation_check(self) -> FuzzyInferenceEngine:
+        """Native engine for checking rules activation before exact simulation, compiled on first use."""
+        if self._activation_check is None:
+            self._activation_check = FuzzyInferenceEngine(self.control_system)
+        return self._activation_check
 
-    def update_simulation(self, sensors: dict[str, RayCastResult]):
-        self.simulation.input['velocity'] = self.car.velocity
-        self.simulation.input['balance'] = sensors['left'].distance - sensors['right'].distance
-        self.simulation.input['side'] = sensors['hard_left'].distance - sensors['hard_right'].distance
-        self.simulation.input['head'] = sensors['head'].distance
+    def compute_simulation(self, inputs: dict[str, float]):
+        for label, value in inputs.items():
+            self.simulation.input[label] = value
         self.simulation.compute()
-        self.gas = max(0, self.simulation.output['gas']) # other are properly clamped in the base car controller
-        self.brake = self.simulation.output['brake']
-        self.steer = self.simulation.output['steer']
 
     def update(self, dt: float, *args, **kwargs):
         # self.update_simulation(sensors) # need to be called separately
         super().update(dt, *args, **kwargs)
 
-    def setup_visualization(self, width: float, height: float):
-        velocity, balance, side, head = self.inputs
-        gas, brake, steer = self.outputs
+    def visualization_layout(self) -> 'ChartLayout':
+        """Variables charts positions in 3x3 grid: outputs in the bottom row, inputs above (up to 6 of them)."""
+        cells = {
+            'velocity': (0, 2),
+            'head':     (1, 0),
+            'balance':  (1, 1),
+            'side':     (1, 2),
+            'gas':      (2, 0),
+            'brake':    (2, 1),
+            'steer':    (2, 2),
+        }
+        variables = self.inputs + self.outputs
+        taken = [cells[var.label] for var in variables if var.label in cells]
+        free = [(row, column) for row in (1, 0) for column in range(3) if (row, column) not in taken]
+        layout = []
+        for var in variables:
+            if var.label in cells:
+                layout.append((var, *cells[var.label]))
+            elif free:
+                layout.append((var, *free.pop(0)))
+        return layout
+
+    def setup_visualization(self, width: float, height: float, blit: bool = False):
+        import matplotlib.pyplot as plt
+        import matplotlib.gridspec as gridspec
+        from visualization import FigureBlitter, MyFuzzyVariableVisualizer
 
         dpi = 67
         fig = plt.figure(figsize=(width / dpi, height / dpi), dpi=dpi)
         gs = gridspec.GridSpec(3, 3, figure=fig)
 
-        self.visualizers = [
-            MyFuzzyVariableVisualizer(velocity, plt.subplot(gs[0, 2])),
-            MyFuzzyVariableVisualizer(head,     plt.subplot(gs[1, 0])),
-            MyFuzzyVariableVisualizer(balance,  plt.subplot(gs[1, 1])),
-            MyFuzzyVariableVisualizer(side,     plt.subplot(gs[1, 2])),
-            MyFuzzyVariableVisualizer(gas,      plt.subplot(gs[2, 0])),
-            MyFuzzyVariableVisualizer(brake,    plt.subplot(gs[2, 1])),
-            MyFuzzyVariableVisualizer(steer,    plt.subplot(gs[2, 2])),
-        ]
+        self.visualizers = [MyFuzzyVariableVisualizer(var, plt.subplot(gs[row, column]))
+                            for var, row, column in self.visualization_layout()]
         self.fig = fig
+        if blit:
+            self.blitter = FigureBlitter(fig, self.visualizers)
 
         print('Done visualization setup')
 
     def visualize(self, width: float, height: float):
+        """Redraws the whole figure, returns it."""
         if self.fig is None:
             self.setup_visualization(width, height)
 
+        self.prepare_visualization()
         for v in self.visualizers:
             v.view(sim=self.simulation)
 
         return self.fig
+
+    def visualize_blit(self, width: float, height: float):
+        """
+        Updates only the changing parts of the figure (see `FigureBlitter`), 
+        returns RGBA buffer (reused between calls) and its size.
+        """
+        if self.blitter is None:
+            self.setup_visualization(width, height, blit=True)
+
+        self.prepare_visualization()
+        return self.blitter.update(self.simulation), self.blitter.size
+
+    def visualize_charts(self, width: int, height: int):
+        """Draws the charts directly with pygame (see `FuzzyCharts`), returns the surface."""
+        if self.charts is None:
+            from fuzzy_charts import FuzzyCharts
+            self.charts = FuzzyCharts(width, height, self.visualization_layout())
+
+        self.prepare_visualization()
+        return self.charts.update(self.simulation)
+
+    def prepare_visualization(self):
+        if (self.inference is not None or self.cache is not None) and self.last_inputs and not self.failed:
+            # Exact simulation state is required to show memberships (not computed on cache hits)
+            self.compute_simulation(self.last_inputs)
@@ -0,0 +1,211 @@
+"""
+Lightweight charts of fuzzy variables, rasterized directly into pygame surfaces,
+as faster alternative to the matplotlib visualization (see `visualization.py`).
+
+Static layers (axes, ticks, legend and curves) are rendered once per variable, as are the
+areas under each membership function: area cut at some activation is just its part below
+the cut row, so each frame only blits parts of pre-rendered layers (much cheaper than filling
+polygons) and draws the crisp value line, after restoring only the area drawn in the previous frame.
+Membership functions are sampled once per pixel column, so cuts need no upsampling.
+"""
+
+import numpy as np
+import pygame
+from skfuzzy.control.fuzzyvariable import FuzzyVariable
+from skfuzzy.control.controlsystem import ControlSystemSimulation
+
+# Same as default matplotlib colors cycle, so charts look alike
+CHART_COLORS = [pygame.Color(c) for c in ('#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+                                          '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf')]
+CHART_FILL_ALPHA = 0.4
+CHART_BACKGROUND = pygame.Color(255, 255, 255)
+CHART_FOREGROUND = pygame.Color(0, 0, 0)
+CHART_LEGEND_FRAME = pygame.Color(204, 204, 204)
+CHART_COLORKEY = pygame.Color(255, 0, 255) # transparent in the layers, never drawn
+
+ChartLayout = list[tuple[FuzzyVariable, int, int]] # variable, row, column
+
+class FuzzyVariableChart:
+    MARGIN_LEFT = 36
+    MARGIN_RIGHT = 10
+    MARGIN_TOP = 10
+    MARGIN_BOTTOM = 34
+
+    def __init__(self, fuzzy_var: FuzzyVariable, rect: pygame.Rect, font: pygame.font.Font):
+        self.fuzzy_var = fuzzy_var
+        self.rect = pygame.Rect(rect)
+        self.font = font
+        self.plot_rect = pygame.Rect(FuzzyVariableChart.MARGIN_LEFT, FuzzyVariableChart.MARGIN_TOP,
+                                     self.rect.width - FuzzyVariableChart.MARGIN_LEFT - FuzzyVariableChart.MARGIN_RIGHT,
+                                     self.rect.height - FuzzyVariableChart.MARGIN_TOP - FuzzyVariableChart.MARGIN_BOTTOM)
+
+        universe = fuzzy_var.universe
+        self.x_min, self.x_max = float(universe.min()), float(universe.max())
+        self.columns_xs = np.arange(self.plot_rect.left, self.plot_rect.right) + self.rect.left
+        columns_values = np.linspace(self.x_min, self.x_max, self.columns_xs.size)
+        self.terms_columns = {label: np.interp(columns_values, universe, term.mf)
+                              for label, term in fuzzy_var.terms.items()}
+        self.colors = {label: CHART_COLORS[i % len(CHART_COLORS)] for i, label in enumerate(fuzzy_var.terms)}
+        self.fill_colors = {label: CHART_BACKGROUND.lerp(color, CHART_FILL_ALPHA)
+                            for label, color in self.colors.items()}
+
+        self.curves_points = {label: np.column_stack((self.columns_xs, self.to_screen_y(columns))).tolist()
+                               for label, columns in self.terms_columns.items()}
+        self.background = self._render_background()
+        self.legend, self.legend_position = self._render_legend()
+        self.plot_origin = (self.rect.left + self.plot_rect.left, self.rect.top + self.plot_rect.top)
+        self.plot_background = self._layer(CHART_BACKGROUND) # plain, but run-length encoded blits are the fastest
+        self.areas = {label: self._render_area(label) for label in self.terms_columns}
+        self.overlay = self._render_overlay()
+        self.last_state = None
+        self.dirty_top = None # top of area to be restored from the background, none if whole chart is
+
+    def to_screen_x(self, value):
+        return self.rect.left + self.plot_rect.left + (value - self.x_min) / (self.x_max - self.x_min) * (self.plot_rect.width - 1)
+
+    def to_screen_y(self, membership):
+        return self.rect.top + self.plot_rect.bottom - 1 - membership / 1.01 * (self.plot_rect.height - 1)
+
+    def _render_background(self):
+        surface = pygame.Surface(self.rect.size)
+        surface.fill(CHART_BACKGROUND)
+        offset = -self.rect.left, -self.rect.top
+        left, bottom = self.plot_rect.left, self.plot_rect.bottom
+
+        # Axes (without top and right ones) with ticks outside
+        pygame.draw.line(surface, CHART_FOREGROUND, (left - 1, self.plot_rect.top), (left - 1, bottom))
+        pygame.draw.line(surface, CHART_FOREGROUND, (left - 1, bottom), (self.plot_rect.right, bottom))
+        for value in np.linspace(self.x_min, self.x_max, 5):
+            x = self.to_screen_x(value) + offset[0]
+            pygame.draw.line(surface, CHART_FOREGROUND, (x, bottom), (x, bottom + 3))
+            text = self.font.render(f'{round(value, 6) + 0:g}', True, CHART_FOREGROUND)
+            surface.blit(text, text.get_rect(midtop=(x, bottom + 4)))
+        for membership in (0, 0.5, 1):
+            y = self.to_screen_y(membership) + offset[1]
+            pygame.draw.line(surface, CHART_FOREGROUND, (left - 4, y), (left - 1, y))
+            text = self.font.render(f'{membership:g}', True, CHART_FOREGROUND)
+            surface.blit(text, text.get_rect(midright=(left - 5, y)))
+
+        # Variable label below
+        text = self.font.render(self.fuzzy_var.label, True, CHART_FOREGROUND)
+        surface.blit(text, text.get_rect(midbottom=(self.plot_rect.centerx, self.rect.height)))
+        return surface
+
+    def _render_legend(self):
+        """Framed legend for the upper left corner, drawn over the cut areas."""
+        line_height = self.font.get_height()
+        width = 22 + max(self.font.size(label)[0] for label in self.colors)
+        surface = pygame.Surface((width, line_height * len(self.colors) + 4))
+        surface.fill(CHART_BACKGROUND)
+        pygame.draw.rect(surface, CHART_LEGEND_FRAME, surface.get_rect(), 1)
+        y = 2
+        for label, color in self.colors.items():
+            pygame.draw.line(surface, color, (3, y + line_height // 2), (17, y + line_height // 2), 2)
+            surface.blit(self.font.render(label, True, CHART_FOREGROUND), (20, y))
+            y += line_height
+        return surface, (self.rect.left + self.plot_rect.left + 4, self.rect.top + self.plot_rect.top + 2)
+
+    def _layer(self, color: pygame.Color = CHART_COLORKEY) -> pygame.Surface:
+        """Surface of the plot area size, transparent (color keyed) unless filled with other color."""
+        layer = pygame.Surface(self.plot_rect.size)
+        layer.fill(color)
+        layer.set_colorkey(CHART_COLORKEY, pygame.RLEACCEL) # run-length encoded, blits fast
+        return layer
+
+    def _to_layer(self, points: list[list[float]]) -> list[tuple[float, float]]:
+        return [(x - self.plot_origin[0], y - self.plot_origin[1]) for x, y in points]
+
+    def _render_area(self, label: str) -> pygame.Surface:
+        """Whole area under the membership function, its part below the cut row is the cut area."""
+        layer = self._layer()
+        points = self.curves_points[label]
+        bottom = self.to_screen_y(0)
+        pygame.draw.polygon(layer, self.fill_colors[label],
+                            self._to_layer(points + [[points[-1][0], bottom], [points[0][0], bottom]]))
+        return layer
+
+    def _render_overlay(self) -> pygame.Surface:
+        """Curves and legend, drawn over the cut areas and the crisp value line."""
+        layer = self._layer()
+        for label, points in self.curves_points.items():
+            pygame.draw.lines(layer, self.colors[label], False, self._to_layer(points))
+        layer.blit(self.legend, (self.legend_position[0] - self.plot_origin[0],
+                                 self.legend_position[1] - self.plot_origin[1]))
+        return layer
+
+    def draw(self, surface: pygame.Surface, cuts: dict[str, float], crisp_value: float | None):
+        """
+        Draws the chart for given cuts (activations) of the terms (only the ones with
+        membership defined) and crisp value of the variable (if available).
+        """
+        state = (tuple(cuts.items()), crisp_value)
+        if state == self.last_state:
+            return
+        self.last_state = state
+
+        left, origin_top = self.plot_origin
+        width, height = self.plot_rect.size
+        if self.dirty_top is None:
+            surface.blit(self.background, self.rect)
+        else:
+            row = self.dirty_top - origin_top
+            surface.blit(self.plot_background, (left, self.dirty_top), (0, row, width, height - row))
+
+        surface.set_clip(self.plot_rect.move(self.rect.topleft))
+        bottom = self.to_screen_y(0)
+        top = bottom
+        for label, cut in cuts.items():
+            if cut <= 0:
+                continue
+            row = min(max(int(round(self.to_screen_y(cut))) - origin_top, 0), height)
+            surface.blit(self.areas[label], (left, origin_top + row), (0, row, width, height - row))
+            top = min(top, self.to_screen_y(cut))
+
+        if crisp_value is not None and any(cut > 0 for cut in cuts.values()):
+            # Draw the crisp value at the actual cut height
+            y = 0.
+            for label, term in self.fuzzy_var.terms.items():
+                if label in cuts:
+                    y = max(y, float(np.interp(crisp_value, self.fuzzy_var.universe, term.mf)))
+
+            # Small cut values are hard to see, so simply set them to 1
+            if y < 0.1:
+                y = 1.
+
+            x = self.to_screen_x(min(max(crisp_value, self.x_min), self.x_max))
+            pygame.draw.line(surface, CHART_FOREGROUND, (x, bottom), (x, self.to_screen_y(y)), 3)
+            top = min(top, self.to_screen_y(y))
+
+        # Curves and legend are on top (redrawn the same way outside the restored area)
+        surface.blit(self.overlay, self.plot_origin)
+        surface.set_clip(None)
+        self.dirty_top = max(self.rect.top + self.plot_rect.top, int(top) - 1)
+
+class FuzzyCharts:
+    """Charts of multiple fuzzy variables laid out in a grid on single surface."""
+
+    def __init__(self, width: int, height: int, layout: ChartLayout, rows: int = 3, columns: int = 3):
+        self.surface = pygame.Surface((width, height))
+        self.surface.fill(CHART_BACKGROUND)
+        font = pygame.font.Font(None, 16)
+        cell_width, cell_height = width // columns, height // rows
+        self.charts = [FuzzyVariableChart(var, pygame.Rect(column * cell_width, row * cell_height, cell_width, cell_height), font)
+                       for var, row, column in layout]
+
+    def update(self, sim: ControlSystemSimulation):
+        """Redraws all the charts for current state of the simulation, returns the surface."""
+        for chart in self.charts:
+            var = chart.fuzzy_var
+            # Like `CrispValueCalculator.find_memberships`, just without upsampling
+            cuts = {}
+            for label, term in var.terms.items():
+                cut = term.membership_value[sim]
+                if cut is not None:
+                    cuts[label] = cut
+            crisp_value = None
+            if hasattr(var, 'input'):
+                crisp_value = var.input[sim]
+            elif hasattr(var, 'output'):
+                crisp_value = var.output[sim]
+            chart.draw(self.surface, cuts, crisp_value)
+        return self.surface
@@ -0,0 +1,290 @@
+"""
+Native vectorized Mamdani inference, compiled from `skfuzzy.control` definitions.
+
+Antecedent and consequent terms are compiled into NumPy arrays, simple rules into
+rule-to-term index matrix, so that fuzzification, rule firing, accumulation and
+centroid defuzzification run for whole batch of inputs at once. Defuzzification
+upsamples the universe at cut crossings the same way `skfuzzy` does, so results
+match it up to floating point rounding.
+
+Membership functions can also differ for each row of the batch (see `with_memberships`),
+so that population of controllers sharing the rules is evaluated at once.
+"""
+
+import copy
+from dataclasses import dataclass, replace
+import numpy as np
+from skfuzzy_lazy import defer_skfuzzy_visualization
+defer_skfuzzy_visualization() # `skfuzzy.control` would import `matplotlib.pyplot` (see `skfuzzy_lazy.py`)
+import skfuzzy.control
+from skfuzzy.control.term import Term, TermPrimitive
+
+class FuzzyInferenceEngine:
+    def __init__(self, control_system: skfuzzy.control.ControlSystem):
+        antecedents = list(control_system.antecedents)
+        consequents = list(control_system.consequents)
+        rules = list(control_system.rules)
+        self.input_labels = [a.label for a in antecedents]
+        self.output_labels = [c.label for c in consequents]
+        self.members: int | None = None # count of rows with own membership functions, if any
+
+        # Fuzzification: memberships of all terms of each input, stacked
+        self.inputs = []
+        self.input_terms: list[Term] = []
+        for antecedent in antecedents:
+            terms = list(antecedent.terms.values())
+            universe = antecedent.universe.astype(np.float64)
+            self.inputs.append((universe, np.arange(universe.size, dtype=np.float64),
+                                np.array([t.mf for t in terms], dtype=np.float64)))
+            self.input_terms.extend(terms)
+        self.terms_count = len(self.input_terms)
+        self._terms_indices = {id(t): i for i, t in enumerate(self.input_terms)}
+
+        # Rule firing: conjunctions of (possibly negated) terms via index matrix into
+        # memberships extended by negations and ones (for padding), others as trees.
+        conjunctions = [self._find_conjunction(rule) for rule in rules]
+        width = max((len(c) for c in conjunctions if c is not None), default=1)
+        self.ones_column = 2 * self.terms_count
+        self.conjunction_rules = np.array([i for i, c in enumerate(conjunctions) if c is not None], dtype=np.intp)
+        self.conjunction_indices = np.array([c + [self.ones_column] * (width - len(c))
+                                             for c in conjunctions if c is not None], dtype=np.intp)
+        self.conjunction_indices = self.conjunction_indices.reshape(-1, width)
+        self.tree_rules = [(i, rule.antecedent, rule.and_func, rule.or_func)
+                           for i, (rule, c) in enumerate(zip(rules, conjunctions)) if c is None]
+        self.rules_count = len(rules)
+
+        # Activation & accumulation: (rule, weight) pairs for each consequent term,
+        # only terms referenced by any rule take part (like in `skfuzzy`).
+        self.outputs: list[_CompiledConsequent] = []
+        for consequent in consequents:
+            if consequent.accumulation_method.__name__ not in ('accumulation_max', 'fmax'):
+                raise ValueError(f"Unsupported accumulation method for '{consequent.label}'.")
+            if consequent.defuzzify_method != 'centroid':
+                raise ValueError(f"Unsupported defuzzification method for '{consequent.label}'.")
+            pairs = [(i, t.term, t.weight) for i, rule in enumerate(rules)
+                     for t in rule.consequent if t.term.parent is consequent]
+            terms = [t for t in consequent.terms.values() if any(t is term for _, term, _ in pairs)]
+            weights = np.zeros((len(pairs), len(terms)))
+            for j, (_, term, weight) in enumerate(pairs):
+                weights[j, [t is term for t in terms].index(True)] = weight
+            universe = consequent.universe.astype(np.float64)
+            self.outputs.append(_CompiledConsequent(
+                universe=universe,
+                mfs=np.array([t.mf for t in terms], dtype=np.float64).reshape(-1, universe.size),
+                pairs_rules=np.array([i for i, _, _ in pairs], dtype=np.intp),
+                weights=weights,
+                labels=[t.label for t in terms]))
+
+    @property
+    def input_terms_labels(self) -> list[list[str]]:
+        """Labels of terms of each input, in order of memberships (see `fuzzify`)."""
+        return [[t.label for t in self.input_terms if t.parent.label == label] for label in self.input_labels]
+
+    @property
+    def output_terms_labels(self) -> list[list[str]]:
+        """Labels of terms of each output which take part in the rules."""
+        return [output.labels for output in self.outputs]
+
+    def with_memberships(self, inputs_mfs: list[np.ndarray], outputs_mfs: list[np.ndarray]) -> 'FuzzyInferenceEngine':
+        """
+        Engine with the same rules, but own membership functions for each row of batch:
+        arrays of shape (members, terms, points) for each input and output, with terms ordered
+        as in `input_terms_labels` and `output_terms_labels`, sampled on the same universes.
+        Batches computed by it have to have single row per member (or per given members).
+        """
+        members = {mfs.shape[0] for mfs in [*inputs_mfs, *outputs_mfs]}
+        if len(members) != 1:
+            raise ValueError('Membership functions have to be given for the same count of members.')
+        for mfs, (universe, _, shared) in zip(inputs_mfs, self.inputs):
+            if mfs.shape[1:] != shared.shape:
+                raise ValueError(f'Expected membership functions of shape (members, {shared.shape}), got {mfs.shape}.')
+        engine = copy.copy(self)
+        engine.members = members.pop()
+        engine.inputs = [(universe, indices, np.asarray(mfs, dtype=np.float64))
+                         for mfs, (universe, indices, _) in zip(inputs_mfs, self.inputs)]
+        engine.outputs = [replace(output, mfs=np.asarray(mfs, dtype=np.float64))
+                          for mfs, output in zip(outputs_mfs, self.outputs)]
+        return engine
+
+    def _find_conjunction(self, rule: skfuzzy.control.Rule) -> list[int] | None:
+        """Finds indices of (negated) terms for rules which are plain AND of terms."""
+        if rule.and_func is not np.fmin:
+            return None
+        indices = []
+        def visit(term: TermPrimitive):
+            if isinstance(term, Term):
+                indices.append(self._term_index(term))
+                return True
+            if term.kind == 'not' and isinstance(term.term1, Term):
+                indices.append(self.terms_count + self._term_index(term.term1))
+                return True
+            if term.kind == 'and':
+                return visit(term.term1) and visit(term.term2)
+            return False
+        return indices if visit(rule.antecedent) else None
+
+    def _term_index(self, term: Term) -> int:
+        return self._terms_indices[id(term)]
+
+    def compute(self, inputs: dict[str, float | np.ndarray]) -> dict[str, float | np.ndarray]:
+        """
+        Computes outputs for inputs (scalars or arrays of the same shape),
+        keyed by labels like `ControlSystemSimulation` inputs and outputs are.
+        """
+        values = [np.asarray(inputs[label], dtype=np.float64) for label in self.input_labels]
+        shape = np.broadcast_shapes(*(v.shape for v in values))
+        batch = np.stack([np.broadcast_to(v, shape).ravel() for v in values], axis=1)
+        results = self.compute_array(batch)
+        return {label: results[:, i].reshape(shape) if shape else float(results[0, i])
+                for i, label in enumerate(self.output_labels)}
+
+    def compute_array(self, inputs: np.ndarray, members: np.ndarray | None = None) -> np.ndarray:
+        """
+        Computes outputs for batch of inputs, array of shape (N, inputs),
+        columns ordered as `input_labels`. Returns array of shape (N, outputs),
+        columns ordered as `output_labels`; NaN where no membership to defuzzify.
+
+        With own membership functions for members (see `with_memberships`), rows are
+        for all the members, or for the given members only (array of N indices).
+        """
+        if self.members is not None:
+            if members is None:
+                if inputs.shape[0] != self.members:
+                    raise ValueError(f'Expected single row of inputs for each of {self.members} members.')
+                members = np.arange(self.members)
+            elif inputs.shape[0] != len(members):
+                raise ValueError(f'Expected single row of inputs for each of {len(members)} given members.')
+        memberships = self.fuzzify(inputs, members)
+        firing = self.fire(memberships)
+        return np.stack([self._defuzzify(firing, output, members) for output in self.outputs], axis=1)
+
+    def active_outputs(self, inputs: np.ndarray) -> np.ndarray:
+        """
+        Whether any rule activates each output, for batch of inputs like in `compute_array`,
+        array of shape (N, outputs). Outputs without active rules have nothing to defuzzify
+        (`skfuzzy` raises on them, `compute_array` gives NaN), so check is cheaper than computing.
+        """
+        firing = self.fire(self.fuzzify(inputs))
+        return np.stack([(firing[:, output.pairs_rules, None] * output.weights).max(axis=(1, 2), initial=0) > 0
+                         for output in self.outputs], axis=1)
+
+    def fuzzify(self, inputs: np.ndarray, members: np.ndarray | None = None) -> np.ndarray:
+        """Memberships of all input terms, array of shape (N, terms); members like in `compute_array`."""
+        memberships = []
+        for (universe, indices, mfs), values in zip(self.inputs, inputs.T):
+            # Values are clipped to universe bounds, like in `skfuzzy` by default
+            position = np.interp(values, universe, indices)
+            i = np.minimum(position.astype(np.intp), universe.size - 2)
+            f = position - i
+            if mfs.ndim == 2:
+                memberships.append(mfs[:, i] + (mfs[:, i + 1] - mfs[:, i]) * f)
+            else: # own for each member
+                rows = np.arange(mfs.shape[0]) if members is None else members
+                a = mfs[rows, :, i]
+                memberships.append((a + (mfs[rows, :, i + 1] - a) * f[:, None]).T)
+        return np.concatenate(memberships, axis=0).T
+
+    def fire(self, memberships: np.ndarray) -> np.ndarray:
+        """Rules firing strengths, array of shape (N, rules)."""
+        n = memberships.shape[0]
+        extended = np.concatenate([memberships, 1 - memberships, np.ones((n, 1))], axis=1)
+        firing = np.empty((n, self.rules_count))
+        firing[:, self.conjunction_rules] = extended[:, self.conjunction_indices].min(axis=2)
+        for i, antecedent, and_func, or_func in self.tree_rules:
+            firing[:, i] = self._fire_tree(extended, antecedent, and_func, or_func)
+        return firing
+
+    def _fire_tree(self, extended: np.ndarray, term: TermPrimitive, and_func, or_func) -> np.ndarray:
+        if isinstance(term, Term):
+            return extended[:, self._term_index(term)]
+        a = self._fire_tree(extended, term.term1, and_func, or_func)
+        if term.kind == 'not':
+            return 1 - a
+        b = self._fire_tree(extended, term.term2, and_func, or_func)
+        return and_func(a, b) if term.kind == 'and' else or_func(a, b)
+
+    @staticmethod
+    def _defuzzify(firing: np.ndarray, output: '_CompiledConsequent', members: np.ndarray | None = None) -> np.ndarray:
+        n = firing.shape[0]
+        if output.mfs.shape[-2] == 0:
+            return np.full(n, np.nan)
+
+        # Accumulate activations into cuts of each term, shape (N, terms)
+        cuts = (firing[:, output.pairs_rules, None] * output.weights).max(axis=1)
+
+        # Aggregated (max of cut) memberships at universe points, shape (N, points)
+        points_mfs = output.points_mfs if members is None or output.mfs.ndim == 2 else output.points_mfs[members]
+        values = np.minimum(points_mfs, cuts[:, None, :]).max(axis=2)
+
+        # Trapezoids areas and moments (exact for piecewise linear function), shape (N, intervals)
+        x1, widths = output.x1, output.widths
+        ya, yb = values[:, :-1], values[:, 1:]
+        areas = 0.5 * widths * (ya + yb)
+        moments_areas = areas * x1 + widths * widths * (ya + 2 * yb) / 6
+
+        # Like `skfuzzy`, upsample the universe with points where term memberships cross their cuts,
+        # only few intervals have such points, so these are recalculated separately.
+        c = cuts[:, None, :]
+        y1, y2 = points_mfs[..., :-1, :], points_mfs[..., 1:, :]
+        zero_crosses = output.zero_crosses if members is None or output.mfs.ndim == 2 else output.zero_crosses[members]
+        crosses = np.where(c == 0, zero_crosses, (y1 >= c) != (y2 >= c))
+        rows, intervals = np.nonzero(crosses.any(axis=2))
+        if rows.size > 0:
+            c = cuts[rows]
+            member_rows = rows if members is None else members[rows]
+            y1 = output.at(output.y1, member_rows, intervals)
+            # Offsets from interval start, duplicating it for terms not crossing, shape (K, terms)
+            offsets = np.where(crosses[rows, intervals], (c - y1) * output.at(output.inverse_slopes, member_rows, intervals), 0)
+            offsets.sort(axis=1)
+            at_crossings = y1[:, None, :] + output.at(output.slopes, member_rows, intervals)[:, None, :] * offsets[..., None]
+            at_crossings = np.minimum(at_crossings, c[:, None, :]).max(axis=2)
+
+            xs = np.concatenate([np.zeros((rows.size, 1)), offsets, widths[intervals, None]], axis=1)
+            ys = np.concatenate([ya[rows, intervals, None], at_crossings, yb[rows, intervals, None]], axis=1)
+            w = xs[:, 1:] - xs[:, :-1]
+            ya_, yb_ = ys[:, :-1], ys[:, 1:]
+            refined_areas = 0.5 * w * (ya_ + yb_)
+            refined_moments = refined_areas * (x1[intervals, None] + xs[:, :-1]) + w * w * (ya_ + 2 * yb_) / 6
+            areas[rows, intervals] = refined_areas.sum(axis=1)
+            moments_areas[rows, intervals] = refined_moments.sum(axis=1)
+
+        total_area = areas.sum(axis=1)
+        result = np.full(n, np.nan)
+        return np.divide(moments_areas.sum(axis=1), total_area, out=result, where=total_area > 0)
+
+@dataclass
+class _CompiledConsequent:
+    """Consequent terms memberships and activation weights, as used in defuzzification."""
+    universe: np.ndarray # shape (points,)
+    mfs: np.ndarray # shape (terms, points), or (members, terms, points) if own for each row
+    pairs_rules: np.ndarray # rule index of each (rule, consequent term) pair
+    weights: np.ndarray # shape (pairs, terms), zero where pair is for other term
+    labels: list[str] # of the terms
+
+    def __post_init__(self):
+        # Arrays below have leading members axis too, if memberships are own for each row
+        self.points_mfs = np.swapaxes(self.mfs, -1, -2) # shape (points, terms)
+        self.x1 = self.universe[:-1]
+        self.y1 = self.points_mfs[..., :-1, :] # shape (intervals, terms)
+        self.y2 = self.points_mfs[..., 1:, :]
+        self.widths = np.diff(self.universe)
+        widths = self.widths[:, None]
+        deltas = self.y2 - self.y1
+        self.slopes = deltas / widths
+        self.inverse_slopes = np.where(deltas != 0, widths / np.where(deltas != 0, deltas, 1), 0)
+        self.zero_crosses = (self.y1 > 0) != (self.y2 > 0)
+
+    @staticmethod
+    def at(array: np.ndarray, rows: np.ndarray, intervals: np.ndarray) -> np.ndarray:
+        """Values of per interval array for the (member, interval) pairs, shape (K, terms)."""
+        return array[intervals] if array.ndim == 2 else array[rows, intervals]
+
+if __name__ == '__main__':
+    from car import Car
+    from fuzzy_car_controller import FuzzyCarController
+    from fuzzy_lookup_table import measure_error
+
+    controller = FuzzyCarController(Car((0, 0)))
+    engine = FuzzyInferenceEngine(controller.control_system)
+    for label, error in measure_error(engine, controller.control_system).items():
+        print(f'{label}: max error {error:.2e}')
@@ -0,0 +1,209 @@
+"""
+Lookup table surrogate for fuzzy control system inference.
+
+The rule base is sampled once (using exact `skfuzzy` computation) on regular grids
+over the input universes, then answered at runtime by multilinear interpolation.
+Each output is tabulated only over the inputs its rules actually depend on.
+"""
+
+import itertools
+import sys
+import numpy as np
+from skfuzzy_lazy import defer_skfuzzy_visualization
+defer_skfuzzy_visualization() # `skfuzzy.control` would import `matplotlib.pyplot` (see `skfuzzy_lazy.py`)
+import skfuzzy.control
+
+class FuzzyLookupTable:
+    def __init__(self, grids: dict[str, np.ndarray], tables: dict[str, tuple[tuple[str, ...], np.ndarray]]):
+        """
+        Parameters
+        ----------
+        grids : regular sampling grid for each input (antecedent) label
+        tables : for each output (consequent) label, labels of inputs it depends on
+            and tabulated values, one axis per those inputs (in order)
+        """
+        self.grids = grids
+        self.tables = tables
+
+        # Plain Python copies for the scalar path, where NumPy call overhead dominates
+        self._scalar_grids = {label: (float(grid[0]), float(grid[-1] - grid[0]) / (len(grid) - 1), len(grid) - 1)
+                              for label, grid in grids.items()}
+        self._scalar_tables = {label: (axes, values.shape, values.ravel().tolist())
+                               for label, (axes, values) in tables.items()}
+
+    @classmethod
+    def compile(cls, control_system: skfuzzy.control.ControlSystem, resolution: int | dict[str, int] = 17):
+        """
+        Samples the control system over its input universes.
+
+        Resolution is number of samples per input universe (including both ends),
+        either the same for all inputs or per input label. Default of 17 samples
+        lands on all the breakpoints of the `FuzzyCarController` input terms.
+        """
+        antecedents = {a.label: a for a in control_system.antecedents}
+        grids = {}
+        for label, antecedent in antecedents.items():
+            count = resolution if isinstance(resolution, int) else resolution[label]
+            if count < 2:
+                raise ValueError(f"Resolution for '{label}' must be at least 2 samples.")
+            grids[label] = np.linspace(antecedent.universe.min(), antecedent.universe.max(), count)
+
+        # Find which inputs each output depends on
+        dependencies: dict[str, set[str]] = {c.label: set() for c in control_system.consequents}
+        for rule in control_system.rules:
+            labels = {term.parent.label for term in rule.antecedent_terms}
+            for weighted_term in rule.consequent:
+                dependencies[weighted_term.term.parent.label] |= labels
+
+        # Sample largest input sets first, so smaller ones can be often sliced from them
+        simulation = skfuzzy.control.ControlSystemSimulation(control_system, cache=False)
+        sampled: list[tuple[tuple[str, ...], dict[str, np.ndarray]]] = []
+        tables = {}
+        for label, depends_on in sorted(dependencies.items(), key=lambda x: -len(x[1])):
+            for axes, samples in sampled:
+                if depends_on <= set(axes):
+                    index = tuple(slice(None) if a in depends_on else 0 for a in axes)
+                    tables[label] = (tuple(a for a in axes if a in depends_on), samples[label][index])
+                    break
+            else:
+                axes = tuple(a for a in antecedents if a in depends_on)
+                samples = cls._sample(simulation, antecedents, grids, axes)
+                sampled.append((axes, samples))
+                tables[label] = (axes, samples[label])
+
+        return cls(grids, tables)
+
+    @staticmethod
+    def _sample(simulation: skfuzzy.control.ControlSystemSimulation, antecedents, grids, axes):
+        shape = tuple(len(grids[a]) for a in axes)
+        samples = {c.label: np.full(shape, np.nan) for c in simulation.ctrl.consequents}
+        fixed = {label: float(np.mean(grids[label][[0, -1]])) for label in antecedents if label not in axes}
+        for index in itertools.product(*(range(n) for n in shape)):
+            for label, value in fixed.items():
+                simulation.input[label] = value
+            for label, i in zip(axes, index):
+                simulation.input[label] = float(grids[label][i])
+            try:
+                simulation.compute()
+            except ValueError:
+                continue # left as NaN
+            for label, value in simulation.output.items():
+                samples[label][index] = value
+        return samples
+
+    def compute(self, inputs: dict[str, float | np.ndarray]) -> dict[str, float | np.ndarray]:
+        """
+        Interpolates outputs for given inputs (scalars or arrays of the same shape),
+        clipping them to the universes bounds like `skfuzzy` does by default.
+        """
+        if not any(isinstance(value, np.ndarray) for value in inputs.values()):
+            return self._compute_scalar(inputs)
+
+        positions = {}
+        for label, grid in self.grids.items():
+            value = np.asarray(inputs[label], dtype=np.float64)
+            step = (grid[-1] - grid[0]) / (len(grid) - 1)
+            positions[label] = np.clip((value - grid[0]) / step, 0, len(grid) - 1)
+
+        outputs = {}
+        for label, (axes, values) in self.tables.items():
+            result = _interpolate(values, [positions[a] for a in axes])
+            outputs[label] = result if result.ndim > 0 else float(result)
+        return outputs
+
+    def _compute_scalar(self, inputs: dict[str, float]) -> dict[str, float]:
+        positions = {}
+        for label, (start, step, last) in self._scalar_grids.items():
+            positions[label] = min(max((inputs[label] - start) / step, 0), last)
+        return {label: _interpolate_scalar(flat, shape, [positions[a] for a in axes])
+                for label, (axes, shape, flat) in self._scalar_tables.items()}
+
+    def save(self, path: str):
+        arrays = {f'grid:{label}': grid for label, grid in self.grids.items()}
+        for label, (axes, values) in self.tables.items():
+            arrays[f'table:{label}:' + ','.join(axes)] = values
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str):
+        grids = {}
+        tables = {}
+        with np.load(path) as data:
+            for key in data.files:
+                kind, label, *rest = key.split(':')
+                if kind == 'grid':
+                    grids[label] = data[key]
+                else:
+                    tables[label] = (tuple(a for a in rest[0].split(',') if a), data[key])
+        return cls(grids, tables)
+
+def _interpolate(values: np.ndarray, positions: list[np.ndarray]):
+    """Multilinear interpolation of values at (fractional) grid positions, one array per axis."""
+    if values.ndim == 0:
+        return values
+    batch_shape = np.broadcast_shapes(*(p.shape for p in positions))
+    indices = []
+    fractions = []
+    for axis, (size, position) in enumerate(zip(values.shape, positions)):
+        i = np.minimum(position.astype(np.intp), size - 2)
+        fractions.append(position - i)
+        offsets = np.arange(2).reshape((1,) * axis + (2,) + (1,) * (values.ndim - axis - 1))
+        indices.append(i.reshape(i.shape + (1,) * values.ndim) + offsets)
+
+    # Gather the hypercube corners, then reduce them one axis at the time
+    corners = values[tuple(indices)]
+    for axis in reversed(range(values.ndim)):
+        f = np.broadcast_to(fractions[axis], batch_shape).reshape(batch_shape + (1,) * axis)
+        corners = corners[..., 0] + (corners[..., 1] - corners[..., 0]) * f
+    return corners
+
+def _interpolate_scalar(flat: list[float], shape: tuple[int, ...], positions: list[float]) -> float:
+    """Scalar version of `_interpolate`, for flattened values."""
+    base = 0
+    stride = 1
+    offsets = [0]
+    fractions = []
+    for size, position in zip(reversed(shape), reversed(positions)):
+        i = min(int(position), size - 2)
+        base += i * stride
+        offsets += [offset + stride for offset in offsets]
+        fractions.append(position - i)
+        stride *= size
+
+    corners = [flat[base + offset] for offset in offsets]
+    for f in reversed(fractions):
+        half = len(corners) // 2
+        corners = [a + (b - a) * f for a, b in zip(corners[:half], corners[half:])]
+    return corners[0]
+
+def measure_error(surrogate, control_system: skfuzzy.control.ControlSystem,
+                  samples: int = 1000, seed: int = 0) -> dict[str, float]:
+    """
+    Finds maximal absolute error of surrogate (lookup table or inference engine,
+    anything with `compute` method) against exact `skfuzzy` output for each output,
+    on random inputs uniformly spread over the input universes.
+    """
+    rng = np.random.default_rng(seed)
+    antecedents = list(control_system.antecedents)
+    inputs = {a.label: rng.uniform(a.universe.min(), a.universe.max(), samples) for a in antecedents}
+    approximated = surrogate.compute(inputs)
+
+    simulation = skfuzzy.control.ControlSystemSimulation(control_system, cache=False)
+    errors = {label: 0. for label in approximated}
+    for i in range(samples):
+        for label, values in inputs.items():
+            simulation.input[label] = values[i]
+        simulation.compute()
+        for label, value in simulation.output.items():
+            errors[label] = max(errors[label], abs(approximated[label][i] - value))
+    return errors
+
+if __name__ == '__main__':
+    from car import Car
+    from fuzzy_car_controller import FuzzyCarController
+
+    resolution = int(sys.argv[1]) if len(sys.argv) > 1 else 17
+    controller = FuzzyCarController(Car((0, 0)))
+    table = FuzzyLookupTable.compile(controller.control_system, resolution)
+    for label, error in measure_error(table, controller.control_system).items():
+        print(f'{label}: max error {error:.4f}')
@@ -0,0 +1,387 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import time
+import pygame
+import sys
+import math
+import numpy as np
+import skfuzzy
+import matplotlib
+import matplotlib.pyplot as plt
+import matplotlib.backends.backend_agg as agg
+from fuzzy_car_controller import FuzzyCarController, share_inference_caches
+
+from map import Map, green_wall_mask
+from car import Car, CarController
+from keyboard_car_controller import KeyboardCarController
+from sensors import DEFAULT_SENSORS, SensorArray
+from track import LapTimer
+from recording import TraceRecorder
+from telemetry import TelemetryPublisher
+from profiling import FrameProfiler
+from race import Race
+from rendering import DirtyRectRenderer
+
+def get_env_boolean(key: str, default: bool) -> bool:
+    return os.getenv(key, 'y' if default else 'n').lower()[0] in ('t', '1', 'y')
+
+USE_PYGAME_MATPLOTLIB_BACKEND = get_env_boolean('USE_PYGAME_MATPLOTLIB_BACKEND', False)
+USE_BLITTING_VISUALIZATION = get_env_boolean('USE_BLITTING_VISUALIZATION', True) # ignored for pygame backend
+USE_PYGAME_CHARTS = get_env_boolean('USE_PYGAME_CHARTS', False) # draw charts directly, without matplotlib
+USE_ASYNC_CHARTS = get_env_boolean('USE_ASYNC_CHARTS', True) # render charts in background process (see `charts_worker.py`)
+CHARTS_RATE = float(os.getenv('CHARTS_RATE', 10)) # charts refreshes per second at most, with async charts
+RECORD_TRACE = os.getenv('RECORD_TRACE') # path to record fuzzy controller inputs and outputs, see `recording.py`
+TELEMETRY_ADDRESS = os.getenv('TELEMETRY_ADDRESS') # host:port or Unix socket path to publish per-tick telemetry on, see `telemetry.py`
+PROFILE_EXPORT = os.getenv('PROFILE_EXPORT', 'profile.json') # path for frame stages timings (.json or .csv)
+FUZZY_INFERENCE = os.getenv('FUZZY_INFERENCE', 'exact') # 'exact' (skfuzzy), 'table' or 'native'
+PHYSICS_RATE = float(os.getenv('PHYSICS_RATE', 60)) # fixed simulation steps per second, independent of FPS
+SENSORS_COUNT = int(os.getenv('SENSORS_COUNT', 0)) # rays fanned around the car (see `SensorArray.fan`), default sensors if 0
+RACE_CARS = int(os.getenv('RACE_CARS', 0)) # fuzzy controller variants racing against the player (see `race.py`), if any
+INFERENCE_CACHE = int(os.getenv('INFERENCE_CACHE', 0)) # size of fuzzy inference cache (see `fuzzy_cache.py`), none if 0
+Car.ROTATION_STEPS = int(os.getenv('CAR_ROTATION_STEPS', Car.ROTATION_STEPS)) # pre-rotated car sprites per turn
+
+if USE_PYGAME_MATPLOTLIB_BACKEND:
+    matplotlib.use('module://pygame_matplotlib.backend_pygame')
+else:
+    matplotlib.use('Agg')
+
+FPS = 60
+MAX_PHYSICS_STEPS_PER_FRAME = 10 # if rendering is slower, simulation slows down instead of piling up steps
+MAX_SPEED_FRAME_TIME = 0.100 # s, of simulating between frames in max speed mode
+MAX_WIDTH = 1600
+MAX_HEIGHT = 900
+CHARTS_AREA_WIDTH = 600
+
+map = Map('maps/1.png', MAX_WIDTH - CHARTS_AREA_WIDTH, MAX_HEIGHT, wall_mask_function=green_wall_mask)
+
+car = Car(map.starting_position, map.starting_angle)
+sensor_array = SensorArray.fan(SENSORS_COUNT) if SENSORS_COUNT else DEFAULT_SENSORS
+fuzzy_car_controller = FuzzyCarController(car, sensor_array=sensor_array)
+
+# Charts worker is forked before there are any threads (logging, telemetry) or the display,
+# as their locks held at the time would stay locked in the worker
+charts_worker = None # with async charts, falls back to drawing them in the loop if it dies
+if USE_ASYNC_CHARTS and not USE_PYGAME_MATPLOTLIB_BACKEND:
+    from charts_worker import ChartsWorker
+    charts_mode = 'pygame' if USE_PYGAME_CHARTS else 'blit' if USE_BLITTING_VISUALIZATION else 'full'
+    charts_worker = ChartsWorker(fuzzy_car_controller, CHARTS_AREA_WIDTH, map.height, charts_mode, CHARTS_RATE)
+    atexit.register(charts_worker.close)
+
+# Logging (like controller fallbacks) is written out by background thread, not to stall the frames
+log_queue = queue.SimpleQueue()
+logging.basicConfig(level=logging.INFO, handlers=[logging.handlers.QueueHandler(log_queue)])
+log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+log_listener.start()
+atexit.register(log_listener.stop)
+
+pygame.init()
+pygame.font.init()
+
+screen = pygame.display.set_mode((map.width + CHARTS_AREA_WIDTH, map.height))
+pygame.display.set_caption("Fuzzy Racing Game")
+
+try:
+    my_font = pygame.font.SysFont('consolas', 16)
+except:
+    my_font = pygame.font.SysFont('dejavusansmono', 16)
+    pass
+
+# Static track gates are drawn into the background once, only the next gate is highlighted each frame
+background = map.surface.copy()
+if map.track is not None:
+    for i, (a, b) in enumerate(map.track.gates):
+        pygame.draw.line(background, (255, 255, 255) if i == len(map.track.gates) - 1 else (120, 120, 120), a, b, 1)
+renderer = DirtyRectRenderer(screen, background)
+
+def draw_text(
+        text: str, 
+        position, 
+        font: pygame.font.Font = my_font, 
+        color: pygame.Color = (0, 0, 0)):
+    renderer.text(text, position, font, color)
+
+clock = pygame.time.Clock()
+
+lap_timer = LapTimer(map.track) if map.track is not None else None
+game_time = 0. # s, simulated time since start or reset
+
+keyboard_car_controller = KeyboardCarController(car)
+if FUZZY_INFERENCE == 'table':
+    print('Compiling fuzzy lookup table...')
+fuzzy_car_controller.compile_inference(FUZZY_INFERENCE)
+car_controllers = [ fuzzy_car_controller, keyboard_car_controller ]
+car_controller: CarController = car_controllers[1]
+
+recorder = TraceRecorder(RECORD_TRACE, sensor_array) if RECORD_TRACE else None
+if recorder is not None:
+    atexit.register(recorder.close) # keep the trace even if interrupted
+
+telemetry = TelemetryPublisher(TELEMETRY_ADDRESS, sensor_array, ['velocity'] + fuzzy_car_controller.features.names) \
+    if TELEMETRY_ADDRESS else None
+if telemetry is not None:
+    atexit.register(telemetry.close)
+
+charts_surface: pygame.Surface | None = None # reused for blitting visualization, shares canvas buffer
+charts_state = None # of the last drawn charts, these are redrawn only when it changes
+
+profiler = FrameProfiler()
+profiling_text = '' # refreshed periodically, as computing percentiles each frame would cost too much
+profiling = False
+
+physics_dt = 1 / PHYSICS_RATE
+accumulator = 0. # s, of real time not simulated yet
+previous_car_pose = (tuple(car.position), car.angle) # before the last physics step, for interpolation
+
+race: Race | None = None
+if RACE_CARS:
+    from evaluation import random_candidates
+    # Default controller and random variants of it; exact inference would be too slow for many cars
+    opponents = [FuzzyCarController(Car(map.starting_position), sensor_array=sensor_array, **candidate)
+                 for candidate in random_candidates(RACE_CARS)]
+    for opponent in opponents:
+        opponent.compile_inference('native' if FUZZY_INFERENCE == 'exact' else FUZZY_INFERENCE)
+    race = Race(map, [car_controller] + opponents,
+                ['you', 'default'] + [f'variant{i}' for i in range(1, RACE_CARS)], sensor_array, physics_dt)
+    lap_timer = race.lap_timer
+
+inference_caches = []
+if INFERENCE_CACHE:
+    inference_caches = share_inference_caches([fuzzy_car_controller] + (race.controllers[1:] if race else []),
+                                              INFERENCE_CACHE)
+
+def step_physics():
+    """Single fixed time step of the simulation: sensing, controllers and car movement."""
+    global game_time, previous_car_pose, wall_ray_casts
+
+    with profiler.stage('rays'):
+        if race is None:
+            wall_ray_casts = sensor_array.sense(map, car.position, car.angle)
+        else:
+            wall_ray_casts = race.sense()[0] # the player's car is the first one
+
+    car_state = (*car.position, car.angle, car.velocity)
+    with profiler.stage('controller_simulation'):
+        # Never raises, failures fall back to previous controls and are counted and logged by the controller
+        fuzzy_car_controller.update_simulation(sensors=wall_ray_casts)
+    if recorder is not None:
+        failed = fuzzy_car_controller.failed
+        recorder.record(game_time, physics_dt, car_state, wall_ray_casts, fuzzy_car_controller, failed)
+        if failed:
+            recorder.flush() # make the failure reproducible right away
+    if telemetry is not None:
+        telemetry.publish(game_time, car_state, wall_ray_casts, fuzzy_car_controller, fuzzy_car_controller.failed,
+                          [profiler.stage(name).last for name in telemetry.stages])
+
+    previous_car_pose = (tuple(car.position), car.angle)
+    if race is None:
+        with profiler.stage('controller_update'):
+            car_controller.update(dt=physics_dt)
+        with profiler.stage('car_move'):
+            car.move(physics_dt)
+        game_time += physics_dt
+        if lap_timer is not None:
+            lap_timer.update(previous_car_pose[0], car.position, game_time - physics_dt, game_time)
+    else:
+        race.controllers[0] = car_controller
+        with profiler.stage('race_controllers'):
+            race.control(range(1, len(race)))
+        with profiler.stage('race_move'):
+            race.move() # updates all controllers, moves the cars and times the laps
+        game_time = race.time
+
+wall_ray_casts = sensor_array.sense(map, car.position, car.angle)
+
+visualizing = False
+paused = False
+do_step = False
+max_speed = False
+running = True
+while running:
+    profiler.frame()
+    with profiler.stage('wait'):
+        frame_dt = clock.tick(0 if max_speed else FPS) / 1000 # s
+
+    with profiler.stage('events'):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.WINDOWEXPOSED:
+                renderer.invalidate()
+                charts_state = None
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE or event.key == pygame.K_q:
+                    running = False
+                if event.key == pygame.K_r:
+                    car.position = list(map.starting_position)
+                    car.angle = map.starting_angle
+                    car.velocity = 0
+                    previous_car_pose = (tuple(car.position), car.angle)
+                    game_time = 0.
+                    if race is not None:
+                        race.reset()
+                        lap_timer = race.lap_timer
+                    elif lap_timer is not None:
+                        lap_timer = LapTimer(map.track)
+                if event.key == pygame.K_c:
+                    car_controller = car_controllers[(car_controllers.index(car_controller) + 1) % len(car_controllers)]
+                    print(f'Switching to {type(car_controller).__name__}')
+                if event.key == pygame.K_p:
+                    paused = not paused
+                if event.key == pygame.K_s:
+                    if paused:
+                        do_step = True
+                if event.key == pygame.K_m:
+                    max_speed = not max_speed
+                    accumulator = 0.
+                if event.key == pygame.K_v:
+                    visualizing = not visualizing
+                if event.key == pygame.K_i:
+                    profiling = not profiling
+                if event.key == pygame.K_e:
+                    profiler.export(PROFILE_EXPORT)
+                    print(f'Exported frame stages timings to {PROFILE_EXPORT}')
+                if event.key == pygame.K_o:
+                    report = profiler.toggle_cprofile()
+                    print(report if report is not None else 'Started cProfile capture')
+
+    if do_step:
+        step_physics() # single step while paused
+        if not visualizing:
+            c = fuzzy_car_controller
+            if c.inference is None and c.cache is None and not c.failed:
+                c.simulation.print_state()
+            else:
+                print(f'inputs: {c.last_inputs}, outputs: gas={c.gas:g}, brake={c.brake:g}, steer={c.steer:g}')
+        do_step = False
+        interpolation = 1.
+    elif paused:
+        interpolation = 1.
+    elif max_speed:
+        # As many steps as fit in the frame time, then render the last state
+        frame_start = time.perf_counter()
+        while time.perf_counter() - frame_start < MAX_SPEED_FRAME_TIME:
+            step_physics()
+        interpolation = 1.
+    else:
+        accumulator = min(accumulator + frame_dt, MAX_PHYSICS_STEPS_PER_FRAME * physics_dt)
+        while accumulator >= physics_dt:
+            step_physics()
+            accumulator -= physics_dt
+        interpolation = accumulator / physics_dt # between previous and current state
+
+    with profiler.stage('sprites_update'):
+        (previous_x, previous_y), previous_angle = previous_car_pose
+        car.update_image(position=(previous_x + (car.position[0] - previous_x) * interpolation,
+                                   previous_y + (car.position[1] - previous_y) * interpolation),
+                         angle=previous_angle + (car.angle - previous_angle) * interpolation)
+        if race is not None:
+            positions, angles = race.poses()
+            previous_positions, previous_angles = race.previous_positions, race.previous_angles
+            for i in np.nonzero(race.released[1:])[0] + 1:
+                race.controllers[i].car.update_image(
+                    position=previous_positions[i] + (positions[i] - previous_positions[i]) * interpolation,
+                    angle=previous_angles[i] + (angles[i] - previous_angles[i]) * interpolation)
+
+    with profiler.stage('map_blit'):
+        renderer.begin() # restores the map only where drawn over in the previous frame
+    with profiler.stage('drawing'):
+        if lap_timer is not None:
+            next_gate = lap_timer.next_gate[0]
+            a, b = map.track.gates[next_gate]
+            renderer.line((255, 255, 255) if next_gate == len(map.track.gates) - 1 else (255, 200, 0), a, b, 3)
+        if race is not None:
+            for i in np.nonzero(race.released[1:])[0] + 1:
+                opponent = race.controllers[i].car
+                renderer.blit(opponent.image, opponent.rect)
+        renderer.blit(car.image, car.rect)
+
+        for ray in wall_ray_casts.values():
+            if ray.hit:
+                renderer.line((99, 20, 20), ray.start_position, ray.hit_position, 2)
+
+        draw_text(f'FPS: {clock.get_fps():.1f} ' + ('(paused)' if paused else '(max speed)' if max_speed else '')
+                  + (f', fuzzy errors: {fuzzy_car_controller.errors}' if fuzzy_car_controller.errors else ''),
+                  position=(0, 0), color=(255, 255, 255))
+        if lap_timer is not None:
+            lap_times = lap_timer.lap_times()
+            sector_times = lap_timer.sector_times()
+            best_lap_time = lap_timer.best_lap_time()
+            draw_text(f'Lap: {lap_timer.laps() + 1}, time: {game_time - (lap_timer.start_times[0] + sum(lap_times)):.2f} s\n'
+                      + (f'Last lap: {lap_times[-1]:.2f} s, best: {best_lap_time:.2f} s\n' if lap_times else '')
+                      + (f'Last sector: {sector_times[-1]:.2f} s\n' if sector_times else '')
+                      + f'Score: {lap_timer.score():.3f}',
+                      position=(0, my_font.get_height()), color=(255, 255, 255))
+            if race is not None:
+                standings = race.standings()
+                shown = standings[:5] + ([0] if 0 not in standings[:5] else [])
+                draw_text('\n'.join(f'{standings.index(i) + 1:>2}. {race.names[i]:<10}{lap_timer.score(i):>7.2f}'
+                                     + (' (waiting)' if not race.released[i] else ' (crashed)' if race.crashed[i] else '')
+                                     for i in shown),
+                          position=(map.width - 220, 0), color=(255, 255, 255))
+
+    with profiler.stage('charts'):
+        state = (True, *fuzzy_car_controller.last_inputs.values()) if visualizing else (False,)
+        if charts_worker is not None and not charts_worker.alive:
+            logging.error('Charts worker died (exit code %s), charts are drawn in the game loop from now on',
+                          charts_worker.process.exitcode)
+            charts_worker.close()
+            charts_worker = None
+            charts_state = None # redrawn
+        async_charts = visualizing and charts_worker is not None
+        if async_charts:
+            # Snapshot not handed (worker busy or rate limited) is handed again on later frames
+            if state != charts_state and charts_worker.submit(fuzzy_car_controller.last_inputs):
+                charts_state = state
+            frame = charts_worker.latest_frame() # never waits for the worker
+            if frame is not None:
+                screen.blit(frame, (map.width, 0))
+                renderer.update((map.width, 0, CHARTS_AREA_WIDTH, map.height))
+        elif state == charts_state:
+            pass # unchanged, the panel is left as it is
+        elif visualizing:
+            if USE_PYGAME_CHARTS:
+                surf = fuzzy_car_controller.visualize_charts(width=CHARTS_AREA_WIDTH, height=map.height)
+            elif USE_BLITTING_VISUALIZATION and not USE_PYGAME_MATPLOTLIB_BACKEND:
+                buffer, w_h = fuzzy_car_controller.visualize_blit(width=CHARTS_AREA_WIDTH, height=map.height)
+                if charts_surface is None:
+                    charts_surface = pygame.image.frombuffer(buffer, w_h, "RGBX") # opaque, blits faster
+                surf = charts_surface
+            else:
+                fig = fuzzy_car_controller.visualize(width=CHARTS_AREA_WIDTH, height=map.height)
+                if USE_PYGAME_MATPLOTLIB_BACKEND:
+                    fig.canvas.draw()
+                    surf = fig
+                else:
+                    canvas = agg.FigureCanvasAgg(fig)
+                    buffer, w_h = canvas.print_to_buffer()
+                    surf = pygame.image.frombuffer(buffer, w_h, "RGBX") # opaque, blits faster
+            screen.blit(surf, (map.width, 0))
+        else:
+            pygame.draw.rect(screen, (0, 0, 0), (map.width, 0, CHARTS_AREA_WIDTH, map.height))
+        if state != charts_state and not async_charts: # async frames update the panel when blitted
+            renderer.update((map.width, 0, CHARTS_AREA_WIDTH, map.height))
+            charts_state = state
+
+    if profiling:
+        if profiler.frames.count % 30 == 0 or not profiling_text:
+            profiling_text = profiler.overlay_text()
+            if inference_caches:
+                hits = sum(c.hits for c in inference_caches)
+                lookups = hits + sum(c.misses for c in inference_caches)
+                profiling_text += f'\ninference cache: {sum(len(c) for c in inference_caches)} entries, ' \
+                                  f'{hits / max(lookups, 1):.1%} hits'
+        draw_text(profiling_text + ('\n(cProfile capturing)' if profiler.cprofiling else ''),
+                  position=(0, map.height - my_font.get_height() * (profiling_text.count('\n') + 2)),
+                  color=(255, 255, 255))
+
+    with profiler.stage('flip'):
+        renderer.present() # updates only the changed regions
+
+if os.getenv('PROFILE_EXPORT'):
+    profiler.export(PROFILE_EXPORT)
+
+pygame.quit()
+sys.exit()
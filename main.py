@@ -1,162 +1,226 @@
+"""
+Command line entry point:
+
+- `play`  - the game, with the window, charts and keyboard control (see `game.py`),
+- `sim`   - headless simulation of the fuzzy controller, optionally recorded,
+- `bench` - benchmarks suite (see `benchmark.py`),
+- `tune`  - random search of fuzzy controller parameters, evaluated in parallel,
+- `race`  - headless race of fuzzy controller variants against each other on single track.
+
+Modules are imported by the subcommands, so headless ones never load the plotting
+libraries nor initialize pygame display.
+"""
+
+import argparse
+import json
 import os
-from time import sleep
-import pygame
+import runpy
 import sys
-import math
-import numpy as np
-import skfuzzy
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.backends.backend_agg as agg
-from fuzzy_car_controller import FuzzyCarController
-
-from map import Map
-from car import Car, CarController
-from keyboard_car_controller import KeyboardCarController
-
-def get_env_boolean(key: str, default: bool) -> bool:
-    return os.getenv(key, 'y' if default else 'n').lower()[0] in ('t', '1', 'y')
-
-USE_PYGAME_MATPLOTLIB_BACKEND = get_env_boolean('USE_PYGAME_MATPLOTLIB_BACKEND', False)
-
-if USE_PYGAME_MATPLOTLIB_BACKEND:
-    matplotlib.use('module://pygame_matplotlib.backend_pygame')
-else:
-    matplotlib.use('Agg')
-
-pygame.init()
-pygame.font.init()
-
-FPS = 60
-MAX_WIDTH = 1600
-MAX_HEIGHT = 900
-CHARTS_AREA_WIDTH = 600
-
-map = Map('maps/1.png', MAX_WIDTH - CHARTS_AREA_WIDTH, MAX_HEIGHT) 
-map.default_wall_condition = lambda x_y, map : map.surface.get_at((int(x_y[0]), int(x_y[1])))[1] > 100 # green
-
-screen = pygame.display.set_mode((map.width + CHARTS_AREA_WIDTH, map.height))
-pygame.display.set_caption("Fuzzy Racing Game")
-
-try:
-    my_font = pygame.font.SysFont('consolas', 16)
-except:
-    my_font = pygame.font.SysFont('dejavusansmono', 16)
-    pass
-
-def draw_text(
-        text: str, 
-        position, 
-        font: pygame.font.Font = my_font, 
-        surface: pygame.Surface = screen, 
-        color: pygame.Color = (0, 0, 0)):
-    position = list(position)
-    for line in text.splitlines():
-        text_surface = my_font.render(line, True, color)
-        surface.blit(text_surface, position)
-        position[1] += font.get_height()
-
-clock = pygame.time.Clock()
-
-car = Car(map.starting_position, map.starting_angle)
-
-sensors_angles = {
-    'head': math.radians(0),
-    'left': math.radians(30),
-    'right': math.radians(-30),
-    'hard_left': math.radians(90),
-    'hard_right': math.radians(-90),
-}
-
-keyboard_car_controller = KeyboardCarController(car)
-fuzzy_car_controller = FuzzyCarController(car)
-car_controllers = [ fuzzy_car_controller, keyboard_car_controller ]
-car_controller: CarController = car_controllers[1]
-
-all_sprites = pygame.sprite.Group()
-all_sprites.add(car)
-
-visualizing = False
-paused = False
-do_step = False
-running = True
-while running:
-    dt = clock.tick(FPS) / 1000 # s
-
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_ESCAPE or event.key == pygame.K_q:
-                running = False
-            if event.key == pygame.K_r:
-                car.position = list(map.starting_position)
-                car.angle = map.starting_angle
-                car.velocity = 0
-            if event.key == pygame.K_c:
-                car_controller = car_controllers[(car_controllers.index(car_controller) + 1) % len(car_controllers)]
-                print(f'Switching to {type(car_controller).__name__}')
-                sleep(0.100)
-            if event.key == pygame.K_p:
-                paused = not paused
-            if event.key == pygame.K_s:
-                if paused:
-                    do_step = True
-                    dt = 1 / 30 # constant step for testing
-            if event.key == pygame.K_v:
-                visualizing = not visualizing
-                sleep(0.100)
-
-    wall_ray_casts = {k: map.cast_ray_to_wall(car.position, car.angle + v) 
-                      for k, v in sensors_angles.items()}
-
-    if not paused or do_step:
-        try:
-            fuzzy_car_controller.update_simulation(sensors=wall_ray_casts)
-        except ValueError as error:
-            print('Error updating simulation:', error)
-            try:
-                fuzzy_car_controller.simulation.print_state()
-                # Note: requires manual adding str(x) to skfuzzy code in some places to (partially) work
-                #   (like when it says about __format__ or something), then still it will error on defuzzification,
-                #   but it still provides good explanation of the current state (without zero area consequent terms).
-                # TODO: add pull request to skfuzzy to fix this issue?
-            except ValueError as error:
-                print('Further error printing out state:', error)
-                print('inputs: ' + ' '.join([f'{v.label}={v.input["current"]}, ' for v in fuzzy_car_controller.inputs]))
-            sleep(0.100)
-
-        car_controller.update(dt=dt)
-        all_sprites.update(dt=dt)
-
-        if do_step:
-            if not visualizing:
-                fuzzy_car_controller.simulation.print_state()
-        do_step = False
-
-    screen.blit(map.surface, (0, 0))
-    all_sprites.draw(screen)
-
-    for k, v in wall_ray_casts.items():
-        v.draw(screen, pygame.Color(99, 20, 20), width=2)
-
-    draw_text(f'FPS: {clock.get_fps():.1f} ' + ('(paused)' if paused else ''), 
-              position=(0, 0), color=(255, 255, 255))
-
-    if visualizing:
-        fig = fuzzy_car_controller.visualize(width=CHARTS_AREA_WIDTH, height=map.height)
-        if USE_PYGAME_MATPLOTLIB_BACKEND:
-            fig.canvas.draw()
-            surf = fig
-        else:
-            canvas = agg.FigureCanvasAgg(fig)
-            buffer, w_h = canvas.print_to_buffer()
-            surf = pygame.image.frombuffer(buffer, w_h, "RGBA")
-        screen.blit(surf, (map.width, 0))
-    else:
-        pygame.draw.rect(screen, (0, 0, 0), (map.width, 0, CHARTS_AREA_WIDTH, map.height))
-
-    pygame.display.flip()
 
-pygame.quit()
-sys.exit()
+from fuzzy_car_controller import FUZZY_INFERENCE_MODES
+
+CHARTS_MODES = ('blit', 'full', 'pygame', 'backend')
+
+def play(args: argparse.Namespace):
+    # The game script is configured by environment variables (see `game.py`)
+    if args.inference:
+        os.environ['FUZZY_INFERENCE'] = args.inference
+    if args.physics_rate:
+        os.environ['PHYSICS_RATE'] = str(args.physics_rate)
+    if args.record:
+        os.environ['RECORD_TRACE'] = args.record
+    if args.sensors:
+        os.environ['SENSORS_COUNT'] = str(args.sensors)
+    if args.race:
+        os.environ['RACE_CARS'] = str(args.race)
+    if args.cache:
+        os.environ['INFERENCE_CACHE'] = str(args.cache)
+    if args.profile_export:
+        os.environ['PROFILE_EXPORT'] = args.profile_export
+    if args.charts:
+        os.environ['USE_PYGAME_CHARTS'] = 'y' if args.charts == 'pygame' else 'n'
+        os.environ['USE_PYGAME_MATPLOTLIB_BACKEND'] = 'y' if args.charts == 'backend' else 'n'
+        os.environ['USE_BLITTING_VISUALIZATION'] = 'y' if args.charts == 'blit' else 'n'
+    if args.sync_charts:
+        os.environ['USE_ASYNC_CHARTS'] = 'n'
+    if args.charts_rate:
+        os.environ['CHARTS_RATE'] = str(args.charts_rate)
+    if args.telemetry:
+        os.environ['TELEMETRY_ADDRESS'] = args.telemetry
+    runpy.run_module('game', run_name='__main__')
+
+def sim(args: argparse.Namespace):
+    from map import Map, green_wall_mask
+    from car import Car
+    from fuzzy_car_controller import FuzzyCarController
+    from fuzzy_cache import FuzzyInferenceCache
+    from simulation import Simulation
+    from recording import TraceRecorder
+    from telemetry import TelemetryPublisher
+    from sensors import DEFAULT_SENSORS, SensorArray
+
+    sensor_array = SensorArray.fan(args.sensors) if args.sensors else DEFAULT_SENSORS
+    map = Map(args.map, args.max_width, args.max_height, wall_mask_function=green_wall_mask,
+              use_distance_field=args.distance_field)
+    cache = FuzzyInferenceCache(args.cache, args.cache_resolution) if args.cache else None
+    def controller_factory(car: Car):
+        controller = FuzzyCarController(car, sensor_array=sensor_array, cache=cache)
+        controller.compile_inference(args.inference)
+        return controller
+    recorder = TraceRecorder(args.record, sensor_array) if args.record else None
+    simulation = Simulation(map, controller_factory, 1 / args.physics_rate, sensor_array, recorder)
+    if args.telemetry:
+        simulation.telemetry = TelemetryPublisher(args.telemetry, sensor_array,
+                                                  ['velocity'] + simulation.controller.features.names)
+        print(f'Publishing telemetry on {args.telemetry}')
+    try:
+        result = simulation.run(args.duration)
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if simulation.telemetry is not None:
+            simulation.telemetry.close()
+            print(f'Telemetry: {simulation.telemetry.published} records published, '
+                  f'{simulation.telemetry.dropped} dropped')
+    print(result.summary())
+    if cache is not None:
+        print('Inference cache: ' + ', '.join(f'{k} {v:.3g}' for k, v in cache.stats().items()))
+
+def bench(args: argparse.Namespace):
+    import benchmark
+    return benchmark.main(args.arguments)
+
+def tune(args: argparse.Namespace):
+    import time
+    import numpy as np
+    from evaluation import evaluate, evaluate_population, random_candidates
+
+    candidates = random_candidates(args.candidates, args.seed, args.deviation)
+    start = time.perf_counter()
+    if args.vectorized:
+        scores = evaluate_population(candidates, args.map, args.max_width, args.max_height,
+                                     duration=args.duration, distance_field=args.distance_field)
+    else:
+        scores = evaluate(candidates, args.map, args.max_width, args.max_height,
+                          duration=args.duration, workers=args.workers)
+    best = int(np.argmax(scores))
+    print(f'Evaluated {len(candidates)} candidates in {time.perf_counter() - start:.2f} s, '
+          f'default score {scores[0]:.3f}, best score {scores[best]:.3f} (#{best})')
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'score': scores[best], **candidates[best]}, file, indent=4)
+
+def race(args: argparse.Namespace):
+    import time
+    from map import Map, green_wall_mask
+    from car import Car
+    from fuzzy_car_controller import FuzzyCarController, share_inference_caches
+    from evaluation import random_candidates
+    from race import Race
+    from sensors import DEFAULT_SENSORS, SensorArray
+
+    sensor_array = SensorArray.fan(args.sensors) if args.sensors else DEFAULT_SENSORS
+    map = Map(args.map, args.max_width, args.max_height, wall_mask_function=green_wall_mask,
+              use_distance_field=args.distance_field)
+    candidates = random_candidates(args.cars, args.seed, args.deviation)
+    controllers = []
+    for candidate in candidates:
+        controller = FuzzyCarController(Car(map.starting_position), sensor_array=sensor_array, **candidate)
+        controller.compile_inference(args.inference)
+        controllers.append(controller)
+    caches = share_inference_caches(controllers, args.cache, args.cache_resolution) if args.cache else []
+    names = ['default'] + [f'variant{i}' for i in range(1, len(candidates))]
+    race = Race(map, controllers, names, sensor_array, 1 / args.physics_rate, args.release_interval)
+    start = time.perf_counter()
+    race.run(args.duration)
+    print(f'Raced {len(race)} cars for {args.duration:.1f} s in {time.perf_counter() - start:.2f} s')
+    print(race.summary())
+    if caches:
+        hits = sum(c.hits for c in caches)
+        print(f'Inference caches: {len(caches)}, hit rate {hits / max(1, hits + sum(c.misses for c in caches)):.1%}')
+    if args.output:
+        timer = race.lap_timer
+        with open(args.output, 'w') as file:
+            json.dump([{'name': names[car], 'score': timer.score(car) if timer else None,
+                        'lap_times': timer.lap_times(car) if timer else [], **candidates[car]}
+                       for car in race.standings()], file, indent=4)
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Fuzzy racing game and tools.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_play = subparsers.add_parser('play', help='play the game')
+    parser_play.add_argument('--inference', choices=FUZZY_INFERENCE_MODES)
+    parser_play.add_argument('--physics-rate', type=float, help='fixed simulation steps per second')
+    parser_play.add_argument('--charts', choices=CHARTS_MODES,
+                             help='fuzzy variables charts: matplotlib with blitting or full redraws, '
+                                  'drawn directly with pygame, or pygame matplotlib backend')
+    parser_play.add_argument('--sync-charts', action='store_true', help='render charts in the game loop, not in background process')
+    parser_play.add_argument('--charts-rate', type=float, metavar='HZ', help='charts refreshes per second at most (async charts)')
+    parser_play.add_argument('--sensors', type=int, metavar='COUNT', help='rays fanned around the car instead of the default ones')
+    parser_play.add_argument('--cache', type=int, metavar='SIZE', help='cache fuzzy inference outputs for quantized inputs')
+    parser_play.add_argument('--race', type=int, metavar='CARS', help='race against fuzzy controller variants')
+    parser_play.add_argument('--record', metavar='TRACE', help='record fuzzy controller into trace file')
+    parser_play.add_argument('--profile-export', metavar='PATH', help='frame stages timings file (.json or .csv)')
+    parser_play.add_argument('--telemetry', metavar='ADDRESS', help='publish per-tick telemetry on host:port or Unix socket path')
+    parser_play.set_defaults(function=play)
+
+    parser_sim = subparsers.add_parser('sim', help='run headless simulation')
+    parser_sim.add_argument('duration', type=float, nargs='?', default=60, help='simulated seconds')
+    parser_sim.add_argument('--inference', choices=FUZZY_INFERENCE_MODES, default='native')
+    parser_sim.add_argument('--physics-rate', type=float, default=60)
+    parser_sim.add_argument('--distance-field', action='store_true', help='trace rays using distance field')
+    parser_sim.add_argument('--sensors', type=int, metavar='COUNT', help='rays fanned around the car instead of the default ones')
+    parser_sim.add_argument('--record', metavar='TRACE', help='record fuzzy controller into trace file')
+    parser_sim.add_argument('--telemetry', metavar='ADDRESS', help='publish per-tick telemetry on host:port or Unix socket path')
+    parser_sim.set_defaults(function=sim)
+
+    parser_bench = subparsers.add_parser('bench', help='run benchmarks (arguments are passed to `benchmark.py`)',
+                                         add_help=False)
+    parser_bench.add_argument('arguments', nargs=argparse.REMAINDER)
+    parser_bench.set_defaults(function=bench)
+
+    parser_tune = subparsers.add_parser('tune', help='random search of fuzzy controller parameters')
+    parser_tune.add_argument('candidates', type=int, nargs='?', default=16)
+    parser_tune.add_argument('--duration', type=float, default=30, help='simulated seconds per candidate')
+    parser_tune.add_argument('--workers', type=int, help='worker processes, all CPUs by default')
+    parser_tune.add_argument('--seed', type=int, default=0)
+    parser_tune.add_argument('--deviation', type=float, default=10, help='of breakpoints perturbations')
+    parser_tune.add_argument('--vectorized', action='store_true',
+                             help='evaluate all candidates together as population, in single process')
+    parser_tune.add_argument('--distance-field', action='store_true',
+                             help='trace rays using distance field (with --vectorized)')
+    parser_tune.add_argument('--output', metavar='PATH', help='write the best candidate parameters to JSON file')
+    parser_tune.set_defaults(function=tune)
+
+    parser_race = subparsers.add_parser('race', help='race fuzzy controller variants against each other')
+    parser_race.add_argument('cars', type=int, nargs='?', default=24, help='default controller, then random variants')
+    parser_race.add_argument('--duration', type=float, default=120, help='simulated seconds')
+    parser_race.add_argument('--inference', choices=FUZZY_INFERENCE_MODES, default='native')
+    parser_race.add_argument('--physics-rate', type=float, default=60)
+    parser_race.add_argument('--release-interval', type=float, default=1., help='minimal seconds between cars starts')
+    parser_race.add_argument('--distance-field', action='store_true', help='trace rays using distance field')
+    parser_race.add_argument('--sensors', type=int, metavar='COUNT', help='rays fanned around the car instead of the default ones')
+    parser_race.add_argument('--seed', type=int, default=0)
+    parser_race.add_argument('--deviation', type=float, default=10, help='of breakpoints perturbations')
+    parser_race.add_argument('--output', metavar='PATH', help='write the standings with parameters to JSON file')
+    parser_race.set_defaults(function=race)
+
+    for subparser in (parser_sim, parser_race):
+        subparser.add_argument('--cache', type=int, metavar='SIZE', help='cache fuzzy inference outputs for quantized inputs')
+        subparser.add_argument('--cache-resolution', type=float, default=1., help='inputs quantization step for the cache')
+
+    for subparser in (parser_sim, parser_tune, parser_race):
+        subparser.add_argument('--map', default='maps/1.png')
+        subparser.add_argument('--max-width', type=int, default=1000)
+        subparser.add_argument('--max-height', type=int, default=900)
+
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['bench']:
+        # Passed through as they are, as `argparse.REMAINDER` doesn't take leading options (like `--help`)
+        return bench(argparse.Namespace(arguments=argv[1:])) or 0
+    args = parser.parse_args(argv)
+    return args.function(args) or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
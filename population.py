@@ -0,0 +1,140 @@
+"""
+Population of fuzzy controllers sharing the rules and features, but each with own membership
+functions parameters, simulated together as arrays: each tick, rays are cast for all the cars
+in single batch (see `SensorArray.cast`), inference runs for all the members in single call
+of the native engine (see `FuzzyInferenceEngine.with_memberships`) and cars move as fleet
+(see `Fleet`). Results are the same as of separate simulations with native inference.
+"""
+
+from dataclasses import dataclass
+import time
+from typing import Sequence
+import numpy as np
+
+from map import Map
+from car import Car
+from fleet import Fleet
+from fuzzy_car_controller import OUTPUT_LABELS, FuzzyCarController, FuzzyRules, default_rules
+from fuzzy_inference import FuzzyInferenceEngine
+from sensors import DEFAULT_SENSORS, Feature, SensorArray
+from track import LapTimer
+
+Parameters = dict[str, dict[str, list[float]]]
+
+class FuzzyPopulation:
+    def __init__(self,
+                 parameters: Sequence[Parameters | None],
+                 rules: FuzzyRules = default_rules,
+                 sensor_array: SensorArray = DEFAULT_SENSORS,
+                 features: dict[str, Feature] | None = None):
+        """
+        Parameters
+        ----------
+        parameters : overrides for `FuzzyCarController.DEFAULT_PARAMETERS` of each member,
+            with the same terms for all of them
+        rules, sensor_array, features : shared by all the members (see `FuzzyCarController`)
+        """
+        if not parameters:
+            raise ValueError('Population has to have at least one member.')
+        # Rules topology is compiled once, from the first member
+        template = FuzzyCarController(Car((0, 0)), parameters=parameters[0], rules=rules,
+                                      sensor_array=sensor_array, features=features)
+        members = [FuzzyCarController.merge_parameters(p) for p in parameters]
+        for i, member in enumerate(members):
+            if {label: list(terms) for label, terms in member.items()} != \
+                    {label: list(terms) for label, terms in template.parameters.items()}:
+                raise ValueError(f'Population member #{i} has different variables or terms than the first one.')
+
+        engine = FuzzyInferenceEngine(template.control_system)
+        universes = {variable.label: variable.universe for variable in template.inputs + template.outputs}
+        def sample(label: str, terms: list[str]):
+            """Memberships of the terms for each member, shape (members, terms, points)."""
+            return np.array([[FuzzyCarController.membership(label, term, universes[label], member[label][term])
+                              for term in terms] for member in members], dtype=np.float64)
+        self.engine = engine.with_memberships(
+            [sample(label, terms) for label, terms in zip(engine.input_labels, engine.input_terms_labels)],
+            [sample(label, terms) for label, terms in zip(engine.output_labels, engine.output_terms_labels)])
+        self.parameters = members
+        self.sensor_array = sensor_array
+        self.features = template.features
+        self.columns = [(['velocity'] + self.features.names).index(label) for label in engine.input_labels]
+        self.lower_bounds, self.upper_bounds = np.array([template.input_bounds[label] for label in engine.input_labels]).T
+        self.outputs_columns = [engine.output_labels.index(label) for label in OUTPUT_LABELS]
+
+    def __len__(self):
+        return len(self.parameters)
+
+    def compute(self, velocities: np.ndarray, distances: np.ndarray, members: np.ndarray | None = None) -> np.ndarray:
+        """
+        Outputs of each member for its car velocity and sensors distances (shape (members, sensors)),
+        array of shape (members, 3) with columns ordered as `OUTPUT_LABELS`; NaN where no rules are active.
+        If members (indices) are given, the rows are for these only.
+        """
+        inputs = np.column_stack([velocities, self.features.compute(distances)])[:, self.columns]
+        inputs = np.clip(inputs, self.lower_bounds, self.upper_bounds) # like `FuzzyCarController.clip_inputs`
+        return self.engine.compute_array(inputs, members)[:, self.outputs_columns]
+
+@dataclass
+class PopulationResult:
+    duration: float # s
+    wall_time: float # s
+    crashed: np.ndarray # bool, for each member
+    distances: np.ndarray # travelled
+    errors: np.ndarray # count of failed controller updates
+    track_scores: np.ndarray | None # see `LapTimer.scores`, none if map has no track
+
+    @property
+    def scores(self) -> np.ndarray:
+        """Track scores, or distances travelled if map has no track (like `evaluation.score`)."""
+        return self.track_scores if self.track_scores is not None else self.distances
+
+class PopulationSimulation:
+    def __init__(self, map: Map, population: FuzzyPopulation, dt: float = 1 / 60):
+        self.map = map
+        self.population = population
+        self.dt = dt
+        count = len(population)
+        self.fleet = Fleet(count, map.starting_position, map.starting_angle)
+        self.time = 0.
+        self.last_outputs = np.zeros((count, len(OUTPUT_LABELS))) # last valid ones, used on failures
+        self.errors = np.zeros(count, dtype=np.intp)
+        self.distances = np.zeros(count)
+        self.lap_timer = LapTimer(map.track, count) if map.track is not None else None
+
+    def step(self):
+        """
+        Like `Simulation.step` for all the cars, crashed ones stay frozen (as if stopped on crash),
+        neither sensing nor computing outputs.
+        """
+        fleet = self.fleet
+        active = np.flatnonzero(fleet.active)
+        distances, _, _, _ = self.population.sensor_array.cast(
+            self.map, fleet.positions[active, 0], fleet.positions[active, 1], fleet.angles[active])
+        outputs = self.population.compute(fleet.velocities[active], distances, active)
+        # Falling back to the last valid outputs, like `FuzzyCarController` by default
+        missing = np.isnan(outputs)
+        failed = missing.any(axis=1)
+        outputs = np.where(missing, self.last_outputs[active], outputs)
+        self.last_outputs[active[~failed]] = outputs[~failed]
+        self.errors[active] += failed
+        fleet.gas[active] = np.maximum(0, outputs[:, 0])
+        fleet.brake[active] = outputs[:, 1]
+        fleet.steer[active] = outputs[:, 2]
+
+        previous_positions = fleet.positions
+        fleet.step(self.dt)
+        self.time += self.dt
+        if self.time > self.dt: # from the first tick on, like `SimulationResult.distance`
+            self.distances += np.hypot(*(fleet.positions - previous_positions).T)
+        if self.lap_timer is not None:
+            self.lap_timer.update(previous_positions, fleet.positions, self.time - self.dt, self.time)
+        fleet.active &= ~fleet.crashed(self.map)
+
+    def run(self, duration: float) -> PopulationResult:
+        start = time.perf_counter()
+        for _ in range(int(round(duration / self.dt))):
+            if not self.fleet.active.any():
+                break
+            self.step()
+        return PopulationResult(duration, time.perf_counter() - start, ~self.fleet.active, self.distances,
+                                self.errors, self.lap_timer.scores() if self.lap_timer is not None else None)
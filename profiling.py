@@ -0,0 +1,127 @@
+"""
+Low-overhead per-stage timing of the game loop frames, with rolling percentiles,
+export to CSV/JSON and optional `cProfile` capture.
+"""
+
+import cProfile
+import csv
+import io
+import json
+import os
+import pstats
+import time
+import numpy as np
+
+PROFILE_PERCENTILES = (50, 95, 99)
+
+class _Stage:
+    """Timer for single stage, reused as context manager each frame (no allocations)."""
+
+    def __init__(self, window: int):
+        self.samples = np.zeros(window) # s, ring buffer
+        self.index = 0
+        self.count = 0
+        self.start = 0.
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.add(time.perf_counter() - self.start)
+
+    def add(self, duration: float):
+        self.samples[self.index] = duration
+        self.index = (self.index + 1) % self.samples.size
+        self.count += 1
+
+    @property
+    def window(self):
+        return self.samples[:min(self.count, self.samples.size)]
+
+    @property
+    def last(self) -> float:
+        """Duration of the latest sample (s), NaN if none yet."""
+        return float(self.samples[self.index - 1]) if self.count else float('nan')
+
+class FrameProfiler:
+    """
+    Collects durations of named stages of the frames, over rolling window of recent frames.
+
+    Usage: `with profiler.stage('events'): ...` around each stage, and `profiler.frame()`
+    once per frame (to time whole frames, including anything not covered by stages).
+    """
+
+    def __init__(self, window: int = 300):
+        self.window = window
+        self.stages: dict[str, _Stage] = {}
+        self.frames = _Stage(window)
+        self.last_frame_time: float | None = None
+        self.cprofile: cProfile.Profile | None = None
+
+    def stage(self, name: str) -> _Stage:
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = _Stage(self.window)
+        return stage
+
+    def frame(self):
+        now = time.perf_counter()
+        if self.last_frame_time is not None:
+            self.frames.add(now - self.last_frame_time)
+        self.last_frame_time = now
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Statistics (in milliseconds) of each stage and of whole frames, over the window."""
+        result = {}
+        for name, stage in [*self.stages.items(), ('frame', self.frames)]:
+            samples = stage.window
+            if samples.size == 0:
+                continue
+            ms = samples * 1000
+            result[name] = {'count': stage.count, 'mean': float(ms.mean()),
+                            **{f'p{q}': float(v) for q, v in zip(PROFILE_PERCENTILES,
+                                                                 np.percentile(ms, PROFILE_PERCENTILES))}}
+        return result
+
+    def overlay_text(self) -> str:
+        header = f'{"stage":<20}{"mean":>7}' + ''.join(f'{f"p{q}":>7}' for q in PROFILE_PERCENTILES)
+        lines = [header]
+        for name, stats in self.summary().items():
+            lines.append(f'{name:<20}{stats["mean"]:>7.2f}' +
+                         ''.join(f'{stats[f"p{q}"]:>7.2f}' for q in PROFILE_PERCENTILES))
+        return '\n'.join(lines)
+
+    def export(self, path: str):
+        """Writes the summary to JSON or CSV file (by the extension)."""
+        summary = self.summary()
+        if os.path.splitext(path)[1].lower() == '.csv':
+            with open(path, 'w', newline='') as file:
+                fields = ['count', 'mean', *[f'p{q}' for q in PROFILE_PERCENTILES]]
+                writer = csv.writer(file)
+                writer.writerow(['stage', *[f if f == 'count' else f'{f}_ms' for f in fields]])
+                for name, stats in summary.items():
+                    writer.writerow([name, *[stats[f] for f in fields]])
+        else:
+            with open(path, 'w') as file:
+                json.dump({'window': self.window, 'unit': 'ms', 'stages': summary}, file, indent=4)
+
+    @property
+    def cprofiling(self):
+        return self.cprofile is not None
+
+    def toggle_cprofile(self, path: str = 'game.prof', top: int = 20):
+        """
+        Starts capturing with `cProfile`, or stops it: saves the stats to the file
+        (for `snakeviz` or `pstats`) and returns top functions by cumulative time as text.
+        """
+        if self.cprofile is None:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+            return None
+        self.cprofile.disable()
+        self.cprofile.dump_stats(path)
+        stream = io.StringIO()
+        pstats.Stats(self.cprofile, stream=stream).sort_stats('cumulative').print_stats(top)
+        self.cprofile = None
+        return stream.getvalue()
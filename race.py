@@ -0,0 +1,280 @@
+"""
+Race of many cars on single track, each with own controller, seeing other cars as obstacles.
+
+Cars are released one after another from the start (the track is narrow there), each timed
+from its own release. Cars near each other are found using uniform grid spatial hash, rebuilt
+each tick, so neither sensing other cars nor collisions need checking all pairs of cars.
+"""
+
+import math
+from typing import Sequence
+import numpy as np
+
+from map import Map, RayCastResult
+from car import Car, CarController
+from track import LapTimer
+from sensors import DEFAULT_SENSORS, SensorArray
+
+class SpatialGrid:
+    """
+    Uniform grid of points, with cells keys sorted (so no per-cell containers), for finding
+    pairs of points within radius up to the cell size by checking only the neighbouring cells.
+    """
+
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self.build(np.zeros((0, 2)))
+
+    def build(self, positions: np.ndarray):
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        cells = np.floor(self.positions / self.cell_size).astype(np.intp)
+        if cells.shape[0] > 0:
+            cells -= cells.min(axis=0) - 1 # margin, so neighbouring cells keys never wrap around
+        self.rows = int(cells[:, 1].max(initial=0)) + 2
+        self.cells = cells
+        keys = cells[:, 0] * self.rows + cells[:, 1]
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+
+    def pairs(self, radius: float, sources: np.ndarray | None = None):
+        """
+        Pairs of different points within the radius, as arrays of indices (i, j); each pair
+        is found in both orders. Only pairs starting at the source points, if given.
+        """
+        if radius > self.cell_size:
+            raise ValueError('Radius cannot be greater than the grid cell size.')
+        sources = np.arange(self.positions.shape[0]) if sources is None else np.asarray(sources, dtype=np.intp)
+        cells = self.cells[sources]
+        found_i, found_j = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                keys = (cells[:, 0] + dx) * self.rows + (cells[:, 1] + dy)
+                starts = np.searchsorted(self.sorted_keys, keys, side='left')
+                counts = np.searchsorted(self.sorted_keys, keys, side='right') - starts
+                total = int(counts.sum())
+                if total == 0:
+                    continue
+                # Expand the ranges of sorted points in the cells into pairs
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                found_i.append(np.repeat(sources, counts))
+                found_j.append(self.order[np.repeat(starts, counts) + offsets])
+        if not found_i:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        i, j = np.concatenate(found_i), np.concatenate(found_j)
+        d = self.positions[j] - self.positions[i]
+        keep = (i != j) & ((d * d).sum(axis=1) <= radius * radius)
+        return i[keep], j[keep]
+
+class Race:
+    CAR_RADIUS = 10 # of the circle approximating car, for collisions and sensing
+    COLLISION_VELOCITY_FACTOR = 0.5 # velocity kept after bumping into other car
+
+    def __init__(self,
+                 map: Map,
+                 controllers: Sequence[CarController],
+                 names: Sequence[str] | None = None,
+                 sensor_array: SensorArray = DEFAULT_SENSORS,
+                 dt: float = 1 / 60,
+                 release_interval: float = 1.):
+        """
+        Parameters
+        ----------
+        map : map with the track
+        controllers : controllers of the cars (each with own car), in order of release
+        names : names of the cars, for standings
+        sensor_array : sensors all the cars are sensing with
+        dt : time step
+        release_interval : minimal time between releases of consecutive cars, s
+        """
+        self.map = map
+        self.controllers = list(controllers)
+        self.names = list(names) if names is not None else [f'car{i}' for i in range(len(self.controllers))]
+        self.sensor_array = sensor_array
+        self.dt = dt
+        self.release_interval = release_interval
+        self.sensing_grid = SpatialGrid(sensor_array.max_distance + Race.CAR_RADIUS)
+        self.collision_grid = SpatialGrid(2 * Race.CAR_RADIUS)
+        self.reset()
+
+    def __len__(self):
+        return len(self.controllers)
+
+    @property
+    def cars(self) -> list[Car]:
+        return [controller.car for controller in self.controllers]
+
+    def reset(self):
+        count = len(self)
+        for car in self.cars:
+            car.position = list(self.map.starting_position)
+            car.angle = self.map.starting_angle
+            car.velocity = 0
+        self.time = 0.
+        self.released = np.zeros(count, dtype=bool)
+        self.crashed = np.zeros(count, dtype=bool) # frozen since, but still obstacle for others
+        self.collisions = np.zeros(count, dtype=np.intp) # count of contacts with other cars
+        self.contacts = np.zeros(0, dtype=np.intp) # keys of pairs of cars touching in the last tick
+        self.errors = np.zeros(count, dtype=np.intp) # count of failed controller simulation updates
+        self.sensors: list[dict[str, RayCastResult]] = [{} for _ in range(count)]
+        self.lap_timer = LapTimer(self.map.track, count) if self.map.track is not None else None
+        self.next_release_time = 0.
+        self.previous_positions, self.previous_angles = self.poses()
+        self.release()
+
+    @property
+    def racing(self):
+        return self.released & ~self.crashed
+
+    def poses(self):
+        cars = self.cars
+        return (np.array([car.position for car in cars], dtype=np.float64).reshape(-1, 2),
+                np.array([car.angle for car in cars], dtype=np.float64))
+
+    def release(self):
+        """Releases the next car, if it's time and the start is clear of other cars."""
+        waiting = np.nonzero(~self.released)[0]
+        if waiting.size == 0 or self.time < self.next_release_time:
+            return
+        positions, _ = self.poses()
+        start = np.asarray(self.map.starting_position, dtype=np.float64)
+        if (np.hypot(*(positions[self.released] - start).T) < 3 * Race.CAR_RADIUS).any():
+            return
+        car = int(waiting[0])
+        self.released[car] = True
+        if self.lap_timer is not None:
+            self.lap_timer.start([car], self.time)
+        self.next_release_time = self.time + self.release_interval
+
+    def sense(self):
+        """Casts sensors rays of racing cars against walls and other cars, all in batch."""
+        positions, angles = self.poses()
+        racing = np.nonzero(self.racing)[0]
+        if racing.size == 0:
+            return self.sensors
+        array = self.sensor_array
+        distances, hits, hit_xs, hit_ys = array.cast(self.map, positions[racing, 0], positions[racing, 1], angles[racing])
+        ray_angles = angles[racing, None] + array.angles
+
+        # Other (released) cars as circles, for pairs found near enough to be seen
+        obstacles = np.nonzero(self.released)[0]
+        self.sensing_grid.build(positions[obstacles])
+        rows = np.full(len(self), -1, dtype=np.intp)
+        rows[racing] = np.arange(racing.size)
+        local = np.searchsorted(obstacles, racing) # racing cars are obstacles too
+        i, j = self.sensing_grid.pairs(self.sensing_grid.cell_size, local)
+        i, j = obstacles[i], obstacles[j]
+        if i.size > 0:
+            w = positions[j] - positions[i]
+            c = (w * w).sum(axis=1) - Race.CAR_RADIUS ** 2
+            outside = c > 0 # overlapping cars don't see each other
+            i, w, c = i[outside], w[outside], c[outside]
+            pair_angles = ray_angles[rows[i]]
+            b = w[:, 0:1] * np.sin(pair_angles) + w[:, 1:2] * np.cos(pair_angles)
+            discriminant = b * b - c[:, None]
+            t = b - np.sqrt(np.maximum(discriminant, 0))
+            seen = (discriminant >= 0) & (b > 0) & (t < array.max_distances)
+            car_distances = np.full(distances.shape, np.iinfo(np.intp).max)
+            np.minimum.at(car_distances, rows[i], np.where(seen, t.astype(np.intp), np.iinfo(np.intp).max))
+            closer = car_distances < distances
+            distances = np.where(closer, car_distances, distances)
+            hits |= closer
+            hit_xs = np.where(closer, positions[racing, 0:1] + np.sin(ray_angles) * distances, hit_xs)
+            hit_ys = np.where(closer, positions[racing, 1:2] + np.cos(ray_angles) * distances, hit_ys)
+
+        for row, car in enumerate(racing.tolist()):
+            position = self.controllers[car].car.position
+            self.sensors[car] = {name: RayCastResult(position, (x, y) if hit else None, angle, distance)
+                                 for name, angle, distance, hit, x, y
+                                 in zip(array.names, ray_angles[row].tolist(), distances[row].tolist(),
+                                        hits[row].tolist(), hit_xs[row].tolist(), hit_ys[row].tolist())}
+        return self.sensors
+
+    def control(self, cars: Sequence[int] | None = None):
+        """Updates controllers simulations of the racing cars (all or given ones) with their sensors."""
+        racing = self.racing
+        for car in range(len(self)) if cars is None else cars:
+            if racing[car]:
+                controller = self.controllers[car]
+                controller.update_simulation(sensors=self.sensors[car])
+                self.errors[car] += controller.failed # controls fell back, like to the previous ones
+
+    def move(self):
+        """Applies controls and moves racing cars, resolves collisions, times laps and releases cars."""
+        self.previous_positions, self.previous_angles = self.poses()
+        racing = self.racing
+        for car in np.nonzero(racing)[0].tolist():
+            controller = self.controllers[car]
+            controller.update(dt=self.dt)
+            controller.car.move(self.dt)
+        self.time += self.dt
+
+        positions, _ = self.poses()
+        self.collide(positions)
+        for car in np.nonzero(racing)[0].tolist():
+            x, y = positions[car]
+            if not (0 <= x < self.map.width and 0 <= y < self.map.height) or self.map.wall_mask[int(x), int(y)]:
+                self.crashed[car] = True
+                self.controllers[car].car.velocity = 0
+        if self.lap_timer is not None:
+            self.lap_timer.update(self.previous_positions, positions, self.time - self.dt, self.time)
+        self.release()
+
+    def collide(self, positions: np.ndarray):
+        """Pushes apart overlapping released cars (crashed ones stay in place) and slows them down."""
+        released = np.nonzero(self.released)[0]
+        self.collision_grid.build(positions[released])
+        i, j = self.collision_grid.pairs(2 * Race.CAR_RADIUS)
+        i, j = released[i], released[j]
+        i, j = i[i < j], j[i < j]
+        contacts = i * len(self) + j
+        new = ~np.isin(contacts, self.contacts)
+        np.add.at(self.collisions, np.concatenate([i[new], j[new]]), 1)
+        self.contacts = contacts
+        if i.size == 0:
+            return
+        d = positions[j] - positions[i]
+        distance = np.hypot(d[:, 0], d[:, 1])
+        normal = np.where(distance[:, None] > 0, d / np.maximum(distance, 1e-9)[:, None], (1., 0.))
+        overlap = 2 * Race.CAR_RADIUS - distance
+        movable = ~self.crashed
+        # Crashed car doesn't move, so the other one is pushed the whole overlap
+        share_i = np.where(movable[i], np.where(movable[j], 0.5, 1.), 0.)
+        share_j = np.where(movable[j], np.where(movable[i], 0.5, 1.), 0.)
+        pushes = np.zeros_like(positions)
+        np.add.at(pushes, i, -normal * (overlap * share_i)[:, None])
+        np.add.at(pushes, j, normal * (overlap * share_j)[:, None])
+        for car in np.unique(np.concatenate([i, j])).tolist():
+            controlled = self.controllers[car].car
+            controlled.position = (positions[car] + pushes[car]).tolist()
+            controlled.velocity *= Race.COLLISION_VELOCITY_FACTOR
+        positions += pushes
+
+    def step(self):
+        self.sense()
+        self.control()
+        self.move()
+
+    def run(self, duration: float):
+        for _ in range(int(round(duration / self.dt))):
+            self.step()
+
+    def standings(self) -> list[int]:
+        """Indices of the cars from the leading one, by track score (see `LapTimer.scores`)."""
+        if self.lap_timer is None:
+            return list(range(len(self)))
+        scores = np.where(self.released, self.lap_timer.scores(), -math.inf)
+        return np.argsort(-scores, kind='stable').tolist()
+
+    def summary(self, count: int | None = None) -> str:
+        """Standings table, of the leading cars only if count given."""
+        lines = [f'{"#":>3} {"name":<16}{"laps":>5}{"best lap":>10}{"gates":>7}{"score":>9}'
+                 f'{"collisions":>12}{"errors":>8}  status']
+        timer = self.lap_timer
+        for position, car in enumerate(self.standings()[:count], 1):
+            best = timer.best_lap_time(car) if timer else None
+            status = 'waiting' if not self.released[car] else 'crashed' if self.crashed[car] else 'racing'
+            lines.append(f'{position:>3} {self.names[car]:<16}{timer.laps(car) if timer else 0:>5}'
+                         + (f'{best:>9.2f}s' if best is not None else f'{"-":>10}')
+                         + f'{int(timer.gates_passed[car]) if timer else 0:>7}{timer.score(car) if timer else 0:>9.3f}'
+                         + f'{self.collisions[car]:>12}{self.errors[car]:>8}  {status}')
+        return '\n'.join(lines)
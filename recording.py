@@ -0,0 +1,199 @@
+"""
+Recording of controller runs into compact binary traces, and their deterministic replay.
+
+Trace file starts with header (magic, then JSON line with the records dtype and sensors
+names, angles and ranges, padded with spaces to multiple of the block size), followed by fixed-width records (NumPy structured array),
+one per tick, appended as the run goes. The records can be memory-mapped, so any tick
+can be accessed at once, even for long runs, and even while the trace is still being written.
+"""
+
+import json
+import math
+import os
+import numpy as np
+
+from map import RayCastResult
+from car import CarController
+from sensors import Sensor, SensorArray
+
+TRACE_MAGIC = b'FUZZYTRACE1\n'
+TRACE_HEADER_SIZE = 1024 # bytes, including the magic; header is multiple of it
+
+def trace_dtype(sensors_names: list[str]):
+    """Record of single tick: car state before it, sensors distances and controller outputs for it."""
+    return np.dtype([
+        ('time', 'f8'), # s, at the start of the tick
+        ('dt', 'f8'),
+        ('x', 'f8'),
+        ('y', 'f8'),
+        ('angle', 'f8'), # radians
+        ('velocity', 'f8'),
+        ('sensors', 'f4', (len(sensors_names),)),
+        ('gas', 'f8'),
+        ('brake', 'f8'),
+        ('steer', 'f8'),
+        ('error', '?'), # controller simulation update failed, outputs fell back (like to previous tick ones)
+    ])
+
+class TraceRecorder:
+    """
+    Appends tick records to the trace file, buffering them in chunks,
+    so recording costs single structured array row assignment per tick.
+    """
+
+    def __init__(self,
+                 path: str,
+                 sensor_array: SensorArray,
+                 chunk_size: int = 1024):
+        self.path = path
+        self.sensors_names = sensor_array.names
+        self.dtype = trace_dtype(self.sensors_names)
+        self.buffer = np.zeros(chunk_size, dtype=self.dtype)
+        self.buffered = 0
+        self.count = 0 # records written and buffered
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        header = TRACE_MAGIC + json.dumps({'dtype': self.dtype.descr,
+                                           'sensors_angles': sensor_array.angles_dict,
+                                           'sensors_max_distances': sensor_array.max_distances.tolist()}).encode()
+        size = -(-(len(header) + 1) // TRACE_HEADER_SIZE) * TRACE_HEADER_SIZE
+        self.file = open(path, 'wb')
+        self.file.write(header.ljust(size - 1) + b'\n')
+
+    def record(self,
+               time: float,
+               dt: float,
+               car_state: tuple[float, float, float, float],
+               sensors: dict[str, RayCastResult],
+               controller: CarController,
+               error: bool = False):
+        """Records the tick, with the car state (X, Y, angle, velocity) from before it."""
+        self.buffer[self.buffered] = (time, dt, *car_state,
+                                      [sensors[name].distance for name in self.sensors_names],
+                                      controller.gas, controller.brake, controller.steer, error)
+        self.buffered += 1
+        self.count += 1
+        if self.buffered == self.buffer.size:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer[:self.buffered].tobytes())
+        self.file.flush()
+        self.buffered = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class Trace:
+    """Memory-mapped, read-only recorded trace."""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            magic = file.read(len(TRACE_MAGIC))
+            header = file.readline()
+        header_size = len(magic) + len(header)
+        if magic != TRACE_MAGIC or header_size % TRACE_HEADER_SIZE != 0:
+            raise ValueError(f'Not a trace file: {path}')
+        info = json.loads(header.decode())
+        self.path = path
+        self.sensors_angles: dict[str, float] = info['sensors_angles']
+        self.sensors_names = list(self.sensors_angles.keys())
+        self.sensor_array = SensorArray([Sensor(name, angle, max_distance) for (name, angle), max_distance
+                                         in zip(self.sensors_angles.items(), info['sensors_max_distances'])])
+        self.dtype = np.dtype([tuple(field) for field in info['dtype']])
+
+        # Partial record at the end (if still being written) is ignored
+        count = (os.path.getsize(path) - header_size) // self.dtype.itemsize
+        self.records = np.memmap(path, dtype=self.dtype, mode='r', offset=header_size, shape=(count,)) \
+            if count > 0 else np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return self.records.shape[0]
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    def sensors(self, tick: int):
+        """Recreates sensors (ray casts results) for the tick, as seen by controllers."""
+        record = self.records[tick]
+        position = (float(record['x']), float(record['y']))
+        results = {}
+        for sensor, distance in zip(self.sensor_array.sensors, record['sensors'].tolist()):
+            angle = float(record['angle']) + sensor.angle
+            hit = distance < sensor.max_distance
+            hit_position = (position[0] + math.sin(angle) * distance,
+                            position[1] + math.cos(angle) * distance) if hit else None
+            results[sensor.name] = RayCastResult(position, hit_position, angle, int(distance))
+        return results
+
+def replay(trace: Trace, controller: CarController, start: int = 0, tolerance: float = 0.):
+    """
+    Feeds the controller with recorded inputs (car state and sensors, without ray casting)
+    and compares its outputs with the recorded ones, tick by tick.
+    Returns index of the first tick where they diverge (by more than tolerance), or none.
+
+    Replaying from later start, the fallback state of the controller (whether the previous update failed,
+    and the last valid outputs, from the last recorded tick which didn't fail) is restored first.
+    """
+    car = controller.car
+    if start > 0:
+        controller.failed = bool(trace[start - 1]['error'])
+        valid = np.flatnonzero(~trace.records['error'][:start])
+        if valid.size > 0 and hasattr(controller, 'last_outputs'):
+            # Recorded gas is clamped to positive, as it is when falling back to the last valid outputs too
+            record = trace[valid[-1]]
+            controller.last_outputs = {'gas': float(record['gas']), 'brake': float(record['brake']),
+                                       'steer': float(record['steer'])}
+    for tick in range(start, len(trace)):
+        record = trace[tick]
+        car.position = [float(record['x']), float(record['y'])]
+        car.angle = float(record['angle'])
+        car.velocity = float(record['velocity'])
+        controller.update_simulation(sensors=trace.sensors(tick))
+        if controller.failed != bool(record['error']):
+            return tick
+        outputs = (controller.gas, controller.brake, controller.steer)
+        recorded = (record['gas'], record['brake'], record['steer'])
+        if any(abs(a - b) > tolerance for a, b in zip(outputs, recorded)):
+            return tick
+    return None
+
+if __name__ == '__main__':
+    import sys
+    from car import Car
+    from fuzzy_car_controller import FuzzyCarController
+
+    if len(sys.argv) < 2:
+        print(f'Usage: {sys.argv[0]} TRACE [exact|table|native] [TOLERANCE]')
+        sys.exit(1)
+    trace = Trace(sys.argv[1])
+    inference = sys.argv[2] if len(sys.argv) > 2 else 'exact'
+    tolerance = float(sys.argv[3]) if len(sys.argv) > 3 else 0.
+
+    controller = FuzzyCarController(Car((0, 0)), sensor_array=trace.sensor_array)
+    controller.compile_inference(inference)
+
+    print(f'Replaying {len(trace)} ticks ({trace.records["dt"].sum():.1f} s) using {inference} inference')
+    tick = replay(trace, controller, tolerance=tolerance)
+    if tick is None:
+        print('No divergence')
+    else:
+        record = trace[tick]
+        print(f'First divergence at tick {tick} (time {record["time"]:.3f} s):')
+        print('  sensors: ' + ', '.join(f'{n}={d:g}' for n, d in zip(trace.sensors_names, record['sensors'].tolist())) +
+              f', velocity={record["velocity"]:g}')
+        print(f'  recorded: gas={record["gas"]:g}, brake={record["brake"]:g}, steer={record["steer"]:g}' +
+              (' (error)' if record['error'] else ''))
+        print(f'  replayed: gas={controller.gas:g}, brake={controller.brake:g}, steer={controller.steer:g}')
+        print(f'  differences: gas={controller.gas - record["gas"]:.3g}, brake={controller.brake - record["brake"]:.3g}, '
+              f'steer={controller.steer - record["steer"]:.3g}')
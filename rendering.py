@@ -0,0 +1,81 @@
+"""
+Dirty rectangles rendering: instead of redrawing and flipping the whole window each frame,
+only the regions drawn over on the previous frame are restored from the cached background,
+and only these and the newly drawn ones are updated on the display.
+"""
+
+import pygame
+
+Color = pygame.Color | tuple[int, int, int]
+
+class DirtyRectRenderer:
+    TEXT_CACHE_SIZE = 256 # rendered text lines, cleared when full
+
+    def __init__(self, screen: pygame.Surface, background: pygame.Surface, position: tuple[int, int] = (0, 0)):
+        """
+        Parameters
+        ----------
+        screen : display surface
+        background : static part of the scene (like the map), converted to the display format once
+        position : of the background on the screen
+        """
+        self.screen = screen
+        self.background = background.convert()
+        self.background_rect = self.background.get_rect(topleft=position)
+        self.drawn: list[pygame.Rect] = [] # over the background in the current frame, restored on the next one
+        self.previous: list[pygame.Rect] = [] # drawn in the previous frame
+        self.updated: list[pygame.Rect] = [] # outside the background (like charts), only updated on the display
+        self.full_update = True
+        self.texts: dict[tuple, pygame.Surface] = {}
+
+    def invalidate(self):
+        """Redraws the whole background and updates the whole display in the next frame (like when window is exposed)."""
+        self.full_update = True
+
+    def begin(self):
+        """Starts the frame, restoring the background where drawn over in the previous one."""
+        if self.full_update:
+            self.screen.blit(self.background, self.background_rect)
+        else:
+            x, y = self.background_rect.topleft
+            for rect in self.drawn:
+                rect = rect.clip(self.background_rect)
+                self.screen.blit(self.background, rect, rect.move(-x, -y))
+        self.previous = self.drawn
+        self.drawn = []
+        self.updated = []
+
+    def blit(self, surface: pygame.Surface, position) -> pygame.Rect:
+        rect = self.screen.blit(surface, position)
+        self.drawn.append(rect)
+        return rect
+
+    def line(self, color: Color, start, end, width: int = 1) -> pygame.Rect:
+        rect = pygame.draw.line(self.screen, color, start, end, width)
+        self.drawn.append(rect)
+        return rect
+
+    def text(self, text: str, position, font: pygame.font.Font, color: Color = (0, 0, 0)):
+        """Draws text line by line, reusing lines rendered before (like the labels which change rarely)."""
+        x, y = position
+        for line in text.splitlines():
+            key = (line, id(font), tuple(color))
+            surface = self.texts.get(key)
+            if surface is None:
+                if len(self.texts) >= self.TEXT_CACHE_SIZE:
+                    self.texts.clear()
+                surface = self.texts[key] = font.render(line, True, color)
+            self.blit(surface, (x, y))
+            y += font.get_height()
+
+    def update(self, rect):
+        """Marks region drawn outside of the background to be updated on the display (not restored)."""
+        self.updated.append(pygame.Rect(rect))
+
+    def present(self):
+        """Ends the frame, updating the changed regions on the display (all of it if invalidated)."""
+        if self.full_update:
+            pygame.display.flip()
+            self.full_update = False
+        else:
+            pygame.display.update(self.previous + self.drawn + self.updated)
@@ -0,0 +1,202 @@
+"""
+Configurable arrays of distance sensors (rays at arbitrary angles and ranges), cast in single
+batched call, and controller inputs derived from their distances declaratively.
+
+Features (weighted sums, differences, minimums and maximums of sensors distances) are compiled
+into weights matrix and masks, so extracting them is few array reductions, for single car
+as well as for batch of cars, regardless of the count of rays.
+"""
+
+from dataclasses import dataclass
+import math
+from typing import Sequence
+import numpy as np
+
+from map import Map, RayCastResult
+
+@dataclass(frozen=True)
+class Sensor:
+    name: str
+    angle: float # radians, relative to the car heading
+    max_distance: int = 200
+
+class SensorArray:
+    def __init__(self, sensors: Sequence[Sensor]):
+        self.sensors = list(sensors)
+        self.names = [s.name for s in self.sensors]
+        if len(set(self.names)) != len(self.names):
+            raise ValueError('Sensors names have to be unique.')
+        self.angles = np.array([s.angle for s in self.sensors], dtype=np.float64)
+        self.max_distances = np.array([s.max_distance for s in self.sensors], dtype=np.intp)
+        self.max_distance = int(self.max_distances.max(initial=0))
+        self.uniform = bool((self.max_distances == self.max_distance).all())
+
+    @staticmethod
+    def from_angles(angles: dict[str, float], max_distance: int = 200):
+        return SensorArray([Sensor(name, angle, max_distance) for name, angle in angles.items()])
+
+    @staticmethod
+    def fan(count: int, spread: float = math.pi, max_distance: int = 200):
+        """Rays evenly spread symmetrically around the heading, from right to left, named `ray0`, `ray1`..."""
+        angles = np.linspace(-spread / 2, spread / 2, count) if count > 1 else np.zeros(count)
+        return SensorArray([Sensor(f'ray{i}', float(angle), max_distance) for i, angle in enumerate(angles)])
+
+    def __len__(self):
+        return len(self.sensors)
+
+    @property
+    def angles_dict(self):
+        return dict(zip(self.names, self.angles.tolist()))
+
+    def cast(self, map: Map, xs, ys, headings):
+        """
+        Casts all the rays for (broadcastable) arrays of positions and headings of cars.
+
+        Returns tuple of arrays of shape (..., sensors): distances (max distance of the sensor
+        if missed), hit flags and hit positions (X and Y, undefined if missed).
+        """
+        xs, ys, headings = (np.asarray(a, dtype=np.float64)[..., None] for a in (xs, ys, headings))
+        cast = map.cast_rays_arrays if map.distance_field is None else map.trace_rays_arrays
+        distances, hits, hit_xs, hit_ys = cast(xs, ys, headings + self.angles, self.max_distance)
+        if not self.uniform:
+            # Casting up to the longest range and cutting the others gives the same as casting each up to its range
+            beyond = distances >= self.max_distances
+            distances = np.where(beyond, self.max_distances, distances)
+            hits &= ~beyond
+        return distances, hits, hit_xs, hit_ys
+
+    def sense(self, map: Map, position: Sequence[float], heading: float) -> dict[str, RayCastResult]:
+        """Casts all the rays from single car, results keyed by sensors names."""
+        distances, hits, hit_xs, hit_ys = self.cast(map, position[0], position[1], heading)
+        return {name: RayCastResult(position, (x, y) if hit else None, heading + angle, distance)
+                for name, angle, distance, hit, x, y
+                in zip(self.names, self.angles.tolist(), distances.tolist(), hits.tolist(),
+                       hit_xs.tolist(), hit_ys.tolist())}
+
+FEATURE_REDUCTIONS = ('sum', 'min', 'max')
+
+@dataclass(frozen=True)
+class Feature:
+    """Controller input derived from sensors distances."""
+    reduction: str # see `FEATURE_REDUCTIONS`
+    weights: dict[str, float] # by sensors names, only names matter for minimum and maximum
+    range: tuple[float, float] | None = None # of the input universe, derived from sensors ranges if none
+
+def weighted_sum(weights: dict[str, float], range: tuple[float, float] | None = None):
+    return Feature('sum', dict(weights), range)
+
+def difference(a: str, b: str, range: tuple[float, float] | None = None):
+    return Feature('sum', {a: 1., b: -1.}, range)
+
+def mean_difference(a: Sequence[str], b: Sequence[str], range: tuple[float, float] | None = None):
+    """Mean distance of the first sensors group minus mean of the second one."""
+    weights = {name: 1 / len(a) for name in a}
+    for name in b:
+        weights[name] = weights.get(name, 0.) - 1 / len(b)
+    return Feature('sum', weights, range)
+
+def minimum(*names: str, range: tuple[float, float] | None = None):
+    return Feature('min', {name: 1. for name in names}, range)
+
+def maximum(*names: str, range: tuple[float, float] | None = None):
+    return Feature('max', {name: 1. for name in names}, range)
+
+class FeatureExtractor:
+    """Features compiled against sensors array, computed for arrays of its distances."""
+
+    def __init__(self, features: dict[str, Feature], sensor_array: SensorArray):
+        self.names = list(features.keys())
+        self.sensor_array = sensor_array
+        indices = {name: i for i, name in enumerate(sensor_array.names)}
+        for label, feature in features.items():
+            if feature.reduction not in FEATURE_REDUCTIONS:
+                raise ValueError(f"Unknown reduction '{feature.reduction}' of feature '{label}'.")
+            unknown = [name for name in feature.weights if name not in indices]
+            if unknown or not feature.weights:
+                raise ValueError(f"Feature '{label}' uses unknown or no sensors: {', '.join(unknown)}")
+
+        def compile(reduction: str):
+            selected = [i for i, f in enumerate(features.values()) if f.reduction == reduction]
+            matrix = np.zeros((len(selected), len(sensor_array)))
+            for row, i in enumerate(selected):
+                for name, weight in features[self.names[i]].weights.items():
+                    matrix[row, indices[name]] = weight
+            return np.array(selected, dtype=np.intp), matrix
+
+        self.sum_indices, self.sum_weights = compile('sum')
+        self.min_indices, min_weights = compile('min')
+        self.max_indices, max_weights = compile('max')
+        # Masked out distances are replaced by infinities, which never win the reduction
+        self.min_offsets = np.where(min_weights != 0, 0., np.inf)
+        self.max_offsets = np.where(max_weights != 0, 0., -np.inf)
+
+        self.ranges = [feature.range or self._derive_range(feature) for feature in features.values()]
+
+    def _derive_range(self, feature: Feature) -> tuple[float, float]:
+        max_distances = dict(zip(self.sensor_array.names, self.sensor_array.max_distances.tolist()))
+        if feature.reduction == 'sum':
+            extremes = [(0., weight * max_distances[name]) for name, weight in feature.weights.items()]
+            return (sum(min(e) for e in extremes), sum(max(e) for e in extremes))
+        return (0., float(max(max_distances[name] for name in feature.weights)))
+
+    def compute(self, distances: np.ndarray) -> np.ndarray:
+        """Features for distances array of shape (..., sensors), as array of shape (..., features)."""
+        distances = np.asarray(distances, dtype=np.float64)
+        features = np.empty(distances.shape[:-1] + (len(self.names),))
+        if self.sum_indices.size:
+            features[..., self.sum_indices] = distances @ self.sum_weights.T
+        if self.min_indices.size:
+            features[..., self.min_indices] = (distances[..., None, :] + self.min_offsets).min(axis=-1)
+        if self.max_indices.size:
+            features[..., self.max_indices] = (distances[..., None, :] + self.max_offsets).max(axis=-1)
+        return features
+
+    def compute_sensors(self, sensors: dict[str, RayCastResult]) -> dict[str, float]:
+        """Features for single car sensors results (keyed by names), keyed by features names."""
+        distances = np.fromiter((sensors[name].distance for name in self.sensor_array.names),
+                                dtype=np.float64, count=len(self.sensor_array))
+        return dict(zip(self.names, self.compute(distances).tolist()))
+
+def fan_features(sensor_array: SensorArray,
+                 front_angle: float = math.radians(15),
+                 side_angle: float = math.radians(60)) -> dict[str, Feature]:
+    """
+    Features of the default controller inputs for any sensors array: `head` as minimum
+    of the front rays, `balance` as mean of the left diagonal rays minus mean of the right ones,
+    and `side` the same for the side rays (with half of the range, like the default one).
+    """
+    def names(condition):
+        return [name for name, angle in zip(sensor_array.names, sensor_array.angles.tolist()) if condition(angle)]
+    front = names(lambda a: abs(a) <= front_angle)
+    diagonal_left = names(lambda a: front_angle < a < side_angle)
+    diagonal_right = names(lambda a: -side_angle < a < -front_angle)
+    side_left = names(lambda a: a >= side_angle)
+    side_right = names(lambda a: a <= -side_angle)
+    if not (front and diagonal_left and diagonal_right and side_left and side_right):
+        raise ValueError('Sensors array has to cover front, diagonal and side directions.')
+    half = sensor_array.max_distance // 2
+    return {
+        'balance': mean_difference(diagonal_left, diagonal_right),
+        'side': mean_difference(side_left, side_right, range=(-half, half)),
+        'head': minimum(*front),
+    }
+
+DEFAULT_SENSORS = SensorArray.from_angles({
+    'head': math.radians(0),
+    'left': math.radians(30),
+    'right': math.radians(-30),
+    'hard_left': math.radians(90),
+    'hard_right': math.radians(-90),
+})
+
+DEFAULT_FEATURES = {
+    'balance': difference('left', 'right'),
+    'side': difference('hard_left', 'hard_right', range=(-100, 100)),
+    'head': minimum('head'),
+}
+
+def default_features(sensor_array: SensorArray) -> dict[str, Feature]:
+    """Default features for the default sensors, otherwise the equivalent generated ones (see `fan_features`)."""
+    if all(name in sensor_array.names for name in DEFAULT_SENSORS.names):
+        return DEFAULT_FEATURES
+    return fan_features(sensor_array)
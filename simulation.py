@@ -0,0 +1,152 @@
+"""
+Headless simulation, decoupled from the display: no window, no event handling,
+no sprites and no image rotation; fixed time step, running as fast as possible.
+"""
+
+from dataclasses import dataclass
+import math
+import time
+from typing import Callable
+import numpy as np
+
+from map import Map, RayCastResult
+from car import Car, CarController
+from track import LapTimer
+from recording import TraceRecorder
+from telemetry import TelemetryPublisher
+from sensors import DEFAULT_SENSORS, SensorArray
+
+CarControllerFactory = Callable[[Car], CarController]
+
+@dataclass
+class SimulationResult:
+    times: np.ndarray # s, shape (ticks,)
+    trajectory: np.ndarray # shape (ticks, 4): X, Y, angle (radians), velocity; after each tick
+    controls: np.ndarray # shape (ticks, 3): gas, brake, steer; as set by the controller
+    crashed: bool
+    errors: int # count of failed controller simulation updates
+    wall_time: float # s
+    lap_times: list[float] # s, empty if map has no track
+    sector_times: list[float] # s
+    track_score: float | None # see `LapTimer.scores`, none if map has no track
+
+    @property
+    def duration(self):
+        return float(self.times[-1]) if len(self.times) else 0.
+
+    @property
+    def distance(self):
+        """Total distance travelled."""
+        return float(np.hypot(*np.diff(self.trajectory[:, :2], axis=0).T).sum())
+
+    @property
+    def mean_velocity(self):
+        return float(self.trajectory[:, 3].mean()) if len(self.trajectory) else 0.
+
+    @property
+    def realtime_factor(self):
+        """Simulated seconds per wall clock second."""
+        return self.duration / self.wall_time if self.wall_time > 0 else math.inf
+
+    def summary(self) -> str:
+        text = (f'Simulated {self.duration:.1f} s in {self.wall_time:.2f} s ({self.realtime_factor:.0f}x real time), '
+                f'distance {self.distance:.0f}, mean velocity {self.mean_velocity:.1f}, '
+                f'crashed: {self.crashed}, errors: {self.errors}')
+        if self.track_score is not None:
+            text += '\nLaps: ' + (', '.join(f'{t:.2f} s' for t in self.lap_times) or 'none') + f', score {self.track_score:.3f}'
+        return text
+
+class Simulation:
+    def __init__(self,
+                 map: Map,
+                 controller_factory: CarControllerFactory,
+                 dt: float = 1 / 60,
+                 sensor_array: SensorArray = DEFAULT_SENSORS,
+                 recorder: TraceRecorder | None = None,
+                 telemetry: TelemetryPublisher | None = None):
+        self.map = map
+        self.dt = dt
+        self.sensor_array = sensor_array
+        self.car = Car(map.starting_position, map.starting_angle)
+        self.controller = controller_factory(self.car)
+        self.time = 0.
+        self.errors = 0
+        self.sensors: dict[str, RayCastResult] = {}
+        self.lap_timer = LapTimer(map.track) if map.track is not None else None
+        self.recorder = recorder
+        self.telemetry = telemetry
+
+    def sense(self):
+        self.sensors = self.sensor_array.sense(self.map, self.car.position, self.car.angle)
+        return self.sensors
+
+    def step(self):
+        start = time.perf_counter() if self.telemetry is not None else 0.
+        self.sense()
+        sensed = time.perf_counter() if self.telemetry is not None else 0.
+        self.controller.update_simulation(sensors=self.sensors)
+        error = self.controller.failed # controls fell back, like to the previous ones
+        self.errors += error
+        if self.recorder is not None:
+            self.recorder.record(self.time, self.dt, (*self.car.position, self.car.angle, self.car.velocity),
+                                 self.sensors, self.controller, error)
+        if self.telemetry is not None:
+            self.telemetry.publish(self.time, (*self.car.position, self.car.angle, self.car.velocity),
+                                   self.sensors, self.controller, error,
+                                   (sensed - start, time.perf_counter() - sensed))
+        self.controller.update(dt=self.dt)
+        previous_position = tuple(self.car.position)
+        self.car.move(self.dt)
+        self.time += self.dt
+        if self.lap_timer is not None:
+            self.lap_timer.update(previous_position, self.car.position, self.time - self.dt, self.time)
+
+    @property
+    def crashed(self):
+        """Whether the car center is on the wall or out of the map."""
+        x, y = self.car.position
+        if not (0 <= x < self.map.width and 0 <= y < self.map.height):
+            return True
+        return bool(self.map.wall_mask[int(x), int(y)])
+
+    def run(self, duration: float, stop_on_crash: bool = True) -> SimulationResult:
+        ticks = int(round(duration / self.dt))
+        times = np.empty(ticks)
+        trajectory = np.empty((ticks, 4))
+        controls = np.empty((ticks, 3))
+        crashed = False
+        start = time.perf_counter()
+        for tick in range(ticks):
+            self.step()
+            times[tick] = self.time
+            trajectory[tick] = (*self.car.position, self.car.angle, self.car.velocity)
+            controls[tick] = (self.controller.gas, self.controller.brake, self.controller.steer)
+            if self.crashed:
+                crashed = True
+                if stop_on_crash:
+                    ticks = tick + 1
+                    break
+        wall_time = time.perf_counter() - start
+        timer = self.lap_timer
+        return SimulationResult(times[:ticks], trajectory[:ticks], controls[:ticks],
+                                crashed, self.errors, wall_time,
+                                lap_times=timer.lap_times() if timer else [],
+                                sector_times=timer.sector_times() if timer else [],
+                                track_score=timer.score() if timer else None)
+
+if __name__ == '__main__':
+    import sys
+    from map import green_wall_mask
+    from fuzzy_car_controller import FuzzyCarController
+
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 60
+    recorder = TraceRecorder(sys.argv[2], DEFAULT_SENSORS) if len(sys.argv) > 2 else None
+    map = Map('maps/1.png', 1000, 900, wall_mask_function=green_wall_mask)
+    def controller_factory(car: Car):
+        controller = FuzzyCarController(car)
+        controller.compile_inference_engine()
+        return controller
+    result = Simulation(map, controller_factory, recorder=recorder).run(duration)
+    if recorder is not None:
+        recorder.close()
+    print(result.summary())
@@ -0,0 +1,49 @@
+"""
+`skfuzzy.control` imports its `visualization` module, used only by `view` methods of fuzzy
+variables, terms and systems, which loads `matplotlib.pyplot` (about half of the `skfuzzy.control`
+import time). Modules importing `skfuzzy.control` replace it by stand-in first, loading the real
+module only when it is first used, so headless runs never load the plotting libraries.
+"""
+
+import importlib.util
+import os
+import sys
+import types
+
+VISUALIZATION_MODULE = 'skfuzzy.control.visualization'
+
+def _load_visualization() -> types.ModuleType:
+    module = sys.modules.get(VISUALIZATION_MODULE)
+    if module is not None and not getattr(module, '_deferred', False):
+        return module
+    package = importlib.util.find_spec('skfuzzy')
+    path = os.path.join(package.submodule_search_locations[0], 'control', 'visualization.py')
+    spec = importlib.util.spec_from_file_location(VISUALIZATION_MODULE, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[VISUALIZATION_MODULE] = module
+    spec.loader.exec_module(module)
+    return module
+
+class _DeferredClass(type):
+    """Stand-in for class of the visualization module, loading it when instantiated or inspected."""
+
+    def __call__(cls, *args, **kwargs):
+        return getattr(_load_visualization(), cls.__name__)(*args, **kwargs)
+
+    def __getattr__(cls, name):
+        return getattr(getattr(_load_visualization(), cls.__name__), name)
+
+def defer_skfuzzy_visualization():
+    """Replaces `skfuzzy.control.visualization` by stand-in, if `skfuzzy.control` wasn't imported yet."""
+    if 'skfuzzy.control' in sys.modules or VISUALIZATION_MODULE in sys.modules:
+        return
+    module = types.ModuleType(VISUALIZATION_MODULE, __doc__)
+    module._deferred = True
+    module.FuzzyVariableVisualizer = _DeferredClass('FuzzyVariableVisualizer', (), {})
+    module.ControlSystemVisualizer = _DeferredClass('ControlSystemVisualizer', (), {})
+    def __getattr__(name: str):
+        if name.startswith('__'): # looked up by the import system, not by the users of the module
+            raise AttributeError(name)
+        return getattr(_load_visualization(), name)
+    module.__getattr__ = __getattr__
+    sys.modules[VISUALIZATION_MODULE] = module
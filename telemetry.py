@@ -0,0 +1,269 @@
+"""
+Streaming of per-tick telemetry over local socket (TCP `host:port`, or Unix socket path),
+for external dashboards watching the game or long headless runs live.
+
+The publisher listens for consumers; each of them first gets header message (JSON with the
+records dtype, sensors names and inputs and stages labels), then messages with batches of
+fixed-width records (like in traces, see `recording.py`), one record per tick. Messages are
+prefixed by their length (4 bytes, little endian). Records are packed in the loop and queued
+into bounded queue, background thread sends them; if consumers are slow (or none connected),
+the oldest records are dropped, so the loop never waits for them.
+"""
+
+from collections import deque
+import json
+import math
+import os
+import select
+import socket
+import struct
+import threading
+import time
+from typing import Sequence
+import numpy as np
+
+from map import RayCastResult
+from car import CarController
+from sensors import SensorArray
+
+TELEMETRY_FORMAT = 'fuzzy-telemetry/1'
+TELEMETRY_STAGES = ('rays', 'controller_simulation') # timed stages of tick, like frame profiler ones
+_LENGTH = struct.Struct('<I')
+
+def telemetry_dtype(sensors_names: list[str], inputs_labels: list[str], stages: Sequence[str]):
+    """Record of single tick: car state before it, sensors distances, controller inputs and outputs for it."""
+    return np.dtype([
+        ('time', 'f8'), # s, at the start of the tick
+        ('x', 'f8'),
+        ('y', 'f8'),
+        ('angle', 'f8'), # radians
+        ('velocity', 'f8'),
+        ('sensors', 'f4', (len(sensors_names),)),
+        ('inputs', 'f8', (len(inputs_labels),)), # NaN if not computed
+        ('gas', 'f8'),
+        ('brake', 'f8'),
+        ('steer', 'f8'),
+        ('error', '?'), # controller simulation update failed, outputs fell back
+        ('stages', 'f4', (len(stages),)), # ms, NaN if not timed
+    ])
+
+def _struct_format(dtype: np.dtype) -> str:
+    """Format packing the same bytes as the (unaligned, little endian) record dtype."""
+    codes = {'f8': 'd', 'f4': 'f', 'b1': '?'}
+    format = '<'
+    for name in dtype.names:
+        field = dtype.fields[name][0]
+        base = field.base if field.subdtype else field
+        format += str(math.prod(field.shape) if field.shape else '') + codes[base.kind + str(base.itemsize)]
+    return format
+
+def parse_address(address: str) -> tuple[int, str | tuple[str, int]]:
+    """Socket family and address: `host:port` (host is localhost if empty) for TCP, path for Unix socket."""
+    host, _, port = address.rpartition(':')
+    if port.isdigit():
+        return socket.AF_INET, (host or 'localhost', int(port))
+    if not hasattr(socket, 'AF_UNIX'):
+        raise ValueError(f"Unix sockets are not supported here, use 'host:port' instead of '{address}'.")
+    return socket.AF_UNIX, address
+
+def _send_message(connection: socket.socket, payload: bytes):
+    connection.sendall(_LENGTH.pack(len(payload)) + payload)
+
+def _receive_exactly(connection: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size > 0:
+        chunk = connection.recv(min(size, 1 << 20))
+        if not chunk:
+            raise EOFError('Telemetry stream closed.')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+class TelemetryPublisher:
+    def __init__(self,
+                 address: str,
+                 sensor_array: SensorArray,
+                 inputs_labels: Sequence[str],
+                 stages: Sequence[str] = TELEMETRY_STAGES,
+                 queue_size: int = 1024,
+                 interval: float = 0.02):
+        """
+        Parameters
+        ----------
+        address : to listen on for consumers, `host:port` or Unix socket path
+        sensor_array : sensors which distances are published
+        inputs_labels : of controller inputs published (like `velocity` and features names)
+        stages : labels of tick stages timings published
+        queue_size : records kept for sending at most, the oldest are dropped beyond it
+        interval : s, of sending the queued records in batch
+        """
+        self.sensors_names = sensor_array.names
+        self.inputs_labels = list(inputs_labels)
+        self.stages = list(stages)
+        self.dtype = telemetry_dtype(self.sensors_names, self.inputs_labels, self.stages)
+        self.struct = struct.Struct(_struct_format(self.dtype))
+        assert self.struct.size == self.dtype.itemsize
+        self.header = json.dumps({'format': TELEMETRY_FORMAT,
+                                  'dtype': self.dtype.descr,
+                                  'sensors': self.sensors_names,
+                                  'inputs': self.inputs_labels,
+                                  'stages': self.stages}).encode()
+        self.queue: deque[bytes] = deque(maxlen=queue_size) # appending and popping are thread safe
+        self.interval = interval
+        self.published = 0
+        self.dropped = 0
+        self.sent = 0 # records, to all consumers
+
+        family, self.address = parse_address(address)
+        if family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address) # stale socket of previous run
+        self.server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(self.address)
+        self.server.listen()
+        self.consumers: list[socket.socket] = []
+        self.closing = False
+        self.thread = threading.Thread(target=self._run, name='telemetry', daemon=True)
+        self.thread.start()
+
+    def publish(self,
+                time: float,
+                car_state: tuple[float, float, float, float],
+                sensors: dict[str, RayCastResult],
+                controller: CarController,
+                error: bool = False,
+                timings: Sequence[float] = ()):
+        """
+        Queues record of the tick, with the car state (X, Y, angle, velocity) from before it,
+        controller inputs (its `last_inputs`, if any) and stages timings (s, ordered as `stages`).
+        """
+        inputs = getattr(controller, 'last_inputs', None) or {}
+        timings = [t * 1000 for t in timings] + [math.nan] * (len(self.stages) - len(timings))
+        record = self.struct.pack(time, *car_state,
+                                  *[sensors[name].distance for name in self.sensors_names],
+                                  *[inputs.get(label, math.nan) for label in self.inputs_labels],
+                                  controller.gas, controller.brake, controller.steer, error, *timings)
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(record)
+        self.published += 1
+
+    def _run(self):
+        while not self.closing:
+            readable, _, _ = select.select([self.server], [], [], self.interval)
+            if readable:
+                self._accept()
+            self._send()
+        self._send()
+
+    def _accept(self):
+        connection, _ = self.server.accept()
+        try:
+            if connection.family == socket.AF_INET:
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            _send_message(connection, self.header)
+            self.consumers.append(connection)
+        except OSError:
+            connection.close()
+
+    def _send(self):
+        # Without consumers, the recent records wait for the first one
+        if not self.consumers or not self.queue:
+            return
+        records = [self.queue.popleft() for _ in range(len(self.queue))]
+        payload = b''.join(records)
+        for connection in list(self.consumers):
+            try:
+                _send_message(connection, payload) # slow consumer blocks this thread only
+            except OSError:
+                self.consumers.remove(connection)
+                connection.close()
+        self.sent += len(records)
+
+    def close(self):
+        """Sends the queued records and stops listening."""
+        if self.closing:
+            return
+        self.closing = True
+        self.thread.join(timeout=1)
+        for connection in self.consumers:
+            connection.close()
+        self.server.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class TelemetryConsumer:
+    """Minimal consumer of the stream, like stand-in for dashboards."""
+
+    def __init__(self, address: str, timeout: float | None = 5.):
+        family, address = parse_address(address)
+        self.connection = socket.socket(family, socket.SOCK_STREAM)
+        self.connection.settimeout(timeout)
+        self.connection.connect(address)
+        info = json.loads(self._receive())
+        if info.get('format') != TELEMETRY_FORMAT:
+            raise ValueError(f"Unknown telemetry format '{info.get('format')}'.")
+        self.sensors_names: list[str] = info['sensors']
+        self.inputs_labels: list[str] = info['inputs']
+        self.stages: list[str] = info['stages']
+        self.dtype = np.dtype([tuple(field) for field in info['dtype']])
+
+    def _receive(self) -> bytes:
+        size, = _LENGTH.unpack(_receive_exactly(self.connection, _LENGTH.size))
+        return _receive_exactly(self.connection, size)
+
+    def receive(self) -> np.ndarray:
+        """Next batch of records (structured array), waits for it."""
+        return np.frombuffer(self._receive(), dtype=self.dtype)
+
+    def __iter__(self):
+        try:
+            while True:
+                yield self.receive()
+        except EOFError:
+            return
+
+    def close(self):
+        self.connection.close()
+
+if __name__ == '__main__':
+    import sys
+
+    # Stand-in consumer: prints rate of the records and the latest one each second
+    address = sys.argv[1] if len(sys.argv) > 1 else 'localhost:5555'
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0 # s, after each batch, like slow consumer
+    consumer = TelemetryConsumer(address, timeout=None)
+    print(f'Connected to {address}: sensors {consumer.sensors_names}, inputs {consumer.inputs_labels}, '
+          f'stages {consumer.stages}')
+    count = 0
+    last_time = None # simulated, to detect records dropped by the publisher
+    gaps = 0
+    start = report_time = time.perf_counter()
+    for records in consumer:
+        if records.size == 0:
+            continue
+        times = records['time']
+        if last_time is not None:
+            steps = np.diff(times, prepend=last_time)
+            gaps += int((steps > 1.5 * np.median(steps)).sum()) if steps.size > 1 else 0
+        last_time = times[-1]
+        count += records.size
+        now = time.perf_counter()
+        if now - report_time >= 1:
+            last = records[-1]
+            stages = ', '.join(f'{name} {ms:.2f} ms' for name, ms in zip(consumer.stages, last['stages']))
+            print(f'{count / (now - start):.0f} records/s, gaps {gaps}; t {last["time"]:.2f} s, '
+                  f'pose ({last["x"]:.0f}, {last["y"]:.0f}, {math.degrees(last["angle"]):.0f}°), '
+                  f'velocity {last["velocity"]:.1f}, gas {last["gas"]:.2f}, brake {last["brake"]:.2f}, '
+                  f'steer {last["steer"]:.2f}, error {bool(last["error"])}; {stages}')
+            report_time = now
+        if delay:
+            time.sleep(delay)
+    print(f'Stream closed after {count} records, gaps {gaps}')
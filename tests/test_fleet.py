@@ -0,0 +1,45 @@
+import numpy as np
+
+from car import Car, CarController
+from fleet import Fleet
+
+def random_fleet(count: int, seed: int = 0) -> Fleet:
+    rng = np.random.default_rng(seed)
+    fleet = Fleet(count, (0, 0))
+    fleet.positions = rng.uniform(0, 1000, (count, 2))
+    fleet.angles = rng.uniform(-np.pi, np.pi, count)
+    fleet.velocities = rng.uniform(-Car.MAX_VELOCITY_BACKWARD, Car.MAX_VELOCITY_FORWARD, count)
+    # Out of range controls (clipped), and some cars coasting or not steering
+    fleet.gas, fleet.brake, fleet.steer = rng.uniform(-1.5, 1.5, (3, count)) * (rng.random((3, count)) > 0.2)
+    return fleet
+
+def test_fleet_steps_like_cars():
+    dt = 1 / 60
+    fleet = random_fleet(200)
+    cars = [Car(position, angle) for position, angle in zip(fleet.positions.tolist(), fleet.angles.tolist())]
+    controllers = [CarController(car) for car in cars]
+    for car, controller, velocity, gas, brake, steer in zip(cars, controllers, fleet.velocities.tolist(),
+                                                            fleet.gas.tolist(), fleet.brake.tolist(), fleet.steer.tolist()):
+        car.velocity = velocity
+        controller.gas, controller.brake, controller.steer = gas, brake, steer
+
+    for _ in range(100):
+        fleet.step(dt)
+        for car, controller in zip(cars, controllers):
+            controller.update(dt=dt)
+            car.move(dt)
+    # Bit-identical, not just close
+    assert fleet.positions.tolist() == [car.position for car in cars]
+    assert fleet.angles.tolist() == [car.angle for car in cars]
+    assert fleet.velocities.tolist() == [car.velocity for car in cars]
+
+def test_inactive_cars_are_frozen():
+    fleet = random_fleet(50, seed=1)
+    fleet.active[::2] = False
+    positions, angles, velocities = fleet.positions.copy(), fleet.angles.copy(), fleet.velocities.copy()
+    for _ in range(10):
+        fleet.step(1 / 60)
+    assert (fleet.positions[::2] == positions[::2]).all()
+    assert (fleet.angles[::2] == angles[::2]).all()
+    assert (fleet.velocities[::2] == velocities[::2]).all()
+    assert (fleet.positions[1::2] != positions[1::2]).any(axis=1).all()
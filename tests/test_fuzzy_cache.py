@@ -0,0 +1,60 @@
+import pytest
+
+from car import Car
+from evaluation import random_candidates
+from fuzzy_cache import FuzzyInferenceCache
+from fuzzy_car_controller import FuzzyCarController, share_inference_caches
+
+def recording_compute(calls: list):
+    def compute(inputs):
+        calls.append(inputs)
+        return {'out': sum(inputs.values())}
+    return compute
+
+def test_lru_eviction_and_counters():
+    calls = []
+    compute = recording_compute(calls)
+    cache = FuzzyInferenceCache(max_size=2)
+    cache.lookup({'a': 1}, compute)
+    cache.lookup({'a': 2}, compute)
+    cache.lookup({'a': 1}, compute) # hit, so 2 is the least recently used now
+    cache.lookup({'a': 3}, compute) # evicts 2
+    assert list(cache.entries) == [(1,), (3,)]
+    cache.lookup({'a': 2}, compute) # computed again, evicts 1
+    assert list(cache.entries) == [(3,), (2,)]
+    assert [c['a'] for c in calls] == [1, 2, 3, 2]
+    assert cache.stats() == {'size': 2, 'hits': 1, 'misses': 4, 'evictions': 2, 'hit_rate': 0.2}
+    cache.clear()
+    assert cache.stats() == {'size': 0, 'hits': 0, 'misses': 0, 'evictions': 0, 'hit_rate': 0.}
+
+def test_outputs_computed_for_quantized_inputs():
+    calls = []
+    cache = FuzzyInferenceCache(resolution={'a': 5.})
+    outputs, quantized = cache.lookup({'a': 11.9, 'b': 2.4}, recording_compute(calls))
+    assert quantized == {'a': 10., 'b': 2.} # bucket centers, default step of 1 for other labels
+    assert calls == [quantized] and outputs == {'out': 12.}
+    outputs, quantized = cache.lookup({'a': 7.6, 'b': 1.6}, recording_compute(calls))
+    assert quantized == {'a': 10., 'b': 2.} and len(calls) == 1 and cache.hits == 1
+
+def test_failed_computations_not_cached():
+    cache = FuzzyInferenceCache()
+    def fail(inputs):
+        raise ValueError('failed')
+    with pytest.raises(ValueError):
+        cache.lookup({'a': 1}, fail)
+    assert len(cache) == 0 and cache.misses == 1
+
+def test_shared_only_by_the_same_rule_base():
+    cache = FuzzyInferenceCache()
+    cache.bind('rules')
+    cache.bind('rules')
+    with pytest.raises(ValueError):
+        cache.bind('other rules')
+
+    candidates = random_candidates(2)
+    controllers = [FuzzyCarController(Car((0, 0)), **candidates[i]) for i in (0, 0, 1)]
+    for controller in controllers:
+        controller.compile_inference('native')
+    caches = share_inference_caches(controllers)
+    assert len(caches) == 2
+    assert controllers[0].cache is controllers[1].cache is not controllers[2].cache
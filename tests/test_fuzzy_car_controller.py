@@ -0,0 +1,56 @@
+import logging
+import math
+import skfuzzy.control
+
+from map import RayCastResult
+from car import Car
+from fuzzy_car_controller import OUTPUT_LABELS, FuzzyCarController
+from sensors import DEFAULT_SENSORS
+
+def partial_rules(inputs, outputs):
+    """Steering rules only for balance to the left, so steer has no active rules for the right."""
+    velocity, balance, side, head = inputs
+    gas, brake, steer = outputs
+    c = skfuzzy.control
+    return [
+        c.Rule(balance['LEFT'] & side['CENTER'], steer['RIGHT']),
+        c.Rule(head['CLOSE'], (brake['HARD'], gas['NONE'])),
+        c.Rule(head['AWAY'] | velocity['SLOW'], (brake['NONE'], gas['HARD'])),
+    ]
+
+def sensors(distance: int = 50) -> dict[str, RayCastResult]:
+    return {sensor.name: RayCastResult((0, 0), (0, distance), sensor.angle, distance) for sensor in DEFAULT_SENSORS.sensors}
+
+def test_exact_outputs_with_inactive_rules_stay_exact():
+    controller = FuzzyCarController(Car((0, 0)), rules=partial_rules)
+    inputs = {'velocity': 50, 'balance': 150, 'side': 0, 'head': 50}
+    outputs = controller.compute_outputs(inputs)
+    assert math.isnan(outputs['steer'])
+
+    # Active outputs are the ones of `skfuzzy` itself, not of the native engine
+    simulation = skfuzzy.control.ControlSystemSimulation(controller.control_system)
+    for label, value in inputs.items():
+        simulation.input[label] = value
+    simulation.compute()
+    assert outputs['gas'] == simulation.output['gas']
+    assert outputs['brake'] == simulation.output['brake']
+
+def test_failed_simulation_logged_once_per_streak(monkeypatch, caplog):
+    controller = FuzzyCarController(Car((0, 0)), fallback_outputs={label: 0. for label in OUTPUT_LABELS})
+    def fail(inputs):
+        raise ValueError('broken simulation')
+    monkeypatch.setattr(controller, 'compute_simulation', fail)
+    with caplog.at_level(logging.WARNING, logger='fuzzy_car_controller'):
+        for _ in range(5):
+            controller.update_simulation(sensors())
+    assert controller.failed and controller.errors == 5
+    assert len(caplog.records) == 1
+    assert caplog.records[0].exc_info[1].args == ('broken simulation',)
+
+    monkeypatch.undo()
+    controller.update_simulation(sensors())
+    assert not controller.failed
+    monkeypatch.setattr(controller, 'compute_simulation', fail)
+    with caplog.at_level(logging.WARNING, logger='fuzzy_car_controller'):
+        controller.update_simulation(sensors())
+    assert len(caplog.records) == 2 # new streak
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import skfuzzy.control
+
+from car import Car
+from evaluation import random_candidates
+from fuzzy_car_controller import FuzzyCarController
+from fuzzy_inference import FuzzyInferenceEngine
+
+def random_inputs(controller: FuzzyCarController, engine: FuzzyInferenceEngine, count: int, seed: int = 0):
+    bounds = np.array([controller.input_bounds[label] for label in engine.input_labels])
+    return np.random.default_rng(seed).uniform(bounds[:, 0], bounds[:, 1], (count, len(bounds)))
+
+@pytest.mark.parametrize('candidate', random_candidates(3, seed=1, deviation=20), ids=['default', 'variant1', 'variant2'])
+def test_engine_matches_skfuzzy(candidate):
+    controller = FuzzyCarController(Car((0, 0)), **candidate)
+    engine = FuzzyInferenceEngine(controller.control_system)
+    inputs = random_inputs(controller, engine, 50)
+    outputs = engine.compute_array(inputs)
+
+    simulation = skfuzzy.control.ControlSystemSimulation(controller.control_system, cache=False)
+    for row, expected in zip(inputs, outputs):
+        for label, value in zip(engine.input_labels, row):
+            simulation.input[label] = value
+        simulation.compute()
+        # Outputs without active rules are left out by `skfuzzy`, NaN in the engine
+        actual = [simulation.output.get(label, np.nan) for label in engine.output_labels]
+        np.testing.assert_allclose(expected, actual, rtol=0, atol=1e-9)
+
+def test_engine_batch_matches_single():
+    controller = FuzzyCarController(Car((0, 0)))
+    engine = FuzzyInferenceEngine(controller.control_system)
+    inputs = random_inputs(controller, engine, 20)
+    batch = engine.compute_array(inputs)
+    for row, expected in zip(inputs, batch):
+        single = engine.compute(dict(zip(engine.input_labels, row.tolist())))
+        assert [single[label] for label in engine.output_labels] == expected.tolist()
+
+def test_inactive_outputs_are_nan():
+    def rules(inputs, outputs):
+        velocity, balance, side, head = inputs
+        gas, brake, steer = outputs
+        c = skfuzzy.control
+        return [c.Rule(balance['LEFT'] & velocity['SLOW'] & side['CENTER'], steer['RIGHT']),
+                c.Rule(head['CLOSE'], (brake['HARD'], gas['NONE'])),
+                c.Rule(head['AWAY'], (brake['NONE'], gas['HARD']))]
+    controller = FuzzyCarController(Car((0, 0)), rules=rules)
+    engine = FuzzyInferenceEngine(controller.control_system)
+    inputs = random_inputs(controller, engine, 200)
+    active = engine.active_outputs(inputs)
+    assert not active.all() and active.any()
+    assert (np.isnan(engine.compute_array(inputs)) == ~active).all()
@@ -0,0 +1,29 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_main(*arguments: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, 'main.py', *arguments], cwd=ROOT, capture_output=True, text=True,
+                          env={**os.environ, 'SDL_VIDEODRIVER': 'dummy'}, timeout=300)
+
+def test_bench_passes_leading_options(tmp_path):
+    output = tmp_path / 'results.json'
+    process = run_main('bench', '--min-time', '0.01', '--output', str(output), 'physics')
+    assert process.returncode == 0, process.stderr
+    results = json.loads(output.read_text())
+    assert results['min_time'] == 0.01
+    assert {r['name'] for r in results['results']} >= {'fleet_steps'}
+
+def test_bench_help():
+    process = run_main('bench', '--help')
+    assert process.returncode == 0, process.stderr
+    assert '--save-baseline' in process.stdout
+
+def test_controller_import_skips_pyplot():
+    code = "import fuzzy_car_controller, main, sys; print('matplotlib.pyplot' in sys.modules)"
+    process = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, timeout=300)
+    assert process.returncode == 0, process.stderr
+    assert process.stdout.splitlines()[-1] == 'False'
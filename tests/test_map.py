@@ -0,0 +1,66 @@
+import json
+import math
+import numpy as np
+import pygame
+import pytest
+
+from map import MAP_CACHE_HEADER_SIZE, MAP_CACHE_MAGIC, Map, green_wall_mask
+
+@pytest.fixture(scope='module')
+def map():
+    surface = pygame.Surface((100, 80)) # black road
+    surface.fill((0, 255, 0), pygame.Rect(60, 0, 40, 80)) # wall on the right
+    return Map(surface, 100, 80, wall_mask_function=green_wall_mask)
+
+@pytest.mark.parametrize('max_distance', [0, 1, 50])
+def test_cast_rays_match_stepping(map, max_distance):
+    angles = np.linspace(0, 2 * math.pi, 16, endpoint=False)
+    expected = [map.cast_ray_to_wall((20, 40), angle, max_distance) for angle in angles]
+    for cast in (map.cast_rays_arrays, map.trace_rays_arrays):
+        distances, hits, hit_xs, _ = cast(20, 40, angles, max_distance)
+        assert distances.tolist() == [result.distance for result in expected]
+        assert hits.tolist() == [result.hit for result in expected]
+        assert np.allclose(hit_xs[hits], [result.hit_position[0] for result in expected if result.hit])
+
+def test_cast_rays_zero_distance_misses(map):
+    xs = np.full((3, 4), 59.5)
+    distances, hits, hit_xs, hit_ys = map.cast_rays_arrays(xs, 40, np.full((3, 4), math.pi / 2), 0)
+    assert distances.shape == hits.shape == hit_xs.shape == hit_ys.shape == (3, 4)
+    assert (distances == 0).all() and not hits.any()
+
+def damage_truncated_header(data: bytes) -> bytes:
+    return data[:len(MAP_CACHE_MAGIC) + 10]
+
+def damage_corrupted_header(data: bytes) -> bytes:
+    return MAP_CACHE_MAGIC + b'\xff\xfe' + data[len(MAP_CACHE_MAGIC) + 2:]
+
+def damage_header_not_object(data: bytes) -> bytes:
+    return (MAP_CACHE_MAGIC + b'[1]').ljust(MAP_CACHE_HEADER_SIZE) + data[MAP_CACHE_HEADER_SIZE:]
+
+def damage_header_without_arrays(data: bytes) -> bytes:
+    header = json.loads(data[len(MAP_CACHE_MAGIC):MAP_CACHE_HEADER_SIZE].decode())
+    del header['arrays']
+    return (MAP_CACHE_MAGIC + json.dumps(header).encode()).ljust(MAP_CACHE_HEADER_SIZE) + data[MAP_CACHE_HEADER_SIZE:]
+
+def damage_truncated_data(data: bytes) -> bytes:
+    return data[:MAP_CACHE_HEADER_SIZE + 100]
+
+@pytest.mark.parametrize('damage', [damage_truncated_header, damage_corrupted_header, damage_header_not_object,
+                                    damage_header_without_arrays, damage_truncated_data])
+def test_damaged_cache_is_rebuilt(tmp_path, monkeypatch, damage):
+    surface = pygame.Surface((100, 80))
+    surface.fill((255, 255, 255))
+    surface.fill((0, 255, 0), pygame.Rect(60, 0, 40, 80))
+    image_path = str(tmp_path / 'map.png')
+    pygame.image.save(surface, image_path)
+    expected = Map(image_path, 100, 80, wall_mask_function=green_wall_mask).wall_mask.copy()
+    cache_path = Map.cache_path_for_image(image_path, 100, 80)
+    with open(cache_path, 'rb') as file:
+        data = file.read()
+    with open(cache_path, 'wb') as file:
+        file.write(damage(data))
+
+    assert (Map(image_path, 100, 80, wall_mask_function=green_wall_mask).wall_mask == expected).all()
+    # Rebuilt cache is written again, the image isn't needed for next loads
+    monkeypatch.setattr(pygame.image, 'load', lambda *args: pytest.fail('map not loaded from the cache'))
+    assert (Map(image_path, 100, 80, wall_mask_function=green_wall_mask).wall_mask == expected).all()
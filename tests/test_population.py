@@ -0,0 +1,22 @@
+import pytest
+
+from evaluation import evaluate_candidate, load_map, random_candidates, score
+from population import FuzzyPopulation, PopulationSimulation
+
+def test_population_matches_separate_simulations():
+    map = load_map()
+    candidates = random_candidates(6, deviation=10)
+    result = PopulationSimulation(map, FuzzyPopulation([c.get('parameters') for c in candidates])).run(8)
+    separate = [evaluate_candidate(map, candidate, 8) for candidate in candidates]
+    assert any(r.crashed for r in separate) and not all(r.crashed for r in separate)
+    assert result.scores.tolist() == [score(r) for r in separate]
+    # Same paths, distances only summed in different order
+    assert result.distances.tolist() == pytest.approx([r.distance for r in separate], rel=1e-12)
+    assert result.crashed.tolist() == [r.crashed for r in separate]
+    assert result.errors.tolist() == [r.errors for r in separate]
+
+def test_members_must_have_the_same_terms():
+    with pytest.raises(ValueError):
+        FuzzyPopulation([None, {'velocity': {'CRAWL': [0, 1, 2]}}])
+    with pytest.raises(ValueError):
+        FuzzyPopulation([])
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from race import SpatialGrid
+
+def brute_force_pairs(positions: np.ndarray, radius: float, sources) -> set[tuple[int, int]]:
+    d = positions[:, None] - positions[None]
+    within = (d * d).sum(axis=2) <= radius * radius
+    return {(i, j) for i in sources for j in np.flatnonzero(within[i]).tolist() if i != j}
+
+@pytest.mark.parametrize('radius', [5., 10., 20.])
+def test_pairs_match_brute_force(radius):
+    rng = np.random.default_rng(0)
+    # Negative coordinates, clusters and duplicate points too
+    positions = np.concatenate([rng.uniform(-100, 300, (300, 2)), rng.normal(50, 5, (50, 2)), np.full((3, 2), 7.)])
+    grid = SpatialGrid(20.)
+    grid.build(positions)
+    i, j = grid.pairs(radius)
+    pairs = set(zip(i.tolist(), j.tolist()))
+    assert len(pairs) == i.size # no duplicates
+    assert pairs == brute_force_pairs(positions, radius, range(len(positions)))
+
+    sources = rng.choice(len(positions), 40, replace=False)
+    i, j = grid.pairs(radius, sources)
+    assert set(zip(i.tolist(), j.tolist())) == brute_force_pairs(positions, radius, sources.tolist())
+
+def test_grid_rebuilt_and_empty():
+    grid = SpatialGrid(10.)
+    assert [a.size for a in grid.pairs(10.)] == [0, 0]
+    grid.build(np.array([[0., 0.], [3., 4.]]))
+    assert sorted(zip(*[a.tolist() for a in grid.pairs(5.)])) == [(0, 1), (1, 0)]
+    grid.build(np.array([[0., 0.], [30., 40.]]))
+    assert [a.size for a in grid.pairs(10.)] == [0, 0]
+
+def test_radius_over_cell_size_raises():
+    grid = SpatialGrid(10.)
+    with pytest.raises(ValueError):
+        grid.pairs(11.)
@@ -0,0 +1,48 @@
+import numpy as np
+import pygame
+import skfuzzy.control
+
+from map import Map, green_wall_mask
+from car import Car
+from fuzzy_car_controller import FuzzyCarController
+from recording import Trace, TraceRecorder, replay
+from simulation import Simulation
+from sensors import DEFAULT_SENSORS
+
+def partial_rules(inputs, outputs):
+    """Steering rules only for balance to the left or centered far from walls, so steer falls back otherwise."""
+    velocity, balance, side, head = inputs
+    gas, brake, steer = outputs
+    c = skfuzzy.control
+    return [
+        c.Rule(balance['LEFT'], steer['RIGHT']),
+        c.Rule(head['AWAY'] & balance['CENTER'], steer['NONE']),
+        c.Rule(head['CLOSE'], (brake['HARD'], gas['NONE'])),
+        c.Rule(head['AWAY'] | velocity['SLOW'], (brake['NONE'], gas['HARD'])),
+    ]
+
+def controller_factory(car: Car) -> FuzzyCarController:
+    controller = FuzzyCarController(car, rules=partial_rules)
+    controller.compile_inference('native')
+    return controller
+
+def test_replay_from_any_tick_matches(tmp_path):
+    surface = pygame.Surface((400, 300))
+    surface.fill((0, 255, 0))
+    surface.fill((0, 0, 0), pygame.Rect(20, 60, 360, 220)) # road, off center
+    map = Map(surface, 400, 300, wall_mask_function=green_wall_mask)
+    path = str(tmp_path / 'run.trace')
+    with TraceRecorder(path, DEFAULT_SENSORS) as recorder:
+        simulation = Simulation(map, controller_factory, recorder=recorder)
+        for _ in range(600):
+            simulation.step()
+            if simulation.crashed:
+                break
+    trace = Trace(path)
+    errors = trace.records['error']
+    assert 0 < errors.sum() < len(trace) - 1
+
+    # Ticks right after streaks of failures start or end, and few others
+    changes = np.flatnonzero(errors[1:] != errors[:-1]) + 1
+    for start in [0, 1, *changes[:6].tolist(), len(trace) - 1]:
+        assert replay(trace, controller_factory(Car((0, 0))), start) is None, start
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from track import LapTimer, Track
+
+# Vertical gates at X of 10 and 20, finish line at 30, all spanning Y from 0 to 10
+TRACK = Track((0, 5), 0, [((10, 0), (10, 10)), ((20, 0), (20, 10)), ((30, 0), (30, 10))])
+
+def drive(timer: LapTimer, path, start_time: float = 0, dt: float = 1):
+    """Moves the cars along path (positions for each tick, shape (ticks, cars, 2)), returns the final time."""
+    time = start_time
+    for previous, position in zip(path[:-1], path[1:]):
+        timer.update(previous, position, time, time + dt)
+        time += dt
+    return time
+
+def lap(offset: float = 0.5):
+    """Positions along the gates (1 per tick), then back to the start around them (outside of their span)."""
+    there = [(x + offset, 5) for x in range(35)]
+    back = [(34 + offset, 20), (offset, 20), (offset, 5)]
+    return there + back
+
+def test_lap_and_sector_times():
+    timer = LapTimer(TRACK)
+    path = np.array(lap() + lap()[1:])[:, None]
+    drive(timer, path)
+    # Crossings interpolated within ticks: X of 10 is crossed half way between 9.5 and 10.5
+    assert timer.crossings[0] == pytest.approx([9.5, 19.5, 29.5, 46.5, 56.5, 66.5])
+    assert timer.sector_times() == pytest.approx([9.5, 10, 10, 17, 10, 10])
+    assert timer.lap_times() == pytest.approx([29.5, 37])
+    assert timer.laps() == 2
+    assert timer.best_lap_time() == pytest.approx(29.5)
+
+def test_gates_count_only_in_order():
+    timer = LapTimer(TRACK)
+    # Crossing the second gate first doesn't count, nor does the finish line
+    drive(timer, np.array([(x, 5) for x in (15, 25, 35)])[:, None])
+    assert timer.gates_passed.tolist() == [0] and timer.crossings == [[]]
+    drive(timer, np.array([(35, 20), (5, 20), (5, 5), (15, 5)])[:, None], start_time=2)
+    assert timer.gates_passed.tolist() == [1]
+    assert timer.next_gate.tolist() == [1]
+
+def test_cars_timed_from_own_start_and_scored():
+    timer = LapTimer(TRACK, count=3)
+    timer.start([1], 5.)
+    path = np.array([[(x + 0.5, 5), (x + 0.5, 5), (min(x, 15) + 0.5, 5)] for x in range(35)])
+    drive(timer, path)
+    assert timer.lap_times(0) == pytest.approx([29.5])
+    assert timer.lap_times(1) == pytest.approx([24.5]) # same crossing, started later
+    assert timer.lap_times(2) == []
+    scores = timer.scores()
+    # More gates passed first, ties broken by earlier last crossing (relative to own start)
+    assert scores[1] > scores[0] > scores[2]
+    assert int(scores[2]) == 1
@@ -0,0 +1,112 @@
+"""
+Track definition (start pose, checkpoints gates and finish line) and lap timing.
+
+Track is read from JSON file next to the map image (like `maps/1.json` for `maps/1.png`),
+in the original image coordinates and angle in degrees. Gates have to be passed in order,
+with the finish line being the last gate of each lap; sectors are between the gates.
+"""
+
+from dataclasses import dataclass
+import json
+import math
+import os
+import numpy as np
+
+from map import Coordinate
+
+Segment = tuple[Coordinate, Coordinate]
+
+@dataclass
+class Track:
+    start_position: Coordinate
+    start_angle: float # radians
+    gates: list[Segment] # checkpoints in order, then the finish line
+
+    @staticmethod
+    def path_for_image(image_path: str):
+        return os.path.splitext(image_path)[0] + '.json'
+
+    @classmethod
+    def load(cls, path: str, scale: float = 1):
+        with open(path) as file:
+            data = json.load(file)
+        def scaled(point):
+            return (point[0] * scale, point[1] * scale)
+        return cls(start_position=scaled(data['start']['position']),
+                   start_angle=math.radians(data['start']['angle']),
+                   gates=[(scaled(a), scaled(b)) for a, b in data.get('checkpoints', []) + [data['finish']]])
+
+class LapTimer:
+    """
+    Tracks gates crossings for number of cars at once. Each tick, only the next gate
+    for each car is checked against its movement segment, so it's O(1) per car.
+    Cars can start at different times (see `start`), all are timed from their own start.
+    """
+
+    def __init__(self, track: Track, count: int = 1, start_time: float = 0):
+        self.track = track
+        self.gates = np.array(track.gates, dtype=np.float64) # shape (gates, 2 points, 2)
+        self.start_time = start_time
+        self.start_times = np.full(count, float(start_time))
+        self.next_gate = np.zeros(count, dtype=np.intp)
+        self.gates_passed = np.zeros(count, dtype=np.intp)
+        self.last_crossing_time = np.full(count, float(start_time))
+        self.crossings: list[list[float]] = [[] for _ in range(count)] # times of all gates crossings
+
+    def start(self, cars, time: float):
+        """Restarts timing of the cars (indices) at given time, like when released later than others."""
+        self.start_times[cars] = time
+        self.last_crossing_time[cars] = time
+
+    def update(self, previous_positions, positions, previous_time: float, time: float):
+        """
+        Checks movements of the cars during the tick (arrays of shape (N, 2)).
+        Returns indices of cars which crossed their next gate.
+        """
+        p = np.asarray(previous_positions, dtype=np.float64).reshape(-1, 2)
+        r = np.asarray(positions, dtype=np.float64).reshape(-1, 2) - p
+        a = self.gates[self.next_gate, 0]
+        s = self.gates[self.next_gate, 1] - a
+
+        # Segments p + t * r and a + u * s intersect for 0 <= t, u <= 1
+        denominator = r[:, 0] * s[:, 1] - r[:, 1] * s[:, 0]
+        d = a - p
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (d[:, 0] * s[:, 1] - d[:, 1] * s[:, 0]) / denominator
+            u = (d[:, 0] * r[:, 1] - d[:, 1] * r[:, 0]) / denominator
+        crossed = (denominator != 0) & (0 <= t) & (t <= 1) & (0 <= u) & (u <= 1)
+
+        indices = np.nonzero(crossed)[0]
+        times = previous_time + t[indices] * (time - previous_time)
+        for i, crossing_time in zip(indices.tolist(), times.tolist()):
+            self.crossings[i].append(crossing_time)
+        self.last_crossing_time[indices] = times
+        self.gates_passed[indices] += 1
+        self.next_gate[indices] = (self.next_gate[indices] + 1) % len(self.gates)
+        return indices
+
+    def sector_times(self, car: int = 0) -> list[float]:
+        """Times of all passed sectors, in order."""
+        return np.diff([self.start_times[car]] + self.crossings[car]).tolist()
+
+    def lap_times(self, car: int = 0) -> list[float]:
+        """Times of completed laps."""
+        finishes = self.crossings[car][len(self.gates) - 1::len(self.gates)]
+        return np.diff([self.start_times[car]] + finishes).tolist()
+
+    def laps(self, car: int = 0) -> int:
+        return int(self.gates_passed[car]) // len(self.gates)
+
+    def best_lap_time(self, car: int = 0) -> float | None:
+        times = self.lap_times(car)
+        return min(times) if times else None
+
+    def scores(self) -> np.ndarray:
+        """
+        Scores of the whole run for each car: count of gates passed,
+        with ties broken by earlier time of passing the last one.
+        """
+        return self.gates_passed + 1 / (1 + self.last_crossing_time - self.start_times)
+
+    def score(self, car: int = 0) -> float:
+        return float(self.scores()[car])
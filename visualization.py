@@ -8,6 +8,9 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.axes import Axes
 from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+from matplotlib.patches import Polygon
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from skfuzzy.fuzzymath.fuzzy_ops import interp_membership
 from skfuzzy.control.fuzzyvariable import FuzzyVariable, Term
 from skfuzzy.control.controlsystem import CrispValueCalculator, ControlSystem, ControlSystemSimulation
@@ -42,6 +45,8 @@ class MyFuzzyVariableVisualizer(object):
             self.fig, self.ax = plt.subplots()
 
         self.plots = {}
+        self.cut_patches: dict[str, Polygon] = {}
+        self.crisp_line: Line2D | None = None
 
     def view(self, sim=None, *args, **kwargs):
         """
@@ -70,8 +75,7 @@ class MyFuzzyVariableVisualizer(object):
 
         self._init_plot()
 
-        crispy = CrispValueCalculator(self.fuzzy_var, sim)
-        ups_universe, output_mf, cut_mfs = crispy.find_memberships()
+        ups_universe, output_mf, cut_mfs = self._find_memberships(sim)
 
         # Plot the output membership functions
         cut_plots = {}
@@ -88,37 +92,85 @@ class MyFuzzyVariableVisualizer(object):
                     facecolor=color, alpha=0.4)
 
         # Plot crisp value if available
-        if len(cut_mfs) > 0 and not all(output_mf == 0):
-            crisp_value = None
-            if hasattr(self.fuzzy_var, 'input'):
-                crisp_value = self.fuzzy_var.input[sim]
-            elif hasattr(self.fuzzy_var, 'output'):
-                crisp_value = self.fuzzy_var.output[sim]
-
-            # Draw the crisp value at the actual cut height
-            if crisp_value is not None:
-                y = 0.
-                for key, term in self.fuzzy_var.terms.items():
-                    if key in cut_mfs:
-                        y = max(y, interp_membership(self.fuzzy_var.universe,
-                                                     term.mf, crisp_value))
-
-                # Small cut values are hard to see, so simply set them to 1
-                if y < 0.1:
-                    y = 1.
-
-                self.ax.plot([crisp_value] * 2, [0, y],
-                             color='k', lw=3, label='crisp value')
+        crisp_value, y = self._find_crisp_line(sim, output_mf, cut_mfs)
+        if crisp_value is not None:
+            self.ax.plot([crisp_value] * 2, [0, y],
+                         color='k', lw=3, label='crisp value')
 
         return self.fig, self.ax
 
+    def init_animated(self):
+        """
+        Draws the static parts of the plot (membership functions, legend, axes)
+        once, and prepares animated artists for the cuts and the crisp value,
+        to be updated by `update` and drawn by `FigureBlitter`.
+        """
+        self._init_plot()
+        self.cut_patches = {}
+        for label, mf_plot in self.plots.items():
+            patch = Polygon(np.zeros((0, 2)), closed=True, facecolor=mf_plot[0].get_color(),
+                            edgecolor='none', alpha=0.4, animated=True, visible=False)
+            self.cut_patches[label] = self.ax.add_patch(patch)
+        self.crisp_line, = self.ax.plot([], [], color='k', lw=3, animated=True, visible=False)
+
+    def update(self, sim: ControlSystemSimulation):
+        """Updates animated artists data for current state of the simulation, returns them."""
+        ups_universe, output_mf, cut_mfs = self._find_memberships(sim)
+
+        for label, patch in self.cut_patches.items():
+            if label in cut_mfs:
+                # Same shape as `fill_between` creates: along the cut, then back along zero
+                xy = np.empty((2 * ups_universe.size, 2))
+                xy[:ups_universe.size, 0] = ups_universe
+                xy[:ups_universe.size, 1] = cut_mfs[label]
+                xy[ups_universe.size:, 0] = ups_universe[::-1]
+                xy[ups_universe.size:, 1] = 0
+                patch.set_xy(xy)
+                patch.set_visible(True)
+            else:
+                patch.set_visible(False)
+
+        crisp_value, y = self._find_crisp_line(sim, output_mf, cut_mfs)
+        if crisp_value is not None:
+            self.crisp_line.set_data([crisp_value] * 2, [0, y])
+            self.crisp_line.set_visible(True)
+        else:
+            self.crisp_line.set_visible(False)
+
+        return [*self.cut_patches.values(), self.crisp_line]
+
+    def _find_memberships(self, sim: ControlSystemSimulation):
+        crispy = CrispValueCalculator(self.fuzzy_var, sim)
+        return crispy.find_memberships()
+
+    def _find_crisp_line(self, sim: ControlSystemSimulation, output_mf, cut_mfs):
+        """Returns crisp value and height of the line to draw for it, or nones if not available."""
+        if len(cut_mfs) == 0 or all(output_mf == 0):
+            return None, None
+
+        crisp_value = None
+        if hasattr(self.fuzzy_var, 'input'):
+            crisp_value = self.fuzzy_var.input[sim]
+        elif hasattr(self.fuzzy_var, 'output'):
+            crisp_value = self.fuzzy_var.output[sim]
+        if crisp_value is None:
+            return None, None
+
+        # Draw the crisp value at the actual cut height
+        y = 0.
+        for key, term in self.fuzzy_var.terms.items():
+            if key in cut_mfs:
+                y = max(y, interp_membership(self.fuzzy_var.universe,
+                                             term.mf, crisp_value))
+
+        # Small cut values are hard to see, so simply set them to 1
+        if y < 0.1:
+            y = 1.
+        return crisp_value, y
+
     def _init_plot(self):
         self.ax.clear()
 
-        # start = time.time()
-        # end = time.time()
-        # print((end - start))
-        
         # Formatting: limits
         self.ax.set_ylim([0, 1.01])
         self.ax.set_xlim([self.fuzzy_var.universe.min(),
@@ -152,3 +204,38 @@ class MyFuzzyVariableVisualizer(object):
         self.ax.set_ylabel('Membership')
         self.ax.set_xlabel(self.fuzzy_var.label)
 
+
+
+class FigureBlitter(object):
+    """
+    Incremental rendering of the figure with fuzzy variables visualizers:
+    static background is rendered once and cached, then each frame it is restored
+    and only animated artists (cuts and crisp values) are drawn over it, 
+    into the single Agg canvas and its buffer.
+    """
+
+    def __init__(self, fig: Figure, visualizers: list[MyFuzzyVariableVisualizer]):
+        self.fig = fig
+        self.visualizers = visualizers
+        self.canvas = FigureCanvasAgg(fig)
+        for v in self.visualizers:
+            v.init_animated()
+        self.canvas.draw() # animated artists are skipped
+        self.background = self.canvas.copy_from_bbox(fig.bbox)
+
+    @property
+    def size(self) -> tuple[int, int]:
+        width, height = self.canvas.get_width_height()
+        return width, height
+
+    def update(self, sim: ControlSystemSimulation):
+        """
+        Redraws animated artists for current state of the simulation.
+        Returns RGBA buffer of the canvas, the same one each time.
+        """
+        self.canvas.restore_region(self.background)
+        for v in self.visualizers:
+            for artist in v.update(sim):
+                if artist.get_visible():
+                    v.ax.draw_artist(artist)
+        return self.canvas.buffer_rgba()